@@ -10,9 +10,9 @@ import logging
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
@@ -25,6 +25,7 @@ from services.answer_sheet_processing_pipeline import (
     ProcessingStage,
     ProcessingStatus
 )
+from services.batch_job_runner import batch_job_runner, ItemSummary
 from utils.file_security import FileSecurityValidator
 from config.settings import settings
 
@@ -34,6 +35,19 @@ logger = logging.getLogger(__name__)
 # 文件安全验证器
 security_validator = FileSecurityValidator()
 
+# 批处理任务类型
+ANSWER_SHEET_JOB_TYPE = "answer_sheet_pipeline"
+
+# 处理管道最终阶段 -> 条目状态
+ITEM_STATUS_BY_STAGE = {
+    ProcessingStage.COMPLETED: 'completed',
+    ProcessingStage.MANUAL_REVIEW: 'review',
+    ProcessingStage.ERROR: 'failed'
+}
+
+# 分数段（按百分制）
+SCORE_BUCKETS = [('90-100', 90), ('80-89', 80), ('70-79', 70), ('60-69', 60), ('below_60', 0)]
+
 @router.post("/answer-sheets")
 async def batch_upload_answer_sheets(
     exam_id: str = Form(...),
@@ -41,7 +55,6 @@ async def batch_upload_answer_sheets(
     processing_config: Optional[str] = Form(None),
     auto_process: bool = Form(True),
     max_concurrent: int = Form(3),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -54,7 +67,6 @@ async def batch_upload_answer_sheets(
         processing_config: 处理配置JSON字符串
         auto_process: 是否自动处理
         max_concurrent: 最大并发处理数
-        background_tasks: 后台任务
         current_user: 当前用户
         db: 数据库连接
     
@@ -81,7 +93,7 @@ async def batch_upload_answer_sheets(
         # 创建上传批次ID
         batch_id = str(uuid.uuid4())
         upload_results = []
-        processing_contexts = []
+        item_payloads = []
         
         # 创建存储目录
         storage_dir = Path(settings.STORAGE_BASE_PATH) / "answer_sheets" / exam_id
@@ -110,12 +122,12 @@ async def batch_upload_answer_sheets(
                     content = await file.read()
                     buffer.write(content)
                 
-                # 创建处理上下文
-                context = AnswerSheetProcessingContext(
-                    sheet_id=file_id,
-                    file_path=str(file_path),
-                    exam_id=exam_id,
-                    metadata={
+                # 记录处理条目（处理时重建处理上下文）
+                item_payloads.append({
+                    'sheet_id': file_id,
+                    'file_path': str(file_path),
+                    'exam_id': exam_id,
+                    'metadata': {
                         'original_filename': file.filename,
                         'file_size': len(content),
                         'mime_type': validation_result['mime_type'],
@@ -123,9 +135,7 @@ async def batch_upload_answer_sheets(
                         'upload_user_id': current_user.id,
                         'upload_time': datetime.now().isoformat()
                     }
-                )
-                
-                processing_contexts.append(context)
+                })
                 
                 upload_result = {
                     'sheet_id': file_id,
@@ -166,17 +176,22 @@ async def batch_upload_answer_sheets(
             'processing_status': 'pending' if auto_process else 'manual'
         }
         
-        # 如果启用自动处理，添加到后台任务队列
-        if auto_process and processing_contexts:
-            background_tasks.add_task(
-                process_batch_in_background,
-                processing_contexts,
-                config,
-                max_concurrent,
-                batch_id
+        # 持久化批处理任务；自动处理时立即排队，否则等待 process-batch 启动
+        if item_payloads:
+            batch_job_runner.create_job(
+                db,
+                ANSWER_SHEET_JOB_TYPE,
+                item_payloads,
+                config={**config, 'max_concurrent': max_concurrent},
+                job_id=batch_id,
+                exam_id=exam_id,
+                created_by=current_user.id,
+                enqueue=auto_process
             )
-            response_data['processing_status'] = 'started'
-            response_data['estimated_processing_time'] = len(processing_contexts) * 30  # 估算处理时间（秒）
+            if auto_process:
+                await batch_job_runner.start()
+                response_data['processing_status'] = 'started'
+                response_data['estimated_processing_time'] = len(item_payloads) * 30  # 估算处理时间（秒）
         
         logger.info(f"批量上传完成: 成功 {success_count}/{len(files)}, 批次ID: {batch_id}")
         
@@ -200,8 +215,8 @@ async def process_uploaded_batch(
     batch_id: str,
     processing_config: Optional[str] = Form(None),
     max_concurrent: int = Form(3),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """
     处理已上传的批次
@@ -210,14 +225,11 @@ async def process_uploaded_batch(
         batch_id: 批次ID
         processing_config: 处理配置
         max_concurrent: 最大并发数
-        background_tasks: 后台任务
         current_user: 当前用户
+        db: 数据库连接
     """
     
     try:
-        # TODO: 从数据库中获取批次信息和文件列表
-        # 这里使用简化逻辑，实际应该从数据库查询
-        
         # 解析处理配置
         config = {}
         if processing_config:
@@ -226,20 +238,14 @@ async def process_uploaded_batch(
             except json.JSONDecodeError:
                 raise HTTPException(status_code=400, detail="处理配置格式错误")
         
-        # TODO: 重新构建处理上下文列表
-        processing_contexts = []  # 从数据库获取
-        
-        if not processing_contexts:
+        job = batch_job_runner.enqueue_job(
+            db, batch_id, config={**config, 'max_concurrent': max_concurrent}
+        )
+        if job is None:
             raise HTTPException(status_code=404, detail="批次不存在或已处理")
         
-        # 启动后台处理
-        background_tasks.add_task(
-            process_batch_in_background,
-            processing_contexts,
-            config,
-            max_concurrent,
-            batch_id
-        )
+        # 启动处理节点（已启动时无副作用）
+        await batch_job_runner.start()
         
         return JSONResponse(
             status_code=200,
@@ -249,8 +255,8 @@ async def process_uploaded_batch(
                 'data': {
                     'batch_id': batch_id,
                     'processing_status': 'started',
-                    'file_count': len(processing_contexts),
-                    'estimated_processing_time': len(processing_contexts) * 30
+                    'file_count': job.total_items,
+                    'estimated_processing_time': job.total_items * 30
                 }
             }
         )
@@ -264,7 +270,8 @@ async def process_uploaded_batch(
 @router.get("/batch-status/{batch_id}")
 async def get_batch_processing_status(
     batch_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """
     获取批次处理状态
@@ -272,39 +279,40 @@ async def get_batch_processing_status(
     Args:
         batch_id: 批次ID
         current_user: 当前用户
+        db: 数据库连接
     """
     
     try:
-        # TODO: 从数据库或缓存中获取实际的批次状态
-        # 这里返回模拟数据
+        job = batch_job_runner.get_job(db, batch_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="批次不存在")
+        
+        counts = batch_job_runner.get_item_counts(db, batch_id)
+        finished_count = counts['completed'] + counts['review'] + counts['failed']
+        
+        # 已结束条目的最终阶段分布和错误分类（数据库聚合，不加载条目结果）
+        processing_stages = batch_job_runner.get_stage_counts(db, batch_id)
+        error_types = batch_job_runner.get_error_counts(db, batch_id)
+        
+        estimated_completion = batch_job_runner.estimate_completion(job, counts)
         
         batch_status = {
             'batch_id': batch_id,
-            'overall_status': 'processing',  # pending, processing, completed, failed
+            'overall_status': job.status,  # created, queued, processing, completed, failed
             'progress': {
-                'total_files': 10,
-                'completed_files': 6,
-                'processing_files': 2,
-                'failed_files': 1,
-                'pending_files': 1,
-                'completion_percentage': 60.0
+                'total_files': job.total_items,
+                'completed_files': counts['completed'],
+                'review_files': counts['review'],
+                'processing_files': counts['processing'],
+                'failed_files': counts['failed'],
+                'pending_files': counts['pending'],
+                'completion_percentage': finished_count / job.total_items * 100 if job.total_items else 0.0
             },
-            'processing_stages': {
-                ProcessingStage.UPLOADED.value: 10,
-                ProcessingStage.PREPROCESSING.value: 10,
-                ProcessingStage.STUDENT_INFO_RECOGNITION.value: 8,
-                ProcessingStage.QUESTION_SEGMENTATION.value: 7,
-                ProcessingStage.ANSWER_EXTRACTION.value: 6,
-                ProcessingStage.GRADING.value: 4,
-                ProcessingStage.QUALITY_CHECK.value: 3,
-                ProcessingStage.COMPLETED.value: 3
-            },
-            'estimated_completion_time': '2024-08-25T03:30:00Z',
+            'processing_stages': processing_stages,
+            'estimated_completion_time': estimated_completion.isoformat() if estimated_completion else None,
             'error_summary': {
-                'total_errors': 1,
-                'error_types': {
-                    'student_info_recognition_failed': 1
-                }
+                'total_errors': counts['failed'],
+                'error_types': error_types
             }
         }
         
@@ -316,6 +324,8 @@ async def get_batch_processing_status(
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取批次状态失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取状态失败: {str(e)}")
@@ -324,72 +334,64 @@ async def get_batch_processing_status(
 async def get_batch_processing_results(
     batch_id: str,
     include_details: bool = False,
-    current_user: User = Depends(get_current_user)
+    since: int = 0,
+    limit: int = 100,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """
     获取批次处理结果
     
+    批次处理过程中即可调用，返回已完成条目的结果。
+    include_details 时按完成顺序返回条目详情，将响应中的 next_since
+    作为下次请求的 since 参数即可只获取新完成的条目。
+    
     Args:
         batch_id: 批次ID
         include_details: 是否包含详细信息
+        since: 增量游标（上次响应的 next_since，即最后一个条目的完成序号）
+        limit: 单次返回的条目详情数量上限
         current_user: 当前用户
+        db: 数据库连接
     """
     
     try:
-        # TODO: 从数据库中获取实际的批次处理结果
+        job = batch_job_runner.get_job(db, batch_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="批次不存在")
+        
+        finished_count = job.completed_items + job.review_items + job.failed_items
         
         batch_results = {
             'batch_id': batch_id,
+            'overall_status': job.status,
+            'is_final': job.status in ('completed', 'failed'),
             'processing_summary': {
-                'total_files': 10,
-                'successfully_processed': 8,
-                'failed_processing': 2,
-                'needs_manual_review': 3,
-                'completion_rate': 80.0
-            },
-            'score_statistics': {
-                'total_students': 8,
-                'average_score': 82.5,
-                'highest_score': 95.0,
-                'lowest_score': 65.0,
-                'score_distribution': {
-                    '90-100': 2,
-                    '80-89': 3,
-                    '70-79': 2,
-                    '60-69': 1,
-                    'below_60': 0
-                }
+                'total_files': job.total_items,
+                'finished_files': finished_count,
+                'successfully_processed': job.completed_items,
+                'failed_processing': job.failed_items,
+                'needs_manual_review': job.review_items,
+                'completion_rate': job.completed_items / job.total_items * 100 if job.total_items else 0.0
             },
-            'quality_metrics': {
-                'average_confidence': 0.85,
-                'ocr_accuracy': 0.92,
-                'segmentation_quality': 0.88,
-                'grading_confidence': 0.83
-            }
+            'score_statistics': _score_statistics(db, batch_id),
+            'quality_metrics': _quality_metrics(db, batch_id)
         }
         
         if include_details:
-            # 添加每个文件的详细处理结果
+            detail_items = batch_job_runner.get_finished_items(db, batch_id, after_seq=since, limit=limit)
             batch_results['file_results'] = [
                 {
-                    'sheet_id': f'sheet_{i}',
-                    'original_filename': f'answer_sheet_{i}.jpg',
-                    'processing_stage': ProcessingStage.COMPLETED.value,
-                    'student_info': {
-                        'student_id': f'student_{i}',
-                        'name': f'学生{i}',
-                        'class': '高三1班'
-                    },
-                    'total_score': 85.0,
-                    'question_scores': [
-                        {'question_id': '1', 'score': 5.0, 'max_score': 5.0},
-                        {'question_id': '2', 'score': 4.5, 'max_score': 5.0},
-                        {'question_id': '3', 'score': 3.0, 'max_score': 5.0}
-                    ],
-                    'needs_review': False,
-                    'processing_time': 45.2
-                } for i in range(1, 9)
+                    **(item.result or {}),
+                    'sheet_id': (item.payload or {}).get('sheet_id'),
+                    'original_filename': (item.payload or {}).get('metadata', {}).get('original_filename'),
+                    'item_status': item.status,
+                    'error_message': item.error_message,
+                    'completed_at': item.completed_at.isoformat()
+                }
+                for item in detail_items
             ]
+            batch_results['next_since'] = detail_items[-1].finish_seq if detail_items else since
         
         return JSONResponse(
             status_code=200,
@@ -399,49 +401,124 @@ async def get_batch_processing_results(
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取批次结果失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取结果失败: {str(e)}")
 
-async def process_batch_in_background(
-    processing_contexts: List[AnswerSheetProcessingContext],
-    config: Dict[str, Any],
-    max_concurrent: int,
-    batch_id: str
-):
+def _score_statistics(db: Session, batch_id: str) -> Dict[str, Any]:
+    """已评分条目的分数统计"""
+    scores = batch_job_runner.get_metric_stats(db, batch_id, prefix='total_score').get('total_score')
+    if scores is None:
+        return {
+            'total_students': 0,
+            'average_score': None,
+            'highest_score': None,
+            'lowest_score': None,
+            'score_distribution': {name: 0 for name, _ in SCORE_BUCKETS}
+        }
+    
+    return {
+        'total_students': scores['count'],
+        'average_score': scores['avg'],
+        'highest_score': scores['max'],
+        'lowest_score': scores['min'],
+        'score_distribution': batch_job_runner.get_metric_histogram(
+            db, batch_id, 'score_percentage', SCORE_BUCKETS
+        )
+    }
+
+def _quality_metrics(db: Session, batch_id: str) -> Dict[str, Any]:
+    """各处理阶段的平均置信度"""
+    overall = batch_job_runner.get_metric_stats(db, batch_id, prefix='confidence').get('confidence')
+    stages = batch_job_runner.get_metric_stats(db, batch_id, prefix='stage_confidence.')
+    return {
+        'average_confidence': overall['avg'] if overall else None,
+        'stage_confidence': {
+            name[len('stage_confidence.'):]: stats['avg'] for name, stats in stages.items()
+        }
+    }
+
+def _summarize_context(context: AnswerSheetProcessingContext) -> Dict[str, Any]:
+    """处理上下文精简为可持久化的条目结果"""
+    stage_results = {result.stage: result for result in context.processing_results}
+    student_result = stage_results.get(ProcessingStage.STUDENT_INFO_RECOGNITION)
+    grading_result = stage_results.get(ProcessingStage.GRADING)
+    grading_data = grading_result.data if grading_result else {}
+    failed = [r for r in context.processing_results if r.status == ProcessingStatus.FAILED]
+    confidences = [r.confidence for r in context.processing_results]
+    
+    return {
+        'processing_stage': context.current_stage.value,
+        'failed_stage': failed[-1].stage.value if failed else None,
+        'student_info': student_result.data.get('extracted_info', {}) if student_result else {},
+        'total_score': grading_data.get('total_score'),
+        'max_total_score': grading_data.get('max_total_score'),
+        'question_scores': [
+            {
+                'question_id': graded['question_id'],
+                'score': graded['score'],
+                'max_score': graded['max_score']
+            }
+            for graded in grading_data.get('grading_results', [])
+        ],
+        'needs_review': any(r.needs_review for r in context.processing_results),
+        'confidence': sum(confidences) / len(confidences) if confidences else None,
+        'stage_confidence': {r.stage.value: r.confidence for r in context.processing_results},
+        'processing_time': sum(r.processing_time for r in context.processing_results),
+        'errors': [
+            {'stage': r.stage.value, 'error_message': r.error_message}
+            for r in failed if r.error_message
+        ]
+    }
+
+async def process_batch_item(
+    payload: Dict[str, Any],
+    config: Dict[str, Any]
+) -> Tuple[str, Dict[str, Any]]:
     """
-    后台处理批次任务
+    处理批次中的单张答题卡（由批处理执行器调用，可在任意处理节点上运行）
     
     Args:
-        processing_contexts: 处理上下文列表
-        config: 处理配置
-        max_concurrent: 最大并发数
-        batch_id: 批次ID
+        payload: 条目输入（sheet_id、file_path、exam_id、metadata）
+        config: 批次处理配置
+    
+    Returns:
+        (条目状态, 处理结果)
     """
     
-    try:
-        logger.info(f"开始后台处理批次: {batch_id}, 文件数: {len(processing_contexts)}")
-        
-        # 调用处理管道进行批量处理
-        results = await processing_pipeline.batch_process_answer_sheets(
-            contexts=processing_contexts,
-            processing_config=config,
-            max_concurrent=max_concurrent
-        )
-        
-        # 统计处理结果
-        success_count = len([r for r in results if r.current_stage == ProcessingStage.COMPLETED])
-        failed_count = len([r for r in results if r.current_stage == ProcessingStage.ERROR])
-        review_count = len([r for r in results if r.current_stage == ProcessingStage.MANUAL_REVIEW])
-        
-        logger.info(
-            f"批次处理完成: {batch_id}, "
-            f"成功: {success_count}, 失败: {failed_count}, 需要审核: {review_count}"
-        )
-        
-        # TODO: 将处理结果保存到数据库
-        # TODO: 发送处理完成通知
-        
-    except Exception as e:
-        logger.error(f"批次处理异常: {batch_id}, 错误: {str(e)}")
-        # TODO: 更新批次状态为失败
\ No newline at end of file
+    context = AnswerSheetProcessingContext(
+        sheet_id=payload['sheet_id'],
+        file_path=payload['file_path'],
+        exam_id=payload['exam_id'],
+        metadata=payload.get('metadata')
+    )
+    context = await processing_pipeline.process_answer_sheet(context, config)
+    
+    return ITEM_STATUS_BY_STAGE.get(context.current_stage, 'completed'), _summarize_context(context)
+
+def summarize_batch_item(status: str, result: Optional[Dict[str, Any]]) -> ItemSummary:
+    """条目结果中需要在数据库中聚合的阶段、错误类型和数值指标"""
+    result = result or {}
+    metrics = {}
+    if result.get('confidence') is not None:
+        metrics['confidence'] = result['confidence']
+    for stage, confidence in result.get('stage_confidence', {}).items():
+        metrics[f'stage_confidence.{stage}'] = confidence
+    if status != 'failed' and result.get('total_score') is not None:
+        max_score = result.get('max_total_score') or 100.0
+        metrics['total_score'] = result['total_score']
+        metrics['score_percentage'] = result['total_score'] / max_score * 100
+    
+    return ItemSummary(
+        stage=result.get('processing_stage', status),
+        error_type=f"{result.get('failed_stage') or 'processing'}_failed" if status == 'failed' else None,
+        metrics=metrics
+    )
+
+batch_job_runner.register_handler(ANSWER_SHEET_JOB_TYPE, process_batch_item, summarize=summarize_batch_item)
+
+async def start_batch_job_workers():
+    """启动批处理执行器，继续处理未完成的批次"""
+    await batch_job_runner.start()
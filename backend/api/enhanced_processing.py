@@ -7,13 +7,17 @@ import cv2
 import numpy as np
 from PIL import Image
 import io
+import uuid
 from datetime import datetime
+from pathlib import Path
 
 from services.enhanced_processing_service import EnhancedProcessingService
 from services.multimodal_student_info_service import MultimodalStudentInfoService
 from services.adaptive_grading_engine import AdaptiveGradingEngine
 from services.enhanced_question_segmentation import EnhancedQuestionSegmentation
 from models.answer_sheet import AnswerSheet
+from services.batch_job_runner import batch_job_runner
+from config.settings import settings
 from db_connection import get_db
 from sqlalchemy.orm import Session
 from fastapi import Depends
@@ -26,6 +30,9 @@ multimodal_student_info = MultimodalStudentInfoService()
 adaptive_grading = AdaptiveGradingEngine()
 question_segmentation = EnhancedQuestionSegmentation()
 
+# 批处理任务类型
+ENHANCED_IMAGE_JOB_TYPE = "enhanced_image"
+
 @router.post("/upload-and-process")
 async def upload_and_process_enhanced(
     files: List[UploadFile] = File(...),
@@ -325,20 +332,45 @@ async def complete_enhanced_workflow(
         raise HTTPException(status_code=500, detail=f"增强工作流处理失败: {str(e)}")
 
 @router.get("/processing-status/{task_id}")
-async def get_processing_status(task_id: str):
+async def get_processing_status(
+    task_id: str,
+    since: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
     """
     获取处理状态接口
+    返回完成序号在 since 之后的文件结果（至多 limit 个），next_since 作为下次请求的游标
     """
     try:
-        # 这里应该从缓存或数据库中获取任务状态
-        # 暂时返回模拟状态
+        job = batch_job_runner.get_job(db, task_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        
+        finished_items = batch_job_runner.get_finished_items(db, task_id, after_seq=since, limit=limit)
+        finished_count = job.completed_items + job.review_items + job.failed_items
+        
         return JSONResponse({
             'task_id': task_id,
-            'status': 'completed',
-            'progress': 100,
-            'message': '处理完成',
-            'result_available': True
+            'status': job.status,
+            'progress': round(finished_count / job.total_items * 100) if job.total_items else 100,
+            'message': f'已处理 {finished_count}/{job.total_items} 个文件',
+            'successful_processing': job.completed_items,
+            'failed_processing': job.failed_items,
+            'result_available': finished_count > 0,
+            'results': [
+                {
+                    'filename': (item.payload or {}).get('filename'),
+                    'file_index': item.item_index,
+                    'result': item.result,
+                    'error': item.error_message
+                }
+                for item in finished_items
+            ],
+            'next_since': finished_items[-1].finish_seq if finished_items else since
         })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取状态失败: {str(e)}")
 
@@ -346,11 +378,12 @@ async def get_processing_status(task_id: str):
 async def batch_processing_endpoint(
     files: List[UploadFile] = File(...),
     batch_config: str = Form(None),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    db: Session = Depends(get_db)
 ):
     """
     批量处理接口
-    支持大批量答题卡的并行处理
+    支持大批量答题卡的并行处理，文件逐个持久化为批处理条目，
+    由所有运行批处理执行器的进程分片处理
     """
     try:
         # 解析批处理配置
@@ -361,82 +394,53 @@ async def batch_processing_endpoint(
         }
         
         # 生成任务ID
-        task_id = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        # 准备图像数据
-        images = []
-        filenames = []
+        task_id = str(uuid.uuid4())
+        storage_dir = Path(settings.STORAGE_BASE_PATH) / "enhanced_batches" / task_id
+        storage_dir.mkdir(parents=True, exist_ok=True)
         
+        # 保存图像文件，处理节点按路径读取
+        payloads = []
         for file in files:
             if file.content_type.startswith('image/'):
                 image_data = await file.read()
                 image = Image.open(io.BytesIO(image_data))
                 image_np = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                images.append(image_np)
-                filenames.append(file.filename)
-        
-        # 启动后台批处理任务
-        background_tasks.add_task(
-            process_batch_in_background,
-            task_id,
-            images,
-            filenames,
-            config
-        )
+                file_path = storage_dir / f"{len(payloads)}.png"
+                cv2.imwrite(str(file_path), image_np)
+                payloads.append({
+                    'file_path': str(file_path),
+                    'filename': file.filename
+                })
+        
+        if not payloads:
+            raise HTTPException(status_code=400, detail="没有可处理的图像文件")
+        
+        # 持久化批处理任务并启动处理节点
+        batch_job_runner.create_job(db, ENHANCED_IMAGE_JOB_TYPE, payloads, config=config, job_id=task_id)
+        await batch_job_runner.start()
         
         return JSONResponse({
             'success': True,
             'task_id': task_id,
-            'message': f'批处理任务已启动，共 {len(images)} 个文件',
-            'estimated_time': len(images) * 2,  # 估算时间（秒）
+            'message': f'批处理任务已启动，共 {len(payloads)} 个文件',
+            'estimated_time': len(payloads) * 2,  # 估算时间（秒）
             'status_endpoint': f'/api/enhanced/processing-status/{task_id}'
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"批处理启动失败: {str(e)}")
 
-async def process_batch_in_background(
-    task_id: str,
-    images: List[np.ndarray],
-    filenames: List[str],
-    config: Dict[str, Any]
-):
+async def process_batch_item(payload: Dict[str, Any], config: Dict[str, Any]):
     """
-    后台批处理任务
+    处理批处理任务中的单个图像（由批处理执行器调用）
     """
-    try:
-        # 这里应该实现实际的批处理逻辑
-        # 包括进度更新、结果存储等
-        
-        batch_size = config.get('batch_size', 20)
-        results = []
-        
-        # 分批处理
-        for i in range(0, len(images), batch_size):
-            batch_images = images[i:i + batch_size]
-            batch_filenames = filenames[i:i + batch_size]
-            
-            # 处理当前批次
-            batch_results = await enhanced_processing.process_batch(
-                batch_images, config
-            )
-            
-            # 整理结果
-            for j, result in enumerate(batch_results):
-                results.append({
-                    'filename': batch_filenames[j],
-                    'result': result,
-                    'batch_index': i // batch_size,
-                    'file_index': i + j
-                })
-        
-        # 保存结果到缓存或数据库
-        # 这里应该实现结果存储逻辑
-        
-        print(f"批处理任务 {task_id} 完成，处理了 {len(results)} 个文件")
-        
-    except Exception as e:
-        print(f"批处理任务 {task_id} 失败: {str(e)}")
+    results = await enhanced_processing.process_batch([payload['file_path']], config)
+    result = results[0]
+    return ('completed' if result.get('success', False) else 'failed'), result
+
+batch_job_runner.register_handler(ENHANCED_IMAGE_JOB_TYPE, process_batch_item)
 
 @router.get("/health")
 async def health_check():
@@ -12,8 +12,6 @@ import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import json
 import time
-import heapq
-from dataclasses import dataclass, field
 from enum import Enum
 
 try:
@@ -51,6 +49,7 @@ except ImportError:
             def export_segmentation_result(self, segments):
                 return {"questions": []}
 from config.settings import settings
+from services.ocr_batch_scheduler import ocr_batch_scheduler
 
 router = APIRouter(prefix="/api/ocr", tags=["OCR处理"])
 
@@ -104,21 +103,9 @@ class TaskPriority(Enum):
     HIGH = 1
     URGENT = 0
 
-@dataclass
-class PriorityTask:
-    priority: int
-    task_id: str
-    exam_id: str
-    answer_sheet_ids: list
-    created_at: float = field(default_factory=time.time)
-    
-    def __lt__(self, other):
-        return self.priority < other.priority
-
-# 优先级队列和任务缓存
-task_queue = []
-task_cache = {}
-queue_lock = asyncio.Lock()
+async def start_ocr_batch_workers():
+    """启动批处理调度器并恢复未完成的任务"""
+    await ocr_batch_scheduler.start(process_batch_ocr_background)
 
 @router.post("/grade_subjective/{answer_sheet_id}", status_code=status.HTTP_202_ACCEPTED)
 async def grade_subjective_questions_endpoint(
@@ -232,7 +219,6 @@ async def process_single_answer_sheet(
 @router.post("/batch-process", response_model=Dict[str, str])
 async def start_batch_ocr_processing(
     request: OCRRequest,
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -264,9 +250,13 @@ async def start_batch_ocr_processing(
     task_id = str(uuid.uuid4())
     
     # 初始化任务状态
-    task_cache[task_id] = {
+    job = {
         "status": "queued",
+        "tenant_id": str(current_user.id),
+        "exam_id": answer_sheets[0].exam_id if answer_sheets else "",
+        "answer_sheet_ids": list(request.answer_sheet_ids),
         "priority": request.priority,
+        "priority_value": priority_value,
         "progress": 0.0,
         "total_sheets": len(answer_sheets),
         "processed_count": 0,
@@ -282,18 +272,6 @@ async def start_batch_ocr_processing(
         "results": []
     }
     
-    # 创建优先级任务并加入队列
-    priority_task = PriorityTask(
-        priority=priority_value,
-        task_id=task_id,
-        exam_id=answer_sheets[0].exam_id if answer_sheets else "",
-        answer_sheet_ids=request.answer_sheet_ids
-    )
-    
-    async with queue_lock:
-        heapq.heappush(task_queue, priority_task)
-        task_cache[task_id]["queue_position"] = len(task_queue)
-    
     # 创建数据库任务记录
     for sheet in answer_sheets:
         grading_task = GradingTask(
@@ -307,45 +285,25 @@ async def start_batch_ocr_processing(
     
     db.commit()
     
-    # 启动队列处理器（如果还没有运行）
-    background_tasks.add_task(process_task_queue)
+    # 持久化并加入调度队列，空闲 worker 立即开始处理
+    await start_ocr_batch_workers()
+    await ocr_batch_scheduler.submit(task_id, job)
     
     return {
         "task_id": task_id,
         "message": f"批量OCR任务已启动，共{len(answer_sheets)}张答题卡"
     }
 
-async def process_task_queue():
-    """处理任务队列"""
-    while True:
-        try:
-            async with queue_lock:
-                if not task_queue:
-                    await asyncio.sleep(5)  # 队列为空时等待
-                    continue
-                
-                # 获取最高优先级任务
-                priority_task = heapq.heappop(task_queue)
-            
-            # 处理任务
-            await process_batch_ocr_background(
-                priority_task.task_id,
-                priority_task.answer_sheet_ids,
-                priority_task.priority
-            )
-            
-        except Exception as e:
-            print(f"队列处理错误: {str(e)}")
-            await asyncio.sleep(1)
-
 async def process_batch_ocr_background(task_id: str, answer_sheet_ids: List[str], priority: int):
-    """后台批量OCR处理"""
+    """后台批量OCR处理（由调度器 worker 调用，answer_sheet_ids 为尚未处理的答题卡）"""
+    job = ocr_batch_scheduler.jobs[task_id]
     try:
         # 更新任务状态为进行中
-        task_cache[task_id]["status"] = "processing"
-        task_cache[task_id]["processing_start_time"] = time.time()
-        task_cache[task_id]["queue_position"] = 0
-        task_cache[task_id]["progress_details"] = []
+        job["status"] = "processing"
+        job["processing_start_time"] = time.time()
+        job["queue_position"] = 0
+        job.setdefault("progress_details", [])
+        ocr_batch_scheduler.save(task_id)
         
         # 获取数据库会话
         from database import SessionLocal
@@ -363,7 +321,7 @@ async def process_batch_ocr_background(task_id: str, answer_sheet_ids: List[str]
                 # 并行处理当前批次
                 tasks = []
                 for sheet_id in batch_ids:
-                    task_cache[task_id]["current_sheet"] = sheet_id
+                    job["current_sheet"] = sheet_id
                     task = asyncio.create_task(process_single_sheet_internal(sheet_id, db))
                     tasks.append(task)
                 
@@ -376,35 +334,35 @@ async def process_batch_ocr_background(task_id: str, answer_sheet_ids: List[str]
                 # 更新结果
                 for j, result in enumerate(batch_results):
                     sheet_id = batch_ids[j]
-                    task_cache[task_id]["processed_count"] += 1
+                    job["processed_count"] += 1
                     
                     if isinstance(result, Exception):
-                        task_cache[task_id]["failed_count"] += 1
-                        task_cache[task_id]["results"].append({
+                        job["failed_count"] += 1
+                        job["results"].append({
                             "answer_sheet_id": sheet_id,
                             "status": "failed",
                             "error_message": str(result)
                         })
                     else:
                         if result["status"] == "completed":
-                            task_cache[task_id]["success_count"] += 1
+                            job["success_count"] += 1
                         else:
-                            task_cache[task_id]["failed_count"] += 1
+                            job["failed_count"] += 1
                         
-                        task_cache[task_id]["results"].append(result)
+                        job["results"].append(result)
                 
                 # 更新进度和统计信息
-                progress = task_cache[task_id]["processed_count"] / task_cache[task_id]["total_sheets"]
-                task_cache[task_id]["progress"] = progress
+                progress = job["processed_count"] / job["total_sheets"]
+                job["progress"] = progress
                 
                 # 计算平均处理时间和预估完成时间
                 if processing_times:
                     avg_time = sum(processing_times) / len(processing_times)
-                    task_cache[task_id]["average_processing_time"] = avg_time
+                    job["average_processing_time"] = avg_time
                     
-                    remaining_batches = (len(answer_sheet_ids) - task_cache[task_id]["processed_count"]) / batch_size
+                    remaining_batches = (job["total_sheets"] - job["processed_count"]) / batch_size
                     estimated_remaining_time = remaining_batches * avg_time
-                    task_cache[task_id]["estimated_completion"] = time.time() + estimated_remaining_time
+                    job["estimated_completion"] = time.time() + estimated_remaining_time
                 
                 # 记录详细进度
                 progress_detail = {
@@ -415,23 +373,24 @@ async def process_batch_ocr_background(task_id: str, answer_sheet_ids: List[str]
                     "successful_in_batch": sum(1 for r in batch_results if not isinstance(r, Exception) and r.get("status") == "completed"),
                     "failed_in_batch": sum(1 for r in batch_results if isinstance(r, Exception) or (not isinstance(r, Exception) and r.get("status") != "completed"))
                 }
-                task_cache[task_id]["progress_details"].append(progress_detail)
+                job["progress_details"].append(progress_detail)
+                ocr_batch_scheduler.save(task_id)
                 
                 # 避免过度并发
                 if i + batch_size < len(answer_sheet_ids):
                     await asyncio.sleep(1)
             
             # 任务完成
-            task_cache[task_id]["status"] = "completed"
-            task_cache[task_id]["completed_at"] = datetime.utcnow()
-            task_cache[task_id]["current_sheet"] = None
+            job["status"] = "completed"
+            job["completed_at"] = datetime.utcnow()
+            job["current_sheet"] = None
             
         finally:
             db.close()
             
     except Exception as e:
-        task_cache[task_id]["status"] = "failed"
-        task_cache[task_id]["error"] = str(e)
+        job["status"] = "failed"
+        job["error"] = str(e)
 
 async def process_single_sheet_internal(sheet_id: str, db: Session) -> Dict[str, Any]:
     """内部单个答题卡处理函数"""
@@ -520,11 +479,10 @@ async def get_task_status(
     current_user: User = Depends(get_current_user)
 ):
     """获取批处理任务状态"""
-    if task_id not in task_cache:
+    task_data = ocr_batch_scheduler.get_job(task_id)
+    if task_data is None:
         raise HTTPException(status_code=404, detail="任务不存在")
     
-    task_data = task_cache[task_id]
-    
     # 估算完成时间
     estimated_completion = None
     if task_data["status"] == "processing" and task_data["processed_count"] > 0:
@@ -554,11 +512,10 @@ async def get_task_results(
     current_user: User = Depends(get_current_user)
 ):
     """获取批处理任务结果"""
-    if task_id not in task_cache:
+    task_data = ocr_batch_scheduler.get_job(task_id)
+    if task_data is None:
         raise HTTPException(status_code=404, detail="任务不存在")
     
-    task_data = task_cache[task_id]
-    
     return OCRBatchResult(
         task_id=task_id,
         total_sheets=task_data["total_sheets"],
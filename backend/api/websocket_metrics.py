@@ -37,7 +37,8 @@ async def get_websocket_metrics(current_user: dict = Depends(get_current_user)):
             "queue_size": message_queue.queue.qsize() if message_queue.queue else 0,
             "messages_sent": message_queue.metrics.messages_sent,
             "messages_failed": message_queue.metrics.messages_failed,
-            "avg_response_time": message_queue.metrics.avg_response_time
+            "avg_response_time": message_queue.metrics.avg_response_time,
+            "latency": message_queue.get_latency_stats()
         }
         
         # WebSocket管理器统计
@@ -70,7 +70,7 @@ async def quality_monitoring_websocket(
                 
             elif message_type == "heartbeat_response":
                 # 更新心跳时间
-                connection.last_heartbeat = connection.connected_at.__class__.utcnow()
+                connection.touch()
                 
     except WebSocketDisconnect:
         logger.info(f"Quality monitoring WebSocket disconnected: {connection.connection_id}")
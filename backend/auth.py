@@ -11,6 +11,7 @@ from config.settings import settings
 from services.email_service import email_service, reset_token_manager
 from middleware.permissions import permission_manager, get_user_permissions
 from middleware.security_audit import security_auditor
+from middleware.token_cache import verified_token_cache, snapshot_instance, hydrate_instance
 
 # OAuth2 an password-based bearer tokens scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -26,23 +27,34 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(
-            token, 
-            settings.SECRET_KEY, 
-            algorithms=[settings.ALGORITHM],
-            audience=settings.JWT_AUDIENCE,
-            issuer=settings.JWT_ISSUER
-        )
-        username: str = payload.get("sub")
-        user_id: str = payload.get("user_id")
-        
-        if username is None:
+    # 已验证令牌缓存命中时跳过签名校验
+    cached = verified_token_cache.get(token)
+    if cached is None:
+        try:
+            payload = jwt.decode(
+                token, 
+                settings.SECRET_KEY, 
+                algorithms=[settings.ALGORITHM],
+                audience=settings.JWT_AUDIENCE,
+                issuer=settings.JWT_ISSUER
+            )
+        except JWTError:
             raise credentials_exception
-            
-        token_data = TokenData(username=username)
-    except JWTError:
+        cached = verified_token_cache.put(token, payload, user_id=payload.get("user_id") or payload.get("sub"))
+    
+    payload = cached.claims
+    username: str = payload.get("sub")
+    user_id: str = payload.get("user_id")
+    
+    if username is None:
         raise credentials_exception
+        
+    token_data = TokenData(username=username)
+    
+    # 用户快照命中时无需查询数据库
+    snapshot = verified_token_cache.get_user_snapshot(cached)
+    if snapshot is not None:
+        return hydrate_instance(db, User, snapshot)
     
     # 优先使用user_id查询，回退到username
     if user_id:
@@ -51,8 +63,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         user = db.query(User).filter(User.username == token_data.username).first()
     
     if user is None or not user.is_active:
+        verified_token_cache.invalidate_token(token)
         raise credentials_exception
         
+    verified_token_cache.set_user_snapshot(cached, snapshot_instance(user))
     return user
 
 
@@ -431,6 +445,7 @@ async def update_user_profile(
     
     db.commit()
     db.refresh(current_user)
+    verified_token_cache.invalidate_user(current_user.id)
     
     return UserResponse.model_validate(current_user)
 
@@ -471,6 +486,7 @@ async def update_password(
     current_user.updated_at = datetime.utcnow()
     
     db.commit()
+    verified_token_cache.invalidate_user(current_user.id)
     
     return MessageResponse(message="密码更新成功")
 
@@ -501,6 +517,7 @@ async def confirm_password_reset(reset_data: PasswordResetRequest, db: Session =
     reset_token_manager.use_token(reset_data.token)
 
     db.commit()
+    verified_token_cache.invalidate_user(user.id)
 
     return MessageResponse(message="密码重置成功")
 
@@ -574,6 +591,7 @@ async def update_user_role(
 
     db.commit()
     db.refresh(target_user)
+    verified_token_cache.invalidate_user(target_user.id)
 
     user_response = UserResponse.model_validate(target_user)
     user_response.permissions = get_user_permissions(target_user.role)
@@ -614,6 +632,7 @@ async def update_user_status(
     target_user.updated_at = datetime.utcnow()
 
     db.commit()
+    verified_token_cache.invalidate_user(target_user.id)
 
     return MessageResponse(message=f"用户状态已更新为 {'激活' if is_active else '禁用'}")
 
@@ -29,6 +29,7 @@ class Settings:
     STORAGE_PATH = Path(os.getenv("STORAGE_PATH", "./storage/image_quality"))  # 图像质量存储路径
     MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "50")) * 1024 * 1024  # 50MB
     ALLOWED_FILE_EXTENSIONS = ['.pdf', '.jpg', '.jpeg', '.png', '.tiff', '.tif']
+    RESULT_SPILL_DIR = os.getenv("RESULT_SPILL_DIR", "./storage/result_spill") or None  # 已完成任务大结果溢写目录，置空关闭
     
     # Gemini 2.5 Pro OCR配置
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -44,6 +45,14 @@ class Settings:
     OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "3"))  # 批处理并发数
     OCR_RETRY_ATTEMPTS = int(os.getenv("OCR_RETRY_ATTEMPTS", "3"))  # 重试次数
     OCR_TIMEOUT = int(os.getenv("OCR_TIMEOUT", "60"))  # 超时时间(秒)
+    OCR_BATCH_WORKERS = int(os.getenv("OCR_BATCH_WORKERS", "2"))  # 并发批处理任务数
+    OCR_JOB_STORE_PATH = Path(os.getenv("OCR_JOB_STORE_PATH", "./storage/ocr_batch_jobs.db"))  # 批处理任务状态存储
+    OCR_JOB_RETENTION_SECONDS = int(os.getenv("OCR_JOB_RETENTION_SECONDS", "604800"))  # 已结束任务保留时长(秒)
+    OCR_JOB_LEASE_SECONDS = int(os.getenv("OCR_JOB_LEASE_SECONDS", "60"))  # 未完成任务持有者租约时长(秒)
+    
+    # 持久化批处理任务配置
+    BATCH_JOB_WORKERS = int(os.getenv("BATCH_JOB_WORKERS", "4"))  # 每个进程的批处理条目并发数
+    BATCH_JOB_LEASE_SECONDS = int(os.getenv("BATCH_JOB_LEASE_SECONDS", "60"))  # 条目租约时长(秒)
     
     # 传统OCR配置(备用)
     TESSERACT_PATH = os.getenv("TESSERACT_PATH", "/usr/bin/tesseract")
@@ -86,6 +95,9 @@ class Settings:
     # WebSocket配置已移除
     # WS_URL = os.getenv("WS_URL", "ws://localhost:8000")
     
+    # WebSocket跨进程广播总线: none / memory / redis（多 worker 部署使用 redis）
+    WEBSOCKET_BACKPLANE = os.getenv("WEBSOCKET_BACKPLANE", "none")
+    
     @classmethod
     def validate_gemini_config(cls) -> bool:
         """验证Gemini配置"""
@@ -9,7 +9,7 @@ import hashlib
 import time
 import json
 import re
-from typing import Dict, Any, List, Optional, Union, Tuple, Callable
+from typing import Dict, Any, List, Optional, Union, Tuple, Callable, Iterable, Set
 from functools import wraps
 from contextlib import contextmanager, asynccontextmanager
 from sqlalchemy import text, event
@@ -133,6 +133,8 @@ class QueryCache:
         self._cache: Dict[str, Tuple[Any, datetime]] = {}
         self._lock = threading.RLock()
         self._access_times: Dict[str, datetime] = {}
+        self._table_index: Dict[str, Set[str]] = defaultdict(set)  # table -> cache keys
+        self._key_tables: Dict[str, Set[str]] = {}  # cache key -> tables
         
     def get(self, key: str) -> Optional[Any]:
         """从缓存获取数据"""
@@ -144,19 +146,35 @@ class QueryCache:
                     return value
                 else:
                     # 过期，删除
-                    del self._cache[key]
-                    self._access_times.pop(key, None)
+                    self._drop(key)
         return None
     
-    def set(self, key: str, value: Any):
-        """设置缓存数据"""
+    def set(self, key: str, value: Any, tables: Optional[Iterable[str]] = None):
+        """设置缓存数据，tables 为查询涉及的表，用于按表失效"""
         with self._lock:
             # 如果缓存已满，删除最久未使用的项
             if len(self._cache) >= self.max_size and key not in self._cache:
                 self._evict_lru()
             
+            self._unindex(key)
             self._cache[key] = (value, datetime.utcnow())
             self._access_times[key] = datetime.utcnow()
+            key_tables = {table.lower() for table in tables or ()}
+            for table in key_tables:
+                self._table_index[table].add(key)
+            if key_tables:
+                self._key_tables[key] = key_tables
+    
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """失效涉及指定表的全部缓存查询"""
+        invalidated = 0
+        with self._lock:
+            for table in tables:
+                for key in list(self._table_index.get(table.lower(), ())):
+                    if key in self._cache:
+                        invalidated += 1
+                    self._drop(key)
+        return invalidated
     
     def _evict_lru(self):
         """删除最久未使用的项"""
@@ -164,14 +182,29 @@ class QueryCache:
             return
         
         lru_key = min(self._access_times.items(), key=lambda x: x[1])[0]
-        self._cache.pop(lru_key, None)
-        self._access_times.pop(lru_key, None)
+        self._drop(lru_key)
+    
+    def _drop(self, key: str):
+        """删除缓存项及其表索引"""
+        self._cache.pop(key, None)
+        self._access_times.pop(key, None)
+        self._unindex(key)
+    
+    def _unindex(self, key: str):
+        for table in self._key_tables.pop(key, ()):
+            keys = self._table_index.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._table_index[table]
     
     def clear(self):
         """清空缓存"""
         with self._lock:
             self._cache.clear()
             self._access_times.clear()
+            self._table_index.clear()
+            self._key_tables.clear()
     
     def stats(self) -> Dict[str, Any]:
         """获取缓存统计信息"""
@@ -179,6 +212,7 @@ class QueryCache:
             return {
                 'size': len(self._cache),
                 'max_size': self.max_size,
+                'indexed_tables': len(self._table_index),
                 'ttl_seconds': self.ttl.total_seconds(),
                 'hit_rate': 0  # 在QueryOptimizer中计算
             }
@@ -284,7 +318,7 @@ class QueryOptimizer:
             cacheable_result = result
         
         # 存储到缓存
-        self.cache.set(cache_key, cacheable_result)
+        self.cache.set(cache_key, cacheable_result, tables=self._extract_tables(sql))
         
         # 更新缓存未命中统计
         query_hash = self._get_query_hash(sql)
@@ -297,6 +331,18 @@ class QueryOptimizer:
         
         return cacheable_result
     
+    _TABLE_PATTERN = re.compile(r'\b(?:from|join)\s+[`"\[]?(\w+)', re.IGNORECASE)
+    
+    def _extract_tables(self, sql: str) -> Set[str]:
+        """提取查询涉及的表名（FROM / JOIN 子句）"""
+        return {name.lower() for name in self._TABLE_PATTERN.findall(sql)}
+    
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """按表失效查询缓存"""
+        if not self.cache:
+            return 0
+        return self.cache.invalidate_tables(tables)
+    
     def _generate_cache_key(self, sql: str, params: Dict = None) -> str:
         """生成缓存键"""
         cache_data = {
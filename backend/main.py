@@ -8,6 +8,7 @@ from api.classified_grading import router as classified_grading_router
 from api.classified_grading import segmentation_router
 from api.compatibility import router as compatibility_router
 from api.database_optimization import router as database_optimization_router
+from api.enhanced_batch_upload import start_batch_job_workers
 from api.exam_management import router as exam_router
 from api.file_upload import router as file_upload_router
 from api.grading_review import router as grading_review_router
@@ -16,6 +17,7 @@ from api.intelligent_segmentation import router as intelligent_segmentation_rout
 from api.model_training import router as model_training_router
 from api.monitoring import router as monitoring_router
 from api.ocr_processing import router as ocr_router
+from api.ocr_processing import start_ocr_batch_workers
 
 # from api.batch_monitoring import router as batch_monitoring_router
 from api.pre_grading import router as pre_grading_router
@@ -28,7 +30,7 @@ from api.websocket_metrics import router as websocket_metrics_router
 from api.websocket_routes import router as websocket_router
 from auth import router as auth_router
 from config.settings import settings
-from db_connection import create_tables
+from db_connection import SessionLocal, create_tables
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
@@ -37,8 +39,11 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from middleware.response_middleware import ResponseMiddleware
 from middleware.security_middleware import RateLimitMiddleware, SecurityMiddleware
 from routes.auth_enhanced import router as auth_enhanced_router
+from services.batch_job_runner import batch_job_runner
+from services.cache_consistency import cache_system_manager, start_commit_invalidation
 from services.concurrency_manager import global_concurrency_manager
 from services.monitoring_system import monitoring_system
+from services.ocr_batch_scheduler import ocr_batch_scheduler
 from services.prometheus_metrics import metrics_collector
 from services.websocket_performance import (
     connection_pool,
@@ -62,6 +67,11 @@ async def lifespan(app: FastAPI):
         logger.info("创建数据库表...")
         create_tables()
 
+    # 启动提交驱动的缓存失效（ORM提交后失效L1/L2/查询缓存）
+    logger.info("启动缓存失效管理...")
+    await start_commit_invalidation(SessionLocal)
+    logger.info("✅ 缓存失效管理已启动")
+
     # 启动WebSocket性能监控系统
     logger.info("启动WebSocket性能监控系统...")
     await message_queue.start_processing()
@@ -78,6 +88,16 @@ async def lifespan(app: FastAPI):
     await global_concurrency_manager.start()
     logger.info("✅ 并发管理器已启动")
 
+    # 启动OCR批处理调度器（恢复未完成的批处理任务）
+    logger.info("启动OCR批处理调度器...")
+    await start_ocr_batch_workers()
+    logger.info("✅ OCR批处理调度器已启动")
+
+    # 启动批处理任务执行器（继续处理未完成的批次条目）
+    logger.info("启动批处理任务执行器...")
+    await start_batch_job_workers()
+    logger.info("✅ 批处理任务执行器已启动")
+
     # 启动监控系统
     logger.info("启动监控系统...")
     await monitoring_system.start()
@@ -91,6 +111,14 @@ async def lifespan(app: FastAPI):
     await monitoring_system.stop()
     logger.info("✅ 监控系统已关闭")
 
+    logger.info("关闭批处理任务执行器...")
+    await batch_job_runner.stop()
+    logger.info("✅ 批处理任务执行器已关闭")
+
+    logger.info("关闭OCR批处理调度器...")
+    await ocr_batch_scheduler.stop()
+    logger.info("✅ OCR批处理调度器已关闭")
+
     logger.info("关闭并发管理器...")
     await global_concurrency_manager.stop()
     logger.info("✅ 并发管理器已关闭")
@@ -103,6 +131,10 @@ async def lifespan(app: FastAPI):
     await message_queue.stop_processing()
     await performance_monitor.stop_monitoring()
     logger.info("✅ WebSocket性能监控系统已关闭")
+
+    logger.info("关闭缓存失效管理...")
+    await cache_system_manager.shutdown()
+    logger.info("✅ 缓存失效管理已关闭")
     logger.info("智阅AI后端服务关闭")
 
 
@@ -9,6 +9,8 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from config.settings import settings
 from models.production_models import User
+from middleware.permission_cache import permission_cache
+from middleware.token_cache import verified_token_cache
 import json
 import hashlib
 import logging
@@ -70,42 +72,50 @@ class JWTManager:
     
     def verify_token(self, token: str, token_type: str = "access") -> Dict[str, Any]:
         """验证令牌"""
-        try:
-            payload = jwt.decode(
-                token,
-                settings.SECRET_KEY,
-                algorithms=[settings.ALGORITHM],
-                audience=settings.JWT_AUDIENCE,
-                issuer=settings.JWT_ISSUER
-            )
-            
-            # 检查令牌类型
-            if payload.get("type") != token_type:
+        # 已验证令牌缓存命中时跳过签名校验
+        cached = verified_token_cache.get(token)
+        if cached is None:
+            try:
+                payload = jwt.decode(
+                    token,
+                    settings.SECRET_KEY,
+                    algorithms=[settings.ALGORITHM],
+                    audience=settings.JWT_AUDIENCE,
+                    issuer=settings.JWT_ISSUER
+                )
+            except ExpiredSignatureError:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail=f"无效的令牌类型，期望: {token_type}"
+                    detail="令牌已过期"
                 )
-            
-            # 检查令牌是否在会话中
-            if not self._is_token_valid(payload["sub"], payload["jti"]):
+            except JWTError as e:
+                logger.warning(f"无效令牌: {str(e)}")
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="令牌已失效或被撤销"
+                    detail="无效令牌"
                 )
-            
-            return payload
-            
-        except ExpiredSignatureError:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="令牌已过期"
-            )
-        except JWTError as e:
-            logger.warning(f"无效令牌: {str(e)}")
+            cached = verified_token_cache.put(token, payload, user_id=payload.get("sub"))
+        
+        payload = cached.claims
+        
+        # 检查令牌类型
+        if payload.get("type") != token_type:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="无效令牌"
+                detail=f"无效的令牌类型，期望: {token_type}"
             )
+        
+        # 检查令牌是否在会话中（本进程撤销立即生效，其他进程的撤销按检查间隔生效）
+        if verified_token_cache.session_check_due(cached):
+            if not self._is_token_valid(payload["sub"], payload["jti"]):
+                verified_token_cache.invalidate_token(token)
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="令牌已失效或被撤销"
+                )
+            verified_token_cache.mark_session_checked(cached)
+        
+        return payload
     
     def refresh_access_token(self, refresh_token: str, db: Session) -> Dict[str, str]:
         """刷新访问令牌"""
@@ -140,12 +150,14 @@ class JWTManager:
         if jti:
             # 撤销特定令牌
             self.redis_client.delete(f"token_session:{user_id}:{jti}")
+            verified_token_cache.invalidate_jti(jti)
         else:
             # 撤销用户所有令牌
             pattern = f"token_session:{user_id}:*"
             keys = self.redis_client.keys(pattern)
             if keys:
                 self.redis_client.delete(*keys)
+            verified_token_cache.invalidate_user(user_id)
         
         self._log_token_activity(user_id, "token_revoke")
     
@@ -276,8 +288,8 @@ class EnhancedPermissionMiddleware:
         return None
     
     def _has_required_permissions(self, user_permissions: List[str], required_permissions: List[str]) -> bool:
-        """检查是否具有所需权限"""
-        return all(perm in user_permissions for perm in required_permissions)
+        """检查是否具有所需权限（预编译位掩码，未编译的权限按集合判断）"""
+        return permission_cache.check_granted_permissions(user_permissions, required_permissions)
     
     def _log_access(self, user_id: str, path: str, method: str):
         """记录访问日志"""
@@ -1,9 +1,13 @@
 """权限缓存优化模块"""
 
 import redis
+import functools
 import json
+import re
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Set
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
 from config.settings import settings
 from middleware.permissions import permission_manager, get_user_permissions
 import hashlib
@@ -11,13 +15,242 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-class PermissionCache:
-    """权限缓存管理器"""
+class ResourcePatternTrie:
+    """资源模式前缀树
+    
+    资源名按 '/' 或 ':' 分段，段可以是 '*'（匹配任意单段）或 '**'
+    （匹配剩余所有段）。查找返回最具体匹配模式所要求的权限位掩码。
+    """
+    
+    _SEPARATORS = re.compile(r'[/:]')
     
     def __init__(self):
+        self.root: Dict[str, Any] = {}
+        
+    @classmethod
+    def split(cls, resource: str) -> List[str]:
+        return [segment for segment in cls._SEPARATORS.split(resource) if segment]
+        
+    def insert(self, pattern: str, mask: int):
+        node = self.root
+        for segment in self.split(pattern):
+            node = node.setdefault(segment, {})
+        node[None] = mask  # None 键存放终止节点的掩码
+        
+    def lookup(self, resource: str) -> Optional[int]:
+        return self._lookup(self.root, self.split(resource), 0)
+        
+    def _lookup(self, node: Dict[str, Any], segments: List[str], index: int) -> Optional[int]:
+        if index == len(segments):
+            if None in node:
+                return node[None]
+            tail = node.get('**')
+            return tail.get(None) if tail else None
+        
+        # 精确段优先于通配段
+        for key in (segments[index], '*'):
+            child = node.get(key)
+            if child is not None:
+                result = self._lookup(child, segments, index + 1)
+                if result is not None:
+                    return result
+                    
+        tail = node.get('**')
+        return tail.get(None) if tail else None
+
+class CompiledPermissions:
+    """一次编译的结果：权限位表、角色掩码、资源前缀树及其查找缓存
+
+    查找缓存与位表绑定在同一对象上，重新编译时整体替换，读取方只需取一次
+    引用即可得到一致的快照，不会把旧位表算出的掩码写入新缓存。
+    缓存为有界 LRU，只按所需权限元组和资源名缓存。
+    """
+    
+    def __init__(self, permission_bits: Dict[str, int], role_masks: Dict[str, int],
+                 resource_trie: ResourcePatternTrie, cache_size: int):
+        self.permission_bits = permission_bits
+        self.role_masks = role_masks
+        self.resource_trie = resource_trie
+        self.mask_of = functools.lru_cache(maxsize=cache_size)(self._mask_of)
+        self.resource_mask = functools.lru_cache(maxsize=cache_size)(self._resource_mask)
+        
+    def _mask_of(self, permissions: Tuple[str, ...]) -> int:
+        mask = 0
+        for permission in permissions:
+            mask |= self.permission_bits.get(permission, PermissionBitsets.UNKNOWN_BIT)
+        return mask
+        
+    def _resource_mask(self, resource: str) -> int:
+        return self.resource_trie.lookup(resource) or 0
+
+class PermissionBitsets:
+    """预编译的权限位集
+    
+    启动时把每个权限名分配到一个整数位，角色编译为位掩码，资源模式编译为
+    前缀树。每次鉴权只需一次 (role_mask & required) == required 运算。
+    """
+    
+    # 第0位保留给未知权限，任何角色都不会拥有
+    UNKNOWN_BIT = 1
+    
+    def __init__(self, cache_size: int = 1024):
+        self.cache_size = cache_size
+        self._compiled = CompiledPermissions({}, {}, ResourcePatternTrie(), cache_size)
+        
+    @property
+    def permission_bits(self) -> Dict[str, int]:
+        return self._compiled.permission_bits
+        
+    @property
+    def role_masks(self) -> Dict[str, int]:
+        return self._compiled.role_masks
+        
+    @property
+    def resource_trie(self) -> ResourcePatternTrie:
+        return self._compiled.resource_trie
+        
+    def compile(self, role_permissions: Dict[str, List[str]], resource_permissions: Dict[str, List[str]]):
+        """从角色/资源权限定义编译位集"""
+        permission_bits: Dict[str, int] = {}
+        for permissions in list(role_permissions.values()) + list(resource_permissions.values()):
+            for permission in permissions:
+                if permission not in permission_bits:
+                    permission_bits[permission] = 1 << (len(permission_bits) + 1)
+                    
+        def to_mask(permissions: Iterable[str]) -> int:
+            mask = 0
+            for permission in permissions:
+                mask |= permission_bits.get(permission, self.UNKNOWN_BIT)
+            return mask
+            
+        role_masks = {role: to_mask(perms) for role, perms in role_permissions.items()}
+        resource_trie = ResourcePatternTrie()
+        for pattern, perms in resource_permissions.items():
+            resource_trie.insert(pattern, to_mask(perms))
+            
+        # 单次引用赋值，读取方看到的要么是旧快照要么是新快照
+        self._compiled = CompiledPermissions(permission_bits, role_masks, resource_trie, self.cache_size)
+        
+        logger.info(f"编译权限位集: {len(permission_bits)} 个权限, {len(role_masks)} 个角色")
+        
+    def mask_of(self, permissions: Iterable[str]) -> int:
+        """所需权限列表转位掩码（按权限元组缓存），未知权限映射到保留位"""
+        return self._compiled.mask_of(tuple(permissions))
+        
+    def granted_mask_of(self, permissions: Iterable[str]) -> int:
+        """已授予权限列表转位掩码（不缓存），未知权限不授予任何位"""
+        permission_bits = self._compiled.permission_bits
+        mask = 0
+        for permission in permissions:
+            mask |= permission_bits.get(permission, 0)
+        return mask
+        
+    def role_mask(self, role: str) -> int:
+        return self._compiled.role_masks.get(role, 0)
+        
+    def resource_mask(self, resource: str) -> int:
+        """资源所需权限掩码，未定义的资源不要求任何权限"""
+        return self._compiled.resource_mask(resource)
+        
+    @staticmethod
+    def satisfies(granted_mask: int, required_mask: int) -> bool:
+        return granted_mask & required_mask == required_mask
+        
+    def has_permissions(self, granted_permissions: Iterable[str], required_permissions: Iterable[str]) -> bool:
+        """已授予的权限列表是否满足所需权限
+        
+        已编译的权限走位运算；不在任何角色/资源定义中的权限（例如单独授予
+        用户的权限）没有对应的位，按集合成员关系判断。
+        """
+        compiled = self._compiled
+        granted = set(granted_permissions)
+        required = tuple(required_permissions)
+        if not all(permission in granted for permission in required
+                   if permission not in compiled.permission_bits):
+            return False
+            
+        granted_mask = 0
+        for permission in granted:
+            granted_mask |= compiled.permission_bits.get(permission, 0)
+        return self.satisfies(granted_mask, compiled.mask_of(required) & ~self.UNKNOWN_BIT)
+        
+    def role_has_permissions(self, role: str, required_permissions: Iterable[str]) -> bool:
+        compiled = self._compiled
+        return self.satisfies(compiled.role_masks.get(role, 0), compiled.mask_of(tuple(required_permissions)))
+        
+    def role_can_access(self, role: str, resource: str) -> bool:
+        compiled = self._compiled
+        return self.satisfies(compiled.role_masks.get(role, 0), compiled.resource_mask(resource))
+
+def compile_permission_bitsets() -> PermissionBitsets:
+    """从全局权限管理器编译权限位集"""
+    bitsets = PermissionBitsets()
+    bitsets.compile(permission_manager.role_permissions, permission_manager.resource_permissions)
+    return bitsets
+
+# 启动时编译
+permission_bitsets = compile_permission_bitsets()
+
+class PermissionCache:
+    """权限缓存管理器
+    
+    角色定义变更时由处理请求的进程重新编译位集，并把定义和版本号发布到
+    Redis；其他进程在鉴权时按 version_check_interval 检查版本号，发现变化
+    即加载新定义并重新编译。
+    """
+    
+    BITSETS_VERSION_KEY = "permission_bitsets:version"
+    BITSETS_DEFINITIONS_KEY = "permission_bitsets:definitions"
+    
+    def __init__(self, version_check_interval: float = 1.0):
         self.redis_client = redis.from_url(settings.REDIS_URL)
         self.default_ttl = 3600  # 1小时
         self.role_ttl = 7200     # 2小时（角色权限变化较少）
+        self.bitsets = permission_bitsets
+        self.version_check_interval = version_check_interval
+        self._bitsets_version: Optional[int] = None
+        self._next_version_check = 0.0
+        self._sync_lock = threading.Lock()
+    
+    def sync_bitsets(self):
+        """检查其他进程发布的位集版本，有变化时加载定义并重新编译"""
+        now = time.monotonic()
+        if now < self._next_version_check or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_version_check = now + self.version_check_interval
+            version = int(self.redis_client.get(self.BITSETS_VERSION_KEY) or 0)
+            if self._bitsets_version is None:
+                # 启动时以代码中的定义为准，只记录当前版本
+                self._bitsets_version = version
+                return
+            if version == self._bitsets_version:
+                return
+            
+            definitions = self.redis_client.get(self.BITSETS_DEFINITIONS_KEY)
+            if definitions:
+                data = json.loads(definitions)
+                permission_manager.role_permissions = data['roles']
+                permission_manager.resource_permissions = data['resources']
+            self.bitsets.compile(permission_manager.role_permissions, permission_manager.resource_permissions)
+            self._bitsets_version = version
+            logger.info(f"权限位集已同步到版本 {version}")
+        except (redis.RedisError, ValueError, KeyError) as e:
+            logger.warning(f"权限位集版本同步失败，继续使用本地位集: {str(e)}")
+        finally:
+            self._sync_lock.release()
+    
+    def _publish_bitsets(self):
+        """发布当前角色/资源定义并递增版本号，通知其他进程重新编译"""
+        definitions = json.dumps({
+            'roles': permission_manager.role_permissions,
+            'resources': permission_manager.resource_permissions
+        })
+        pipe = self.redis_client.pipeline()
+        pipe.set(self.BITSETS_DEFINITIONS_KEY, definitions)
+        pipe.incr(self.BITSETS_VERSION_KEY)
+        _, version = pipe.execute()
+        self._bitsets_version = version
         
     def get_user_permissions(self, user_id: str, user_role: str) -> List[str]:
         """获取用户权限（带缓存）"""
@@ -73,32 +306,23 @@ class PermissionCache:
     
     def check_user_permission(self, user_id: str, user_role: str, required_permission: str) -> bool:
         """检查用户是否具有特定权限"""
-        permissions = self.get_user_permissions(user_id, user_role)
-        return required_permission in permissions
+        self.sync_bitsets()
+        return self.bitsets.role_has_permissions(user_role, (required_permission,))
     
     def check_user_permissions(self, user_id: str, user_role: str, required_permissions: List[str]) -> bool:
-        """检查用户是否具有所有必需权限"""
-        user_permissions = self.get_user_permissions(user_id, user_role)
-        return all(perm in user_permissions for perm in required_permissions)
+        """检查用户是否具有所有必需权限（位运算，仅定期检查位集版本）"""
+        self.sync_bitsets()
+        return self.bitsets.role_has_permissions(user_role, required_permissions)
+    
+    def check_granted_permissions(self, granted_permissions: List[str], required_permissions: List[str]) -> bool:
+        """检查已授予的权限列表（令牌或用户级缓存）是否满足所需权限"""
+        self.sync_bitsets()
+        return self.bitsets.has_permissions(granted_permissions, required_permissions)
     
     def check_resource_access(self, user_id: str, user_role: str, resource: str) -> bool:
-        """检查用户是否可以访问特定资源"""
-        cache_key = f"resource_access:{user_id}:{resource}"
-        
-        # 尝试从缓存获取
-        cached_result = self.redis_client.get(cache_key)
-        if cached_result is not None:
-            logger.debug(f"从缓存获取资源访问权限: {user_id} -> {resource}")
-            return cached_result.decode() == 'true'
-        
-        # 缓存未命中，检查权限
-        can_access = permission_manager.can_access_resource(user_role, resource)
-        
-        # 存储到缓存（较短的TTL，因为资源访问可能更动态）
-        self.redis_client.setex(cache_key, 1800, 'true' if can_access else 'false')  # 30分钟
-        
-        logger.debug(f"缓存资源访问权限: {user_id} -> {resource} = {can_access}")
-        return can_access
+        """检查用户是否可以访问特定资源（前缀树匹配 + 位运算）"""
+        self.sync_bitsets()
+        return self.bitsets.role_can_access(user_role, resource)
     
     def invalidate_user_cache(self, user_id: str):
         """清除用户相关缓存"""
@@ -120,6 +344,10 @@ class PermissionCache:
     
     def invalidate_role_cache(self, role: str):
         """清除角色相关缓存"""
+        # 角色定义可能已变化，重新编译位集并通知其他进程
+        self.bitsets.compile(permission_manager.role_permissions, permission_manager.resource_permissions)
+        self._publish_bitsets()
+        
         # 清除角色权限缓存
         self.redis_client.delete(f"role_permissions:{role}")
         
@@ -0,0 +1,157 @@
+"""已验证令牌缓存模块"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+import logging
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class VerifiedToken:
+    """已通过签名校验的令牌声明"""
+    key: str
+    claims: Dict[str, Any]
+    expires_at: float
+    user_id: Optional[str] = None
+    jti: Optional[str] = None
+    session_checked_at: float = 0.0
+    user_snapshot: Optional[Dict[str, Any]] = None
+    user_cached_at: float = 0.0
+
+class VerifiedTokenCache:
+    """有界LRU缓存：已验证的JWT声明及对应用户快照
+
+    条目在令牌自身的 exp 到期，撤销令牌时按 jti 或用户立即清除。
+    其他进程中的撤销/用户变更通过 session_check_interval 和 user_ttl
+    在有限时间内生效。
+    """
+
+    def __init__(self, max_size: int = 10000, user_ttl: float = 60.0,
+                 session_check_interval: float = 30.0):
+        self.max_size = max_size
+        self.user_ttl = user_ttl
+        self.session_check_interval = session_check_interval
+        self._entries: "OrderedDict[str, VerifiedToken]" = OrderedDict()
+        self._by_jti: Dict[str, str] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[VerifiedToken]:
+        """获取未过期的已验证令牌"""
+        key = self._token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry.expires_at <= time.time():
+                self._remove(key)
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, token: str, claims: Dict[str, Any], user_id: Optional[str] = None) -> VerifiedToken:
+        """缓存已通过签名校验的令牌声明"""
+        key = self._token_key(token)
+        entry = VerifiedToken(
+            key=key,
+            claims=claims,
+            expires_at=float(claims.get("exp", 0)),
+            user_id=str(user_id) if user_id is not None else None,
+            jti=claims.get("jti")
+        )
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            if entry.jti:
+                self._by_jti[entry.jti] = key
+            if entry.user_id:
+                self._by_user.setdefault(entry.user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.stats["evictions"] += 1
+        return entry
+
+    def session_check_due(self, entry: VerifiedToken) -> bool:
+        return time.time() - entry.session_checked_at >= self.session_check_interval
+
+    def mark_session_checked(self, entry: VerifiedToken):
+        entry.session_checked_at = time.time()
+
+    def get_user_snapshot(self, entry: VerifiedToken) -> Optional[Dict[str, Any]]:
+        if entry.user_snapshot is None or time.time() - entry.user_cached_at >= self.user_ttl:
+            return None
+        return entry.user_snapshot
+
+    def set_user_snapshot(self, entry: VerifiedToken, snapshot: Dict[str, Any]):
+        entry.user_snapshot = snapshot
+        entry.user_cached_at = time.time()
+
+    def invalidate_token(self, token: str):
+        with self._lock:
+            self._remove(self._token_key(token))
+
+    def invalidate_jti(self, jti: str):
+        """按 jti 清除（撤销单个令牌）"""
+        with self._lock:
+            key = self._by_jti.get(jti)
+            if key is not None:
+                self._remove(key)
+
+    def invalidate_user(self, user_id: str):
+        """清除用户的全部令牌（撤销全部令牌或用户信息变更）"""
+        with self._lock:
+            for key in list(self._by_user.get(str(user_id), ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_jti.clear()
+            self._by_user.clear()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if entry.jti and self._by_jti.get(entry.jti) == key:
+            del self._by_jti[entry.jti]
+        if entry.user_id:
+            keys = self._by_user.get(entry.user_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[entry.user_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, **self.stats}
+
+def snapshot_instance(instance: Any) -> Dict[str, Any]:
+    """提取ORM对象的列属性快照"""
+    mapper = sa_inspect(instance).mapper
+    return {attr.key: getattr(instance, attr.key) for attr in mapper.column_attrs}
+
+def hydrate_instance(db: Session, model: Any, snapshot: Dict[str, Any]) -> Any:
+    """由快照重建ORM对象并挂载到当前会话，不发起数据库查询"""
+    instance = model(**snapshot)
+    make_transient_to_detached(instance)
+    return db.merge(instance, load=False)
+
+# 全局实例
+verified_token_cache = VerifiedTokenCache()
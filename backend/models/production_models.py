@@ -266,4 +266,84 @@ class TemplateUsage(Base):
     # 关联关系
     template = relationship("AnswerSheetTemplate", back_populates="usages")
     exam = relationship("Exam")
-    user = relationship("User")
\ No newline at end of file
+    user = relationship("User")
+class BatchJob(Base):
+    """批处理任务 - 条目级状态持久化，进程重启后可继续处理"""
+    __tablename__ = 'batch_jobs'
+    
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    job_type = Column(String(50), nullable=False, comment='任务类型: answer_sheet_pipeline/enhanced_image')
+    exam_id = Column(String(36), comment='考试ID')
+    created_by = Column(String(36), comment='创建人ID')
+    
+    status = Column(String(20), default='created', comment='任务状态: created/queued/processing/completed/failed')
+    config = Column(JSON, comment='处理配置')
+    
+    # 进度统计（由处理节点原子累加）
+    total_items = Column(Integer, default=0)
+    completed_items = Column(Integer, default=0)
+    failed_items = Column(Integer, default=0)
+    review_items = Column(Integer, default=0)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, comment='开始处理时间')
+    completed_at = Column(DateTime, comment='完成时间')
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_batch_job_status', 'status', 'created_at'),
+        Index('idx_batch_job_exam', 'exam_id'),
+    )
+    
+    # 关联关系
+    items = relationship("BatchJobItem", back_populates="job", cascade="all, delete-orphan")
+
+class BatchJobItem(Base):
+    """批处理条目 - 由处理节点租约领取，结果逐条写回"""
+    __tablename__ = 'batch_job_items'
+    
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    job_id = Column(String(36), ForeignKey('batch_jobs.id', ondelete='CASCADE'), nullable=False)
+    item_index = Column(Integer, nullable=False, comment='批次内序号')
+    
+    status = Column(String(20), default='pending', comment='条目状态: pending/processing/completed/failed/review')
+    payload = Column(JSON, comment='处理输入（文件路径、元数据等）')
+    result = Column(JSON, comment='处理结果')
+    error_message = Column(Text, comment='错误信息')
+    
+    # 租约：处理节点崩溃后过期条目可被其他节点重新领取
+    worker_id = Column(String(100), comment='处理节点ID')
+    lease_expires_at = Column(DateTime, comment='租约过期时间')
+    attempts = Column(Integer, default=0, comment='已尝试次数')
+    
+    started_at = Column(DateTime, comment='开始处理时间')
+    completed_at = Column(DateTime, comment='完成时间')
+    # 批次内完成序号：与任务计数在同一事务中分配，按提交顺序单调递增，作为增量查询游标
+    finish_seq = Column(Integer, comment='批次内完成序号')
+    
+    # 可聚合的结果摘要，状态查询在 SQL 中统计而不加载结果 JSON
+    result_stage = Column(String(50), comment='最终处理阶段')
+    error_type = Column(String(50), comment='错误类型')
+    
+    __table_args__ = (
+        Index('idx_batch_item_job_status', 'job_id', 'status'),
+        Index('idx_batch_item_claim', 'status', 'lease_expires_at'),
+        Index('idx_batch_item_finish_seq', 'job_id', 'finish_seq'),
+    )
+    
+    # 关联关系
+    job = relationship("BatchJob", back_populates="items")
+
+class BatchJobItemMetric(Base):
+    """批处理条目数值指标 - 分数、置信度等按名称在 SQL 中聚合"""
+    __tablename__ = 'batch_job_item_metrics'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(36), ForeignKey('batch_jobs.id', ondelete='CASCADE'), nullable=False)
+    item_id = Column(String(36), ForeignKey('batch_job_items.id', ondelete='CASCADE'), nullable=False)
+    name = Column(String(100), nullable=False, comment='指标名称')
+    value = Column(Float, nullable=False)
+    
+    __table_args__ = (
+        Index('idx_batch_metric_job_name', 'job_id', 'name'),
+    )
@@ -4,8 +4,10 @@ Async Processing Pipeline for OCR and Grading
 """
 
 import asyncio
+import functools
 import json
 import logging
+import sys
 import time
 import uuid
 from abc import ABC, abstractmethod
@@ -23,6 +25,8 @@ import concurrent.futures
 import multiprocessing as mp
 from contextlib import asynccontextmanager
 
+from services.result_retention import RetentionStore, TaskRecord
+
 logger = logging.getLogger(__name__)
 
 class TaskStatus(str, Enum):
@@ -90,6 +94,8 @@ class TaskInstance:
     # 执行信息
     worker_id: Optional[str] = None
     retry_count: int = 0
+    # 调度优先级：被更高优先级的下游任务依赖时继承其优先级
+    effective_priority: Optional[TaskPriority] = None
     error_message: Optional[str] = None
     execution_log: List[str] = field(default_factory=list)
     
@@ -97,6 +103,10 @@ class TaskInstance:
     processing_time: float = 0.0
     resource_usage: Dict[str, Any] = field(default_factory=dict)
     
+    def __post_init__(self):
+        if self.effective_priority is None:
+            self.effective_priority = self.task_def.priority
+    
     @property
     def duration(self) -> Optional[float]:
         """任务执行时长"""
@@ -116,7 +126,19 @@ class TaskInstance:
         return result
 
 class TaskProcessor(ABC):
-    """任务处理器接口"""
+    """任务处理器接口
+    
+    execution_mode 为 "process" 的处理器在进程池中执行，每个子进程
+    构造一次处理器实例并调用 warm_up 加载模型、模板等常驻状态。
+    子进程中的实例默认由注册的实例 pickle 复制而来（spawn 启动），
+    不可 pickle 时注册时传入 processor_factory。
+    """
+    
+    execution_mode = "async"
+    
+    def warm_up(self):
+        """子进程启动时加载常驻状态"""
+        pass
     
     @abstractmethod
     async def process(self, task: TaskInstance) -> Dict[str, Any]:
@@ -136,6 +158,8 @@ class TaskProcessor(ABC):
 class OCRProcessor(TaskProcessor):
     """OCR处理器"""
     
+    execution_mode = "process"
+    
     def __init__(self):
         self.supported_formats = ['.jpg', '.jpeg', '.png', '.pdf', '.tiff']
         
@@ -250,6 +274,8 @@ class GradingProcessor(TaskProcessor):
 class PreprocessingProcessor(TaskProcessor):
     """预处理器"""
     
+    execution_mode = "process"
+    
     async def process(self, task: TaskInstance) -> Dict[str, Any]:
         """执行预处理"""
         task.add_log("Starting image preprocessing")
@@ -285,6 +311,8 @@ class WorkerPool:
         self.max_workers = max_workers
         self.worker_type = worker_type
         self.active_workers: Dict[str, TaskInstance] = {}
+        # 工作槽在任务结束之外的时机释放时回调（由编排器设置以唤醒调度）
+        self.on_slot_released: Optional[Callable[[], None]] = None
         self.worker_stats: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
             'tasks_completed': 0,
             'tasks_failed': 0,
@@ -301,7 +329,9 @@ class WorkerPool:
         if not self.is_available():
             raise RuntimeError("No available workers")
             
-        worker_id = f"{self.worker_type}_worker_{len(self.active_workers)}"
+        slot = next(i for i in range(self.max_workers)
+                    if f"{self.worker_type}_worker_{i}" not in self.active_workers)
+        worker_id = f"{self.worker_type}_worker_{slot}"
         self.active_workers[worker_id] = task
         task.worker_id = worker_id
         
@@ -320,48 +350,314 @@ class WorkerPool:
         stats['total_processing_time'] += processing_time
         stats['last_active'] = datetime.now()
         
+    async def run(self, processor: TaskProcessor, task: TaskInstance) -> Dict[str, Any]:
+        """在事件循环中执行任务"""
+        return await processor.process(task)
+        
+    def shutdown(self):
+        """释放工作池资源"""
+        pass
+        
     def get_stats(self) -> Dict[str, Any]:
         """获取工作池统计"""
         return {
             'worker_type': self.worker_type,
+            'pool_kind': 'async',
             'max_workers': self.max_workers,
             'active_workers': len(self.active_workers),
             'available_workers': self.max_workers - len(self.active_workers),
             'worker_stats': dict(self.worker_stats)
         }
 
+# 子进程内的处理器实例与事件循环（由进程池 initializer 创建）
+_process_processor: Optional[TaskProcessor] = None
+_process_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _processor_copy(processor: TaskProcessor) -> TaskProcessor:
+    """默认 processor_factory：实例随 initargs pickle 到子进程，直接返回该副本"""
+    return processor
+
+def _limit_process_memory(memory_limit_mb: Optional[int]):
+    """用 RLIMIT_AS 限制子进程地址空间，任务中超限的分配抛出 MemoryError
+    
+    Windows 没有 resource 模块、macOS 不强制 RLIMIT_AS，此时只能依赖
+    任务结束后的峰值内存检查。
+    """
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Cannot enforce worker memory limit of {memory_limit_mb}MB: {e}")
+
+def _init_process_worker(processor_factory: Callable[[], TaskProcessor],
+                         memory_limit_mb: Optional[int] = None):
+    """进程池 initializer：构造处理器并预热，然后设置内存上限"""
+    global _process_processor, _process_loop
+    _process_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_process_loop)
+    _process_processor = processor_factory()
+    _process_processor.warm_up()
+    _limit_process_memory(memory_limit_mb)
+
+def _peak_memory_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss 在 Linux 上单位为 KB，macOS 上为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _run_in_process_worker(task: TaskInstance) -> Dict[str, Any]:
+    """在子进程中执行任务，返回结果、执行日志和进程峰值内存"""
+    output = _process_loop.run_until_complete(_process_processor.process(task))
+    peak_memory_mb = _peak_memory_mb()
+    return {
+        'output': output,
+        'execution_log': task.execution_log,
+        'pid': mp.current_process().pid,
+        'peak_memory_mb': peak_memory_mb
+    }
+
+# ProcessPoolExecutor 的 max_tasks_per_child 需要 Python 3.11+
+SUPPORTS_MAX_TASKS_PER_CHILD = sys.version_info >= (3, 11)
+
+class ProcessWorkerPool(WorkerPool):
+    """进程工作池：CPU密集阶段在子进程中执行，不阻塞编排器事件循环
+    
+    - 子进程常驻处理器实例（模型、模板只加载一次）
+    - 每个子进程执行 max_tasks_per_worker 个任务后回收；Python 3.11 以下
+      改为进程池累计执行 max_tasks_per_worker * max_workers 个任务后整体替换
+    - 子进程地址空间以 RLIMIT_AS 限制为 memory_limit_mb（预热之后设置），
+      任务中超限的分配抛出 MemoryError 并整体替换进程池；不支持 RLIMIT_AS
+      的平台上，任务结束后峰值内存超限同样替换进程池，旧进程池在当前任务完成后退出
+    - 超时或取消时子进程中的任务无法中断，其工作槽保持占用直到任务实际结束
+    """
+    
+    def __init__(self, processor_factory: Callable[[], TaskProcessor],
+                 max_workers: Optional[int] = None, worker_type: str = "general",
+                 max_tasks_per_worker: Optional[int] = 200,
+                 memory_limit_mb: Optional[int] = 2048):
+        super().__init__(max_workers=max_workers or mp.cpu_count(), worker_type=worker_type)
+        self.processor_factory = processor_factory
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.memory_limit_mb = memory_limit_mb
+        self.executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.executor_tasks = 0
+        # 调用方已放弃（超时/取消）但仍在子进程中运行的任务
+        self.abandoned_futures: Set[concurrent.futures.Future] = set()
+        self.pool_stats = {
+            'pool_restarts': 0,
+            'memory_recycles': 0,
+            'task_count_recycles': 0,
+            'abandoned_tasks': 0,
+            'peak_memory_mb': 0.0
+        }
+        
+    def is_available(self) -> bool:
+        return len(self.active_workers) + len(self.abandoned_futures) < self.max_workers
+        
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        if (self.executor is not None and not SUPPORTS_MAX_TASKS_PER_CHILD and self.max_tasks_per_worker
+                and self.executor_tasks >= self.max_tasks_per_worker * self.max_workers):
+            self.pool_stats['task_count_recycles'] += 1
+            self._recycle_executor()
+        if self.executor is None:
+            options = {}
+            if SUPPORTS_MAX_TASKS_PER_CHILD and self.max_tasks_per_worker:
+                options['max_tasks_per_child'] = self.max_tasks_per_worker
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_process_worker,
+                initargs=(self.processor_factory, self.memory_limit_mb),
+                **options
+            )
+            self.executor_tasks = 0
+        return self.executor
+        
+    def _recycle_executor(self):
+        """替换进程池，旧进程在当前任务完成后退出"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            self.pool_stats['pool_restarts'] += 1
+            
+    def _hold_slot(self, future: concurrent.futures.Future, loop: asyncio.AbstractEventLoop):
+        """已放弃的任务结束前继续占用工作槽"""
+        self.abandoned_futures.add(future)
+        self.pool_stats['abandoned_tasks'] += 1
+        
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(self._release_slot, future)
+            except RuntimeError:
+                # 事件循环已关闭
+                self.abandoned_futures.discard(future)
+        future.add_done_callback(release)
+        
+    def _release_slot(self, future: concurrent.futures.Future):
+        self.abandoned_futures.discard(future)
+        if self.on_slot_released is not None:
+            self.on_slot_released()
+            
+    async def run(self, processor: TaskProcessor, task: TaskInstance) -> Dict[str, Any]:
+        """在子进程中执行任务，并将执行日志合并回任务实例"""
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        
+        future = executor.submit(_run_in_process_worker, task)
+        self.executor_tasks += 1
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 未开始的任务已随取消撤回；已在子进程中运行的任务无法中断
+            if not future.done():
+                self._hold_slot(future, loop)
+            raise
+        except concurrent.futures.process.BrokenProcessPool:
+            # 子进程异常退出（如被OOM终止），下次提交使用新进程池
+            if self.executor is executor:
+                self._recycle_executor()
+            raise
+        except MemoryError:
+            # 超出 RLIMIT_AS 上限，子进程状态不可靠，替换进程池
+            logger.warning(f"{self.worker_type} task {task.instance_id} exceeded {self.memory_limit_mb}MB")
+            if self.executor is executor:
+                self.pool_stats['memory_recycles'] += 1
+                self._recycle_executor()
+            raise
+            
+        task.execution_log = result['execution_log']
+        task.resource_usage.update({'pid': result['pid'], 'peak_memory_mb': result['peak_memory_mb']})
+        
+        peak_memory_mb = result['peak_memory_mb']
+        self.pool_stats['peak_memory_mb'] = max(self.pool_stats['peak_memory_mb'], peak_memory_mb)
+        if self.memory_limit_mb and peak_memory_mb > self.memory_limit_mb and self.executor is executor:
+            logger.warning(
+                f"{self.worker_type} worker {result['pid']} peaked at {peak_memory_mb:.0f}MB, "
+                f"recycling process pool"
+            )
+            self.pool_stats['memory_recycles'] += 1
+            self._recycle_executor()
+            
+        return result['output']
+        
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.abandoned_futures.clear()
+            
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats.update({
+            'pool_kind': 'process',
+            'active_workers': len(self.active_workers) + len(self.abandoned_futures),
+            'available_workers': self.max_workers - len(self.active_workers) - len(self.abandoned_futures),
+            'abandoned_running': len(self.abandoned_futures),
+            'max_tasks_per_worker': self.max_tasks_per_worker,
+            'memory_limit_mb': self.memory_limit_mb,
+            **self.pool_stats
+        })
+        return stats
+
+SCHEDULING_ORDER = [TaskPriority.CRITICAL, TaskPriority.HIGH, TaskPriority.NORMAL, TaskPriority.LOW]
+# 数值越大越紧急
+PRIORITY_RANK = {priority: rank for rank, priority in enumerate(reversed(SCHEDULING_ORDER))}
+# 终止状态：不会再完成，依赖它的任务级联取消
+TERMINAL_FAILURE_STATUSES = (TaskStatus.FAILED, TaskStatus.CANCELLED)
+
 class PipelineOrchestrator:
-    """管道编排器"""
+    """管道编排器
     
-    def __init__(self):
+    调度由事件驱动：提交、任务完成和工作池释放时唤醒调度器。
+    依赖按入度计数（Kahn），依赖全部完成的任务才进入所属工作池的
+    就绪队列，就绪任务不会被队列中前面的未就绪任务阻塞。
+    
+    上游任务继承依赖它的最高优先级（优先级继承），避免紧急任务被
+    低优先级依赖拖住；上游失败或取消时，下游任务沿依赖图级联取消。
+    
+    已结束的任务实例按 TTL/数量上限保留（大结果可溢写到 spill_dir），
+    依赖判断使用保留更久的紧凑 TaskRecord。
+    """
+    
+    def __init__(
+        self,
+        completed_retention: int = 1000,
+        completed_ttl: float = 3600.0,
+        record_retention: int = 100000,
+        record_ttl: float = 86400.0,
+        spill_dir: Optional[str] = None
+    ):
         self.processors: Dict[str, TaskProcessor] = {}
         self.worker_pools: Dict[str, WorkerPool] = {}
-        self.task_queue: Dict[TaskPriority, deque] = {
-            priority: deque() for priority in TaskPriority
-        }
+        # 就绪队列：处理器类型 -> 优先级 -> 任务
+        self.ready_queues: Dict[str, Dict[TaskPriority, deque]] = {}
+        self.queued_tasks: Dict[str, TaskInstance] = {}
+        # 等待依赖的任务及其未完成依赖数
+        self.waiting_tasks: Dict[str, TaskInstance] = {}
+        self.pending_dependencies: Dict[str, int] = {}
+        self.dependents: Dict[str, Set[str]] = defaultdict(set)
         self.running_tasks: Dict[str, TaskInstance] = {}
-        self.completed_tasks: Dict[str, TaskInstance] = {}
+        self.execution_tasks: Dict[str, asyncio.Task] = {}
+        # 退避等待重试的任务
+        self.retrying_tasks: Dict[str, TaskInstance] = {}
+        self.completed_tasks = RetentionStore(
+            max_items=completed_retention, ttl_seconds=completed_ttl,
+            spill_dir=spill_dir, name="pipeline"
+        )
+        # 已结束任务的紧凑记录：task_id -> TaskRecord
+        self.task_records = RetentionStore(max_items=record_retention, ttl_seconds=record_ttl)
         self.pipeline_definitions: Dict[str, List[PipelineStage]] = {}
         
         self.running = False
         self.scheduler_task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._dirty_pools: Set[str] = set()
         
         # 统计信息
         self.stats = {
             'total_tasks': 0,
             'completed_tasks': 0,
             'failed_tasks': 0,
+            'cancelled_tasks': 0,
+            'priority_boosts': 0,
             'average_processing_time': 0.0
         }
         
-    def register_processor(self, processor: TaskProcessor):
-        """注册处理器"""
+    def register_processor(self, processor: TaskProcessor, max_workers: Optional[int] = None,
+                           processor_factory: Optional[Callable[[], TaskProcessor]] = None,
+                           **pool_options):
+        """注册处理器
+        
+        execution_mode 为 "process" 的处理器使用进程工作池（默认每核一个进程），
+        子进程用 processor_factory 构造处理器（默认 pickle 复制 processor，
+        保留构造参数），pool_options 传给 ProcessWorkerPool
+        （max_tasks_per_worker、memory_limit_mb）。
+        """
         processor_type = processor.get_processor_type()
         self.processors[processor_type] = processor
         
         # 为每种处理器类型创建工作池
         if processor_type not in self.worker_pools:
-            self.worker_pools[processor_type] = WorkerPool(max_workers=4, worker_type=processor_type)
+            if processor.execution_mode == "process":
+                self.worker_pools[processor_type] = ProcessWorkerPool(
+                    processor_factory=processor_factory or functools.partial(_processor_copy, processor),
+                    max_workers=max_workers,
+                    worker_type=processor_type,
+                    **pool_options
+                )
+            else:
+                self.worker_pools[processor_type] = WorkerPool(max_workers=max_workers or 4, worker_type=processor_type)
+            self.worker_pools[processor_type].on_slot_released = lambda: self._notify(processor_type)
+        self.ready_queues.setdefault(processor_type, {priority: deque() for priority in TaskPriority})
             
         logger.info(f"Registered processor: {processor_type}")
         
@@ -376,6 +672,9 @@ class PipelineOrchestrator:
             return
             
         self.running = True
+        self._wakeup = asyncio.Event()
+        self._dirty_pools.update(self.ready_queues)
+        self._wakeup.set()
         self.scheduler_task = asyncio.create_task(self._scheduler_loop())
         
         logger.info("Pipeline orchestrator started")
@@ -401,6 +700,9 @@ class PipelineOrchestrator:
                 self._wait_for_task(task) for task in self.running_tasks.values()
             ], return_exceptions=True)
             
+        for worker_pool in self.worker_pools.values():
+            worker_pool.shutdown()
+            
         logger.info("Pipeline orchestrator stopped")
         
     async def submit_task(self, task_def: TaskDefinition, input_data: Dict[str, Any]) -> str:
@@ -421,10 +723,32 @@ class PipelineOrchestrator:
         if not processor.validate_input(input_data):
             raise ValueError("Input validation failed")
             
-        # 加入队列
-        self.task_queue[task_def.priority].append(task_instance)
         self.stats['total_tasks'] += 1
         
+        # 依赖已失败或取消：任务直接取消
+        for dep_task_id in task_def.depends_on:
+            dep_task = self.task_records.get(dep_task_id)
+            if dep_task and dep_task.status in TERMINAL_FAILURE_STATUSES:
+                self._finish_cancelled(
+                    task_instance, f"Dependency {dep_task_id} {dep_task.status.value}"
+                )
+                return instance_id
+                
+        # 统计未完成依赖，全部完成则直接就绪
+        unmet = []
+        for dep_task_id in task_def.depends_on:
+            dep_task = self.task_records.get(dep_task_id)
+            if not dep_task or dep_task.status != TaskStatus.COMPLETED:
+                self.dependents[dep_task_id].add(instance_id)
+                unmet.append(dep_task_id)
+                
+        if unmet:
+            self.waiting_tasks[instance_id] = task_instance
+            self.pending_dependencies[instance_id] = len(unmet)
+            self._inherit_priority(unmet, task_instance.effective_priority)
+        else:
+            self._enqueue_ready(task_instance)
+        
         logger.info(f"Submitted task: {instance_id} ({task_def.task_type})")
         
         return instance_id
@@ -470,81 +794,192 @@ class PipelineOrchestrator:
         if task_id in self.running_tasks:
             return self.running_tasks[task_id]
             
-        # 检查已完成的任务
-        if task_id in self.completed_tasks:
-            return self.completed_tasks[task_id]
+        # 检查已完成的任务（超出保留期后返回 None）
+        task = self.completed_tasks.get(task_id)
+        if task is not None:
+            return task
             
-        # 检查队列中的任务
-        for priority_queue in self.task_queue.values():
-            for task in priority_queue:
-                if task.instance_id == task_id:
-                    return task
-                    
-        return None
+        # 检查等待依赖的任务
+        if task_id in self.waiting_tasks:
+            return self.waiting_tasks[task_id]
+            
+        # 检查就绪队列和等待重试的任务
+        return self.queued_tasks.get(task_id) or self.retrying_tasks.get(task_id)
         
     async def cancel_task(self, task_id: str) -> bool:
-        """取消任务"""
-        # 从队列中移除
-        for priority_queue in self.task_queue.values():
-            for i, task in enumerate(priority_queue):
-                if task.instance_id == task_id:
-                    task.status = TaskStatus.CANCELLED
-                    del priority_queue[i]
-                    logger.info(f"Cancelled queued task: {task_id}")
-                    return True
+        """取消任务，依赖它的下游任务级联取消"""
+        # 从等待依赖的任务中移除
+        task = self.waiting_tasks.pop(task_id, None)
+        if task is not None:
+            self.pending_dependencies.pop(task_id, None)
+            for dep_task_id in task.task_def.depends_on:
+                self._discard_dependent(dep_task_id, task_id)
+            self._finish_cancelled(task, "Cancelled")
+            logger.info(f"Cancelled waiting task: {task_id}")
+            return True
+            
+        # 从就绪队列或重试等待中移除
+        task = self.queued_tasks.get(task_id)
+        if task is not None:
+            self._remove_ready(task)
+        else:
+            task = self.retrying_tasks.pop(task_id, None)
+        if task is not None:
+            self._finish_cancelled(task, "Cancelled")
+            logger.info(f"Cancelled queued task: {task_id}")
+            return True
                     
-        # 取消正在运行的任务
+        # 中断正在运行的任务，_run_task 结束时记录取消并级联
         if task_id in self.running_tasks:
             task = self.running_tasks[task_id]
             task.status = TaskStatus.CANCELLED
-            # 这里应该实现任务中断逻辑
+            task.error_message = "Cancelled"
+            execution_task = self.execution_tasks.get(task_id)
+            if execution_task is not None:
+                execution_task.cancel()
             logger.info(f"Cancelled running task: {task_id}")
             return True
             
         return False
         
+    def _finish_cancelled(self, task: TaskInstance, reason: str):
+        """记录取消的任务并级联取消下游"""
+        task.status = TaskStatus.CANCELLED
+        task.error_message = reason
+        task.completed_at = datetime.now()
+        self._record_finished(task)
+        self.stats['cancelled_tasks'] += 1
+        self._cascade_failure(task)
+        
+    def _record_finished(self, task: TaskInstance):
+        """保存已结束的任务实例和紧凑记录"""
+        self.completed_tasks[task.instance_id] = task
+        self.task_records[task.instance_id] = TaskRecord(
+            task.instance_id, task.status, task.created_at,
+            task.started_at, task.completed_at, task.error_message
+        )
+        
+    def _cascade_failure(self, task: TaskInstance):
+        """上游失败或取消：等待它的下游任务全部取消（沿依赖图传递）"""
+        stack = [task]
+        while stack:
+            upstream = stack.pop()
+            for dependent_id in self.dependents.pop(upstream.instance_id, ()):
+                dependent = self.waiting_tasks.pop(dependent_id, None)
+                if dependent is None:
+                    continue
+                self.pending_dependencies.pop(dependent_id, None)
+                for dep_task_id in dependent.task_def.depends_on:
+                    self._discard_dependent(dep_task_id, dependent_id)
+                    
+                dependent.status = TaskStatus.CANCELLED
+                dependent.error_message = f"Dependency {upstream.instance_id} {upstream.status.value}"
+                dependent.completed_at = datetime.now()
+                dependent.add_log(f"Cancelled: {dependent.error_message}")
+                self._record_finished(dependent)
+                self.stats['cancelled_tasks'] += 1
+                stack.append(dependent)
+                
+    def _inherit_priority(self, task_ids: List[str], priority: TaskPriority):
+        """上游任务继承下游的优先级，等待中的上游继续向其依赖传递"""
+        stack = list(task_ids)
+        visited = set()
+        while stack:
+            task_id = stack.pop()
+            if task_id in visited:
+                continue
+            visited.add(task_id)
+            
+            # 运行中的任务已无需调度，不再处理
+            task = (self.waiting_tasks.get(task_id) or self.queued_tasks.get(task_id)
+                    or self.retrying_tasks.get(task_id))
+            if task is None or PRIORITY_RANK[task.effective_priority] >= PRIORITY_RANK[priority]:
+                continue
+                
+            # 就绪任务移到新优先级队列尾部
+            if task_id in self.queued_tasks:
+                self._remove_ready(task)
+                task.effective_priority = priority
+                self._enqueue_ready(task)
+            else:
+                task.effective_priority = priority
+            self.stats['priority_boosts'] += 1
+            task.add_log(f"Priority inherited: {priority.value}")
+            
+            if task_id in self.waiting_tasks:
+                stack.extend(task.task_def.depends_on)
+                
+    def _remove_ready(self, task: TaskInstance):
+        queue = self.ready_queues[task.task_def.task_type][task.effective_priority]
+        queue.remove(task)
+        del self.queued_tasks[task.instance_id]
+        
+    def _discard_dependent(self, dep_task_id: str, task_id: str):
+        dependents = self.dependents.get(dep_task_id)
+        if dependents is not None:
+            dependents.discard(task_id)
+            if not dependents:
+                del self.dependents[dep_task_id]
+                
+    def _enqueue_ready(self, task: TaskInstance, front: bool = False):
+        """任务进入所属工作池的就绪队列并唤醒调度器"""
+        processor_type = task.task_def.task_type
+        queue = self.ready_queues[processor_type][task.effective_priority]
+        if front:
+            queue.appendleft(task)
+        else:
+            queue.append(task)
+        self.queued_tasks[task.instance_id] = task
+        self._notify(processor_type)
+        
+    def _notify(self, processor_type: str):
+        self._dirty_pools.add(processor_type)
+        self._wakeup.set()
+        
+    def _release_dependents(self, task_id: str):
+        """依赖完成：下游任务入度减一，归零即就绪"""
+        for dependent_id in self.dependents.pop(task_id, ()):
+            remaining = self.pending_dependencies.get(dependent_id)
+            if remaining is None:
+                continue
+            if remaining > 1:
+                self.pending_dependencies[dependent_id] = remaining - 1
+                continue
+            del self.pending_dependencies[dependent_id]
+            self._enqueue_ready(self.waiting_tasks.pop(dependent_id))
+            
     async def _scheduler_loop(self):
-        """调度器循环"""
+        """调度器循环：等待提交/完成/释放信号"""
         while self.running:
             try:
+                await self._wakeup.wait()
+                self._wakeup.clear()
                 await self._schedule_tasks()
-                await asyncio.sleep(0.1)  # 调度间隔
+            except asyncio.CancelledError:
+                break
             except Exception as e:
                 logger.error(f"Scheduler error: {str(e)}")
                 await asyncio.sleep(1)
                 
     async def _schedule_tasks(self):
-        """调度任务"""
-        # 按优先级处理任务
-        for priority in [TaskPriority.CRITICAL, TaskPriority.HIGH, TaskPriority.NORMAL, TaskPriority.LOW]:
-            queue = self.task_queue[priority]
-            
-            while queue:
-                task = queue[0]  # 查看队列头部
-                
-                # 检查依赖
-                if not self._check_dependencies(task):
-                    break  # 依赖未满足，跳出当前优先级
-                    
-                # 检查资源
-                processor_type = task.task_def.task_type
-                worker_pool = self.worker_pools.get(processor_type)
+        """调度任务：只处理有变化的工作池，按优先级派发至工作池满"""
+        dirty_pools, self._dirty_pools = self._dirty_pools, set()
+        
+        for processor_type in dirty_pools:
+            worker_pool = self.worker_pools.get(processor_type)
+            priority_queues = self.ready_queues.get(processor_type)
+            if not worker_pool or not priority_queues:
+                continue
                 
-                if not worker_pool or not worker_pool.is_available():
-                    break  # 资源不足
-                    
-                # 开始执行任务
-                queue.popleft()
-                await self._execute_task(task)
+            for priority in SCHEDULING_ORDER:
+                queue = priority_queues[priority]
+                while queue and worker_pool.is_available():
+                    task = queue.popleft()
+                    del self.queued_tasks[task.instance_id]
+                    await self._execute_task(task)
+                if not worker_pool.is_available():
+                    break
                 
-    def _check_dependencies(self, task: TaskInstance) -> bool:
-        """检查任务依赖"""
-        for dep_task_id in task.task_def.depends_on:
-            dep_task = self.completed_tasks.get(dep_task_id)
-            if not dep_task or dep_task.status != TaskStatus.COMPLETED:
-                return False
-        return True
-        
     async def _execute_task(self, task: TaskInstance):
         """执行任务"""
         processor_type = task.task_def.task_type
@@ -558,8 +993,8 @@ class PipelineOrchestrator:
         task.started_at = datetime.now()
         self.running_tasks[task.instance_id] = task
         
-        # 创建执行任务
-        execution_task = asyncio.create_task(
+        # 创建执行任务（保留引用以便取消）
+        self.execution_tasks[task.instance_id] = asyncio.create_task(
             self._run_task(task, processor, worker_pool)
         )
         
@@ -573,7 +1008,7 @@ class PipelineOrchestrator:
         try:
             # 设置超时
             result = await asyncio.wait_for(
-                processor.process(task),
+                worker_pool.run(processor, task),
                 timeout=task.task_def.timeout
             )
             
@@ -589,6 +1024,11 @@ class PipelineOrchestrator:
             task.error_message = "Task timeout"
             task.add_log("Task failed: timeout")
             
+        except asyncio.CancelledError:
+            task.status = TaskStatus.CANCELLED
+            task.error_message = task.error_message or "Cancelled"
+            task.add_log("Task cancelled")
+            
         except Exception as e:
             task.status = TaskStatus.FAILED
             task.error_message = str(e)
@@ -599,10 +1039,12 @@ class PipelineOrchestrator:
                 task.retry_count += 1
                 task.status = TaskStatus.RETRYING
                 task.add_log(f"Retrying task (attempt {task.retry_count})")
+                self.retrying_tasks[task.instance_id] = task
                 
-                # 重新入队
-                await asyncio.sleep(2 ** task.retry_count)  # 指数退避
-                self.task_queue[task.task_def.priority].appendleft(task)
+                # 指数退避后重新入队，退避期间不占用工作槽
+                asyncio.get_running_loop().call_later(
+                    2 ** task.retry_count, self._requeue_retry, task
+                )
                 
         finally:
             processing_time = time.time() - start_time
@@ -614,10 +1056,14 @@ class PipelineOrchestrator:
             # 从运行任务中移除
             if task.instance_id in self.running_tasks:
                 del self.running_tasks[task.instance_id]
+            self.execution_tasks.pop(task.instance_id, None)
+                
+            # 工作槽释放
+            self._notify(task.task_def.task_type)
                 
             # 添加到已完成任务
             if task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED]:
-                self.completed_tasks[task.instance_id] = task
+                self._record_finished(task)
                 
                 if success:
                     self.stats['completed_tasks'] += 1
@@ -629,6 +1075,23 @@ class PipelineOrchestrator:
                     total_time = self.stats['average_processing_time'] * (self.stats['completed_tasks'] - 1) + processing_time
                     self.stats['average_processing_time'] = total_time / self.stats['completed_tasks']
                     
+            if success:
+                self._release_dependents(task.instance_id)
+            elif task.status == TaskStatus.CANCELLED:
+                task.completed_at = datetime.now()
+                self._record_finished(task)
+                self.stats['cancelled_tasks'] += 1
+                self._cascade_failure(task)
+            elif task.status == TaskStatus.FAILED:
+                self._cascade_failure(task)
+                    
+    def _requeue_retry(self, task: TaskInstance):
+        """重试任务回到就绪队列头部"""
+        if self.retrying_tasks.pop(task.instance_id, None) is None:
+            return
+        task.status = TaskStatus.PENDING
+        self._enqueue_ready(task, front=True)
+        
     async def _wait_for_task(self, task: TaskInstance):
         """等待任务完成"""
         while task.status in [TaskStatus.PENDING, TaskStatus.RUNNING, TaskStatus.RETRYING]:
@@ -640,10 +1103,17 @@ class PipelineOrchestrator:
             'timestamp': datetime.now().isoformat(),
             'orchestrator_stats': self.stats.copy(),
             'queue_lengths': {
-                priority.value: len(queue) for priority, queue in self.task_queue.items()
+                priority.value: sum(len(queues[priority]) for queues in self.ready_queues.values())
+                for priority in TaskPriority
             },
+            'waiting_tasks': len(self.waiting_tasks),
+            'retrying_tasks': len(self.retrying_tasks),
             'running_tasks': len(self.running_tasks),
             'completed_tasks': len(self.completed_tasks),
+            'retention': {
+                'completed_tasks': self.completed_tasks.get_stats(),
+                'task_records': self.task_records.get_stats()
+            },
             'worker_pools': {
                 name: pool.get_stats() for name, pool in self.worker_pools.items()
             }
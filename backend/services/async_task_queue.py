@@ -3,20 +3,34 @@ Asynchronous Task Queue - Redis-based Task Processing
 智阅3.0重构第二阶段：异步任务队列系统
 
 Features:
-- Priority-based task queues (high, normal, low)
+- Priority-, deadline- and cost-aware task scheduling
 - Task retry mechanism with exponential backoff
 - Task status tracking and monitoring
 - Worker pool management
 - Task result storage and retrieval
 - Dead letter queue for failed tasks
+
+就绪任务保存在一个 ZSET 中，分数为最晚开始时间（EDF/SJF 混合）：
+- 有截止时间：deadline - 预估耗时
+- 无截止时间：入队时间 + 该优先级最长等待 + 预估耗时（短任务优先）
+每个优先级的最长等待同时作为隐式截止时间，低优先级任务不会被持续饿死。
+
+出队由 Lua 脚本按分数原子弹出并登记租约，空闲 worker 阻塞在就绪信号
+列表上，有任务入队立即唤醒。延迟任务由单一 leader 定时器按最近到期
+时间唤醒并原子迁移到就绪队列。
+
+处理中的任务以租约记录（ZSET 按到期时间排序），worker 心跳续期；
+leader 定时器同时回收过期租约并将任务放回队首，保证至少处理一次。
 """
 
 import asyncio
 import json
 import logging
+import os
+import socket
 import time
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Callable, Union
+from typing import Any, Dict, List, Optional, Callable, Set, Union
 from dataclasses import dataclass, asdict
 from enum import Enum
 from uuid import uuid4
@@ -31,6 +45,174 @@ class TaskPriority(str, Enum):
     LOW = "low"
 
 
+# 到期延迟任务迁移到就绪 ZSET（分数取任务的 schedule_score），返回迁移数量和下一个到期时间
+PROMOTE_SCHEDULED_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, payload in ipairs(due) do
+    -- 旧版 payload 没有分数，按当前时间入队
+    local score = cjson.decode(payload)['schedule_score']
+    if type(score) ~= 'number' then
+        score = ARGV[1]
+    end
+    redis.call('ZADD', KEYS[2], score, payload)
+    redis.call('LPUSH', KEYS[3], 1)
+    redis.call('ZREM', KEYS[1], payload)
+end
+local nxt = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {#due, nxt[2] or ''}
+"""
+
+# 调度 leader 租约：持有者续期，否则尝试抢占
+SCHEDULER_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# 租约相关脚本的 KEYS 约定：
+# ready_tasks(ZSET 就绪任务), leases(ZSET id->到期时间), leased(HASH id->租约记录), ready(就绪信号),
+# deliveries(HASH id->投递次数), failed(死信列表)
+
+# 批量认领：按分数弹出最多 n 个任务并登记租约（含投递次数），就绪信号裁剪为剩余任务数
+CLAIM_TASKS_SCRIPT = """
+local claimed = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+for _, payload in ipairs(claimed) do
+    redis.call('ZREM', KEYS[1], payload)
+    local id = cjson.decode(payload)['id']
+    local deliveries = redis.call('HINCRBY', KEYS[5], id, 1)
+    redis.call('ZADD', KEYS[2], ARGV[2], id)
+    redis.call('HSET', KEYS[3], id, cjson.encode({
+        task = payload, worker_id = ARGV[3], claimed_at = ARGV[4], deliveries = deliveries
+    }))
+end
+local remaining = redis.call('ZCARD', KEYS[1])
+if remaining == 0 then
+    redis.call('DEL', KEYS[4])
+else
+    redis.call('LTRIM', KEYS[4], 0, remaining - 1)
+end
+return claimed
+"""
+
+# 心跳续期：仅续期仍归该 worker 持有的租约
+EXTEND_LEASES_SCRIPT = """
+local extended = 0
+for i = 3, #ARGV do
+    local lease = redis.call('HGET', KEYS[2], ARGV[i])
+    if lease and cjson.decode(lease)['worker_id'] == ARGV[1] then
+        redis.call('ZADD', KEYS[1], 'XX', ARGV[2], ARGV[i])
+        extended = extended + 1
+    end
+end
+return extended
+"""
+
+# 迁移旧版 :high/:normal/:low 列表：ARGV 为 (旧 payload, 新 payload, 分数) 三元组，
+# LREM 成功才加入就绪 ZSET，多个节点同时迁移也不会重复入队
+MIGRATE_LEGACY_SCRIPT = """
+local moved = 0
+for i = 1, #ARGV, 3 do
+    if redis.call('LREM', KEYS[1], 1, ARGV[i]) == 1 then
+        redis.call('ZADD', KEYS[2], ARGV[i + 2], ARGV[i + 1])
+        redis.call('LPUSH', KEYS[3], 1)
+        moved = moved + 1
+    end
+end
+return moved
+"""
+
+# 确认完成：仅当租约仍归该 worker 持有时删除租约（ARGV[2] 为空则不校验持有者），
+# 返回 0 表示租约已过期或被其他 worker 重新认领
+ACK_LEASE_SCRIPT = """
+if ARGV[2] ~= '' then
+    local lease = redis.call('HGET', KEYS[2], ARGV[1])
+    if not lease or cjson.decode(lease)['worker_id'] ~= ARGV[2] then
+        return 0
+    end
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+return 1
+"""
+
+# 放回就绪队列：ARGV[1] = 'expired'（回收到期租约，ARGV[2]=now, ARGV[3]=limit）
+# 或 'release'（worker 主动归还，ARGV[2]=worker_id, ARGV[3..]=task_ids）。
+# 到期回收时投递次数超过 max_retries 的任务转入死信列表，不再放回；
+# 主动归还的任务未开始处理，不计投递次数。
+# 返回放回数量、下一个租约到期时间、放回的任务 ID 和转入死信的任务 ID
+REQUEUE_LEASES_SCRIPT = """
+local ids = {}
+if ARGV[1] == 'expired' then
+    ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2], 'LIMIT', 0, tonumber(ARGV[3]))
+else
+    for i = 3, #ARGV do
+        ids[#ids + 1] = ARGV[i]
+    end
+end
+local requeued = {}
+local dead = {}
+for _, id in ipairs(ids) do
+    local lease = redis.call('HGET', KEYS[3], id)
+    local record = lease and cjson.decode(lease)
+    if ARGV[1] == 'expired' or (record and record['worker_id'] == ARGV[2]) then
+        redis.call('ZREM', KEYS[2], id)
+        redis.call('HDEL', KEYS[3], id)
+        if record then
+            local task = cjson.decode(record['task'])
+            local deliveries = tonumber(record['deliveries']) or 1
+            local max_retries = tonumber(task['max_retries']) or 3
+            if ARGV[1] == 'expired' and deliveries > max_retries then
+                redis.call('HDEL', KEYS[5], id)
+                redis.call('LPUSH', KEYS[6], cjson.encode({
+                    task_id = id, status = 'failed', result = cjson.null,
+                    error = 'Lease expired after ' .. deliveries .. ' deliveries',
+                    started_at = tonumber(record['claimed_at']), completed_at = tonumber(ARGV[2]),
+                    execution_time = cjson.null, retry_count = deliveries - 1
+                }))
+                dead[#dead + 1] = id
+            else
+                if ARGV[1] ~= 'expired' then
+                    redis.call('HINCRBY', KEYS[5], id, -1)
+                end
+                -- 保留原分数，放回后仍按原有顺序调度；旧版 payload 没有分数，放回队首
+                local score = task['schedule_score']
+                if type(score) ~= 'number' then
+                    score = 0
+                end
+                redis.call('ZADD', KEYS[1], score, record['task'])
+                redis.call('LPUSH', KEYS[4], 1)
+                requeued[#requeued + 1] = id
+            end
+        end
+    end
+end
+local nxt = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+return {#requeued, nxt[2] or '', requeued, dead}
+"""
+
+# 单位成本耗时 EWMA 校准：各节点共享同一估计值，原子更新
+# ARGV: 任务类型, 观测值, 初始值, 平滑系数
+COST_EWMA_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1])) or tonumber(ARGV[3])
+local updated = current + tonumber(ARGV[4]) * (tonumber(ARGV[2]) - current)
+redis.call('HSET', KEYS[1], ARGV[1], tostring(updated))
+return tostring(updated)
+"""
+
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
 class TaskStatus(str, Enum):
     PENDING = "pending"
     PROCESSING = "processing"
@@ -66,6 +248,9 @@ class Task(BaseModel):
     scheduled_at: Optional[float] = None
     correlation_id: Optional[str] = None
     user_id: Optional[str] = None
+    deadline: Optional[float] = None  # 期望完成时间（epoch 秒）
+    cost: Optional[float] = None  # 预估成本（如主观题数、页数）
+    schedule_score: Optional[float] = None  # 就绪队列分数，入队时计算
     
     class Config:
         use_enum_values = True
@@ -77,12 +262,15 @@ class TaskWorker:
     def __init__(self, 
                  worker_id: str,
                  task_handlers: Dict[str, Callable],
-                 queue_manager: 'AsyncTaskQueue'):
+                 queue_manager: 'AsyncTaskQueue',
+                 prefetch: int = 1):
         self.worker_id = worker_id
         self.task_handlers = task_handlers
         self.queue_manager = queue_manager
+        self.prefetch = prefetch
         self.running = False
         self.current_task: Optional[Task] = None
+        self.held_task_ids: Set[str] = set()
         self.logger = logging.getLogger(f"{__name__}.{worker_id}")
     
     async def start(self):
@@ -92,13 +280,13 @@ class TaskWorker:
         
         while self.running:
             try:
-                # Get next task from queue manager
-                task = await self.queue_manager.get_next_task(self.worker_id)
+                # Claim next tasks from queue manager
+                tasks = await self.queue_manager.claim_batch(self.worker_id, self.prefetch)
                 
-                if task:
-                    await self.process_task(task)
-                else:
-                    # No tasks available, wait a bit
+                if tasks:
+                    await self.process_batch(tasks)
+                elif not self.queue_manager.redis_client:
+                    # Queue not connected, wait a bit
                     await asyncio.sleep(1)
                     
             except asyncio.CancelledError:
@@ -109,6 +297,35 @@ class TaskWorker:
         
         self.logger.info(f"Worker {self.worker_id} stopped")
     
+    async def process_batch(self, tasks: List[Task]):
+        """Process claimed tasks in order while keeping their leases alive"""
+        self.held_task_ids = {task.id for task in tasks}
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        
+        try:
+            for task in tasks:
+                if not self.running:
+                    break
+                await self.process_task(task)
+                self.held_task_ids.discard(task.id)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            
+            # 未开始处理的任务立即归还队列，不等租约过期
+            if self.held_task_ids:
+                await self.queue_manager.release_tasks(self.worker_id, list(self.held_task_ids))
+                self.held_task_ids = set()
+    
+    async def _heartbeat_loop(self):
+        """Extend leases of held tasks"""
+        while True:
+            await asyncio.sleep(self.queue_manager.heartbeat_interval)
+            try:
+                await self.queue_manager.extend_leases(self.worker_id, list(self.held_task_ids))
+            except Exception as e:
+                self.logger.error(f"Worker {self.worker_id} heartbeat failed: {str(e)}")
+    
     async def process_task(self, task: Task):
         """Process a single task"""
         self.current_task = task
@@ -146,8 +363,9 @@ class TaskWorker:
                 execution_time=execution_time
             )
             
-            await self.queue_manager.complete_task(task.id, task_result)
-            self.logger.info(f"Task {task.id} completed in {execution_time:.2f}s")
+            if await self.queue_manager.complete_task(task.id, task_result, worker_id=self.worker_id):
+                await self.queue_manager.record_completion(task, task_result)
+                self.logger.info(f"Task {task.id} completed in {execution_time:.2f}s")
             
         except asyncio.TimeoutError:
             error_msg = f"Task {task.id} timed out after {task.timeout}s"
@@ -175,17 +393,15 @@ class TaskWorker:
             execution_time=execution_time
         )
         
-        await self.queue_manager.fail_task(task.id, task_result)
+        await self.queue_manager.fail_task(task.id, task_result, worker_id=self.worker_id)
     
     async def stop(self):
-        """Stop the worker"""
-        self.running = False
+        """Stop the worker
         
-        # If currently processing a task, mark it as cancelled
-        if self.current_task:
-            await self.queue_manager.update_task_status(
-                self.current_task.id, TaskStatus.CANCELLED
-            )
+        当前任务不标记为 CANCELLED：worker 被取消时 process_batch 会把它连同
+        未开始的任务一起归还队列（状态恢复为 PENDING），由其他 worker 重新执行。
+        """
+        self.running = False
 
 
 class AsyncTaskQueue:
@@ -195,39 +411,99 @@ class AsyncTaskQueue:
                  redis_url: str = "redis://localhost:6379",
                  queue_prefix: str = "zhiyue:tasks",
                  result_ttl: int = 3600,  # 1 hour
-                 max_workers: int = 10):
+                 max_workers: int = 10,
+                 dequeue_timeout: float = 5.0,
+                 scheduler_lease_ttl: float = 10.0,
+                 scheduler_batch_size: int = 100,
+                 lease_ttl: float = 30.0,
+                 worker_prefetch: int = 1,
+                 max_wait: Optional[Dict[TaskPriority, float]] = None,
+                 cost_unit_seconds: Optional[Dict[str, float]] = None,
+                 default_cost_unit_seconds: float = 1.0):
         
         self.redis_url = redis_url
         self.queue_prefix = queue_prefix
         self.result_ttl = result_ttl
         self.max_workers = max_workers
+        self.dequeue_timeout = dequeue_timeout
+        self.scheduler_lease_ttl = scheduler_lease_ttl
+        self.scheduler_batch_size = scheduler_batch_size
+        self.lease_ttl = lease_ttl
+        self.heartbeat_interval = lease_ttl / 3
+        self.worker_prefetch = worker_prefetch
+        
+        # 各优先级最长等待（秒），也是无截止时间任务的隐式截止时间
+        self.max_wait = max_wait or {
+            TaskPriority.HIGH: 30.0,
+            TaskPriority.NORMAL: 300.0,
+            TaskPriority.LOW: 1800.0
+        }
+        # 每单位成本的预估耗时（秒），按任务类型；配置值为初始值，
+        # 校准结果存于 Redis 由各节点共享，本地副本按 calibration_refresh_interval 刷新
+        self._configured_cost_unit_seconds = dict(cost_unit_seconds or {})
+        self.cost_unit_seconds = dict(self._configured_cost_unit_seconds)
+        self.default_cost_unit_seconds = default_cost_unit_seconds
+        self.calibration_refresh_interval = 5.0
+        self._calibration_loaded_at = float("-inf")
+        self.node_id = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
         
         self.redis_client: Optional[aioredis.Redis] = None
         self.workers: List[TaskWorker] = []
         self.worker_tasks: List[asyncio.Task] = []
         self.task_handlers: Dict[str, Callable] = {}
         self.running = False
+        self.scheduler_task: Optional[asyncio.Task] = None
+        self.is_scheduler_leader = False
+        self._promote_script = None
+        self._scheduler_lease_script = None
+        self._release_lease_script = None
+        self._claim_script = None
+        self._extend_script = None
+        self._requeue_script = None
+        self._ack_script = None
+        self._migrate_script = None
+        self._cost_ewma_script = None
         
         self.logger = logging.getLogger(__name__)
         
-        # Queue names by priority
-        self.priority_queues = {
-            TaskPriority.HIGH: f"{queue_prefix}:high",
-            TaskPriority.NORMAL: f"{queue_prefix}:normal", 
-            TaskPriority.LOW: f"{queue_prefix}:low"
-        }
+        # Ready tasks ordered by latest start time
+        self.ready_tasks = f"{queue_prefix}:ready_tasks"
+        self.deadline_stats = f"{queue_prefix}:deadline_stats"
+        # 尚未结束的有截止时间任务：id -> 截止时间
+        self.pending_deadlines = f"{queue_prefix}:pending_deadlines"
+        self.cost_calibration = f"{queue_prefix}:cost_unit_seconds"
         
-        # Processing and result storage
-        self.processing_set = f"{queue_prefix}:processing"
+        # Leases and result storage
+        self.leases_zset = f"{queue_prefix}:leases"
+        self.leased_hash = f"{queue_prefix}:leased"
+        self.ready_signal = f"{queue_prefix}:ready"
         self.results_hash = f"{queue_prefix}:results"
         self.failed_queue = f"{queue_prefix}:failed"
+        self.deliveries_hash = f"{queue_prefix}:deliveries"
         self.scheduled_set = f"{queue_prefix}:scheduled"
+        self.scheduler_leader_key = f"{queue_prefix}:scheduler:leader"
+        self.scheduler_wakeup = f"{queue_prefix}:scheduler:wakeup"
+        self.lease_keys = [
+            self.ready_tasks, self.leases_zset, self.leased_hash, self.ready_signal,
+            self.deliveries_hash, self.failed_queue
+        ]
+        # 旧版按优先级分列表的就绪队列，启动时迁移到 ready_tasks
+        self.legacy_queues = [f"{queue_prefix}:{priority.value}" for priority in TaskPriority]
     
     async def initialize(self):
         """Initialize Redis connection"""
         try:
             self.redis_client = aioredis.from_url(self.redis_url, decode_responses=True)
             await self.redis_client.ping()
+            self._promote_script = self.redis_client.register_script(PROMOTE_SCHEDULED_SCRIPT)
+            self._scheduler_lease_script = self.redis_client.register_script(SCHEDULER_LEASE_SCRIPT)
+            self._release_lease_script = self.redis_client.register_script(RELEASE_LEASE_SCRIPT)
+            self._claim_script = self.redis_client.register_script(CLAIM_TASKS_SCRIPT)
+            self._extend_script = self.redis_client.register_script(EXTEND_LEASES_SCRIPT)
+            self._requeue_script = self.redis_client.register_script(REQUEUE_LEASES_SCRIPT)
+            self._ack_script = self.redis_client.register_script(ACK_LEASE_SCRIPT)
+            self._migrate_script = self.redis_client.register_script(MIGRATE_LEGACY_SCRIPT)
+            self._cost_ewma_script = self.redis_client.register_script(COST_EWMA_SCRIPT)
             self.logger.info("Task queue Redis connection established")
         except Exception as e:
             self.logger.error(f"Failed to initialize task queue: {str(e)}")
@@ -238,28 +514,62 @@ class AsyncTaskQueue:
         self.task_handlers[task_type] = handler
         self.logger.info(f"Registered handler for task type: {task_type}")
     
+    async def _refresh_cost_calibration(self):
+        """从 Redis 读取共享的单位成本耗时校准值（按间隔刷新本地副本）"""
+        now = time.monotonic()
+        if now - self._calibration_loaded_at < self.calibration_refresh_interval:
+            return
+        self._calibration_loaded_at = now
+        calibrated = await self.redis_client.hgetall(self.cost_calibration)
+        self.cost_unit_seconds = {
+            **self._configured_cost_unit_seconds,
+            **{task_type: float(value) for task_type, value in calibrated.items()}
+        }
+    
+    def estimate_duration(self, task: Task) -> float:
+        """按成本估算任务耗时（秒）"""
+        unit_seconds = self.cost_unit_seconds.get(task.type, self.default_cost_unit_seconds)
+        return (task.cost if task.cost is not None else 1.0) * unit_seconds
+    
+    def schedule_score(self, task: Task, enqueued_at: float) -> float:
+        """就绪队列分数：最晚开始时间，越小越先执行"""
+        duration = self.estimate_duration(task)
+        implicit_deadline = enqueued_at + self.max_wait[TaskPriority(task.priority)]
+        if task.deadline is not None:
+            return min(task.deadline, implicit_deadline) - duration
+        return implicit_deadline + duration
+    
     async def submit_task(self, task: Task) -> str:
         """Submit a task to the queue"""
         if not self.redis_client:
             raise RuntimeError("Task queue not initialized")
         
+        priority = TaskPriority(task.priority)
+        await self._refresh_cost_calibration()
+        
         # If task has a delay, add to scheduled set
         if task.delay > 0:
             scheduled_time = time.time() + task.delay
             task.scheduled_at = scheduled_time
+            task.schedule_score = self.schedule_score(task, scheduled_time)
             
-            await self.redis_client.zadd(
-                self.scheduled_set,
-                {json.dumps(task.dict()): scheduled_time}
-            )
+            # 唤醒调度 leader，使其按新的最近到期时间重新计时
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.zadd(self.scheduled_set, {json.dumps(task.dict()): scheduled_time})
+            pipe.lpush(self.scheduler_wakeup, 1)
+            pipe.ltrim(self.scheduler_wakeup, 0, 0)
+            await pipe.execute()
             
             self.logger.info(f"Task {task.id} scheduled for {datetime.fromtimestamp(scheduled_time)}")
         else:
-            # Add directly to priority queue
-            queue_name = self.priority_queues[task.priority]
-            await self.redis_client.lpush(queue_name, json.dumps(task.dict()))
+            # Add directly to ready queue
+            task.schedule_score = self.schedule_score(task, time.time())
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.zadd(self.ready_tasks, {json.dumps(task.dict()): task.schedule_score})
+            pipe.lpush(self.ready_signal, 1)
+            await pipe.execute()
             
-            self.logger.info(f"Task {task.id} submitted to {task.priority} priority queue")
+            self.logger.info(f"Task {task.id} submitted with {priority.value} priority")
         
         # Store task metadata
         await self.redis_client.hset(
@@ -268,67 +578,216 @@ class AsyncTaskQueue:
             json.dumps({
                 "status": TaskStatus.PENDING.value,
                 "created_at": task.created_at,
-                "priority": task.priority.value,
-                "type": task.type
+                "priority": priority.value,
+                "type": task.type,
+                "deadline": task.deadline,
+                "cost": task.cost
             })
         )
+        if task.deadline is not None:
+            await self.redis_client.zadd(self.pending_deadlines, {task.id: task.deadline})
         
         return task.id
     
     async def get_next_task(self, worker_id: str) -> Optional[Task]:
         """Get the next task for processing"""
+        tasks = await self.claim_batch(worker_id, 1)
+        return tasks[0] if tasks else None
+    
+    async def claim_batch(self, worker_id: str, n: int, timeout: float = None) -> List[Task]:
+        """Claim up to n tasks under a lease
+        
+        认领与登记租约在同一脚本中完成；队列为空时阻塞在就绪信号上，
+        有任务入队立即重试。认领的任务须 complete_task / fail_task 确认，
+        否则租约过期后重新入队。
+        """
         if not self.redis_client:
-            return None
+            return []
         
-        # First, check for scheduled tasks that are ready
-        await self._process_scheduled_tasks()
+        timeout = self.dequeue_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
         
-        # Try to get task from priority queues (high to low)
-        for priority in [TaskPriority.HIGH, TaskPriority.NORMAL, TaskPriority.LOW]:
-            queue_name = self.priority_queues[priority]
-            
-            # Blocking pop with timeout
-            result = await self.redis_client.brpop(queue_name, timeout=1)
+        while True:
+            now = time.time()
+            payloads = await self._claim_script(
+                keys=self.lease_keys,
+                args=[n, now + self.lease_ttl, worker_id, now]
+            )
+            if payloads:
+                return [Task(**json.loads(payload)) for payload in payloads]
             
-            if result:
-                _, task_data = result
-                task = Task(**json.loads(task_data))
-                
-                # Add to processing set
-                await self.redis_client.sadd(
-                    self.processing_set,
-                    json.dumps({
-                        "task_id": task.id,
-                        "worker_id": worker_id,
-                        "started_at": time.time()
-                    })
-                )
-                
-                return task
+            remaining = deadline - time.time()
+            if remaining < 0.001:
+                return []
+            if not await self.redis_client.brpop(self.ready_signal, timeout=remaining):
+                return []
+    
+    async def extend_leases(self, worker_id: str, task_ids: List[str]) -> int:
+        """Heartbeat: extend leases still held by the worker"""
+        if not self.redis_client or not task_ids:
+            return 0
+        return await self._extend_script(
+            keys=[self.leases_zset, self.leased_hash],
+            args=[worker_id, time.time() + self.lease_ttl, *task_ids]
+        )
+    
+    async def release_tasks(self, worker_id: str, task_ids: List[str]) -> int:
+        """Return unprocessed claimed tasks to the front of their queues
         
-        return None
+        归还的任务重新进入就绪队列，状态恢复为 PENDING。
+        """
+        if not self.redis_client or not task_ids:
+            return 0
+        requeued, _, requeued_ids, _ = await self._requeue_script(
+            keys=self.lease_keys, args=["release", worker_id, *task_ids]
+        )
+        for task_id in requeued_ids:
+            await self.update_task_status(task_id, TaskStatus.PENDING)
+        return int(requeued)
+    
+    async def _reap_expired_leases(self) -> Optional[float]:
+        """Requeue tasks whose lease expired
+        
+        按到期时间范围查询，开销与过期数量成正比。投递次数超过 max_retries
+        的任务（如每次都拖垮 worker 的任务）转入 failed 队列。返回下一个租约到期时间。
+        """
+        while True:
+            now = time.time()
+            requeued, next_expiry, _, dead_ids = await self._requeue_script(
+                keys=self.lease_keys,
+                args=["expired", now, self.scheduler_batch_size]
+            )
+            if requeued:
+                self.logger.warning(f"Requeued {requeued} tasks with expired leases")
+            for task_id in dead_ids:
+                task_data = await self.redis_client.hget(self.results_hash, task_id)
+                deadline = json.loads(task_data).get("deadline") if task_data else None
+                if deadline is not None:
+                    await self._record_deadline_outcome(task_id, deadline, now, failed=True)
+                await self._store_result(task_id, TaskResult(
+                    task_id=task_id,
+                    status=TaskStatus.FAILED,
+                    error="Lease expired too many times",
+                    completed_at=now
+                ))
+                self.logger.error(f"Task {task_id} moved to failed queue after repeated lease expiry")
+            if int(requeued) + len(dead_ids) < self.scheduler_batch_size:
+                return float(next_expiry) if next_expiry else None
     
-    async def _process_scheduled_tasks(self):
-        """Move ready scheduled tasks to processing queues"""
-        current_time = time.time()
+    async def _ack_lease(self, task_id: str, worker_id: Optional[str] = None) -> bool:
+        """Release the lease if the worker still holds it
         
-        # Get all tasks scheduled for now or earlier
-        ready_tasks = await self.redis_client.zrangebyscore(
-            self.scheduled_set, 0, current_time, withscores=True
+        租约过期后任务可能已被其他 worker 重新认领，此时原 worker 的确认
+        视为过期确认：不删除新租约，调用方也不应再记录结果。
+        """
+        acked = await self._ack_script(
+            keys=[self.leases_zset, self.leased_hash, self.deliveries_hash], args=[task_id, worker_id or ""]
         )
+        if not acked:
+            self.logger.warning(
+                f"Dropping stale ack for task {task_id} from worker {worker_id}: lease expired or reclaimed"
+            )
+        return bool(acked)
+    
+    async def _migrate_legacy_queues(self) -> int:
+        """Move tasks left in the pre-ZSET priority lists into ready_tasks
         
-        for task_data, score in ready_tasks:
-            # Parse task
-            task = Task(**json.loads(task_data))
-            
-            # Move to appropriate priority queue
-            queue_name = self.priority_queues[task.priority]
-            await self.redis_client.lpush(queue_name, task_data)
-            
-            # Remove from scheduled set
-            await self.redis_client.zrem(self.scheduled_set, task_data)
-            
-            self.logger.info(f"Moved scheduled task {task.id} to {task.priority} queue")
+        旧版 LPUSH 入队、BRPOP 出队，列表尾部为最早入队的任务；以创建时间
+        作为入队时间计算分数，迁移后保持原有先后顺序。
+        """
+        migrated = 0
+        await self._refresh_cost_calibration()
+        for queue_name in self.legacy_queues:
+            payloads = await self.redis_client.lrange(queue_name, 0, -1)
+            for start in range(0, len(payloads), self.scheduler_batch_size):
+                args = []
+                for payload in payloads[start:start + self.scheduler_batch_size]:
+                    try:
+                        task = Task(**json.loads(payload))
+                    except Exception as e:
+                        self.logger.error(f"Skipping unreadable task in legacy queue {queue_name}: {str(e)}")
+                        continue
+                    task.schedule_score = self.schedule_score(task, task.created_at)
+                    args.extend([payload, json.dumps(task.dict()), task.schedule_score])
+                if args:
+                    migrated += int(await self._migrate_script(
+                        keys=[queue_name, self.ready_tasks, self.ready_signal], args=args
+                    ))
+        
+        if migrated:
+            self.logger.info(f"Migrated {migrated} tasks from legacy priority queues")
+        return migrated
+    
+    async def _process_scheduled_tasks(self) -> Optional[float]:
+        """Move ready scheduled tasks to priority queues
+        
+        返回下一个延迟任务的到期时间（无则为 None）。
+        """
+        while True:
+            moved, next_due = await self._promote_script(
+                keys=[self.scheduled_set, self.ready_tasks, self.ready_signal],
+                args=[time.time(), self.scheduler_batch_size]
+            )
+            if moved:
+                self.logger.info(f"Moved {moved} scheduled tasks to priority queues")
+            if int(moved) < self.scheduler_batch_size:
+                return float(next_due) if next_due else None
+    
+    async def _acquire_scheduler_lease(self) -> bool:
+        """获取或续期调度 leader 租约"""
+        acquired = await self._scheduler_lease_script(
+            keys=[self.scheduler_leader_key],
+            args=[self.node_id, int(self.scheduler_lease_ttl * 1000)]
+        )
+        is_leader = bool(acquired)
+        if is_leader != self.is_scheduler_leader:
+            self.logger.info(
+                f"Node {self.node_id} {'became' if is_leader else 'lost'} scheduled task leader"
+            )
+        self.is_scheduler_leader = is_leader
+        return is_leader
+    
+    async def _scheduler_loop(self):
+        """延迟任务与租约回收 leader 定时器
+        
+        仅租约持有者迁移到期任务、回收过期租约；休眠到最近到期时间，
+        新延迟任务经唤醒列表提前打断休眠。非 leader 按半个租约周期尝试接管。
+        """
+        renew_interval = self.scheduler_lease_ttl / 2
+        
+        while self.running:
+            try:
+                if not await self._acquire_scheduler_lease():
+                    await asyncio.sleep(renew_interval)
+                    continue
+                
+                lease_renewed_at = time.time()
+                next_due = await self._process_scheduled_tasks()
+                next_expiry = await self._reap_expired_leases()
+                
+                wait = renew_interval
+                for deadline in (next_due, next_expiry):
+                    if deadline is not None:
+                        wait = min(wait, deadline - time.time())
+                wait = min(wait, lease_renewed_at + renew_interval - time.time())
+                
+                if wait >= 0.001:
+                    await self.redis_client.brpop(self.scheduler_wakeup, timeout=wait)
+                    
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"Scheduled task timer error: {str(e)}")
+                await asyncio.sleep(1)
+        
+        if self.is_scheduler_leader and self.redis_client:
+            try:
+                await self._release_lease_script(
+                    keys=[self.scheduler_leader_key], args=[self.node_id]
+                )
+            except Exception as e:
+                self.logger.error(f"Failed to release scheduler lease: {str(e)}")
+            self.is_scheduler_leader = False
     
     async def update_task_status(self, task_id: str, status: TaskStatus, worker_id: str = None):
         """Update task status"""
@@ -358,19 +817,21 @@ class AsyncTaskQueue:
             json.dumps(result_data)
         )
     
-    async def complete_task(self, task_id: str, result: TaskResult):
-        """Mark task as completed"""
+    async def complete_task(self, task_id: str, result: TaskResult, worker_id: Optional[str] = None) -> bool:
+        """Mark task as completed
+        
+        传入 worker_id 时校验租约持有者，过期确认不记录结果并返回 False。
+        """
         if not self.redis_client:
-            return
+            return False
         
-        # Remove from processing set
-        processing_entries = await self.redis_client.smembers(self.processing_set)
-        for entry in processing_entries:
-            entry_data = json.loads(entry)
-            if entry_data["task_id"] == task_id:
-                await self.redis_client.srem(self.processing_set, entry)
-                break
+        if not await self._ack_lease(task_id, worker_id):
+            return False
         
+        await self._store_result(task_id, result)
+        return True
+    
+    async def _store_result(self, task_id: str, result: TaskResult):
         # Store result
         await self.redis_client.hset(
             self.results_hash,
@@ -381,15 +842,21 @@ class AsyncTaskQueue:
         # Set TTL for result
         await self.redis_client.expire(f"{self.results_hash}:{task_id}", self.result_ttl)
     
-    async def fail_task(self, task_id: str, result: TaskResult):
-        """Handle task failure with retry logic"""
+    async def fail_task(self, task_id: str, result: TaskResult, worker_id: Optional[str] = None) -> bool:
+        """Handle task failure with retry logic
+        
+        传入 worker_id 时校验租约持有者，过期确认既不重试也不记录失败。
+        """
         if not self.redis_client:
-            return
+            return False
+        
+        if not await self._ack_lease(task_id, worker_id):
+            return False
         
         # Get task info to check retry logic
         task_data = await self.redis_client.hget(self.results_hash, task_id)
         if not task_data:
-            return
+            return True
         
         task_info = json.loads(task_data)
         retry_count = task_info.get("retry_count", 0)
@@ -406,7 +873,9 @@ class AsyncTaskQueue:
                 data=task_info.get("data", {}),
                 priority=TaskPriority(task_info.get("priority", "normal")),
                 delay=delay,
-                max_retries=max_retries
+                max_retries=max_retries,
+                deadline=task_info.get("deadline"),
+                cost=task_info.get("cost")
             )
             
             # Update retry count
@@ -427,19 +896,55 @@ class AsyncTaskQueue:
             # Max retries reached, move to failed queue
             await self.redis_client.lpush(self.failed_queue, json.dumps(asdict(result)))
             
+            # 最终失败的任务没有按时交付，计为截止时间未达成
+            if task_info.get("deadline") is not None:
+                await self._record_deadline_outcome(
+                    task_id, task_info["deadline"], result.completed_at or time.time(), failed=True
+                )
+            
             # Update final status
             result.status = TaskStatus.FAILED
-            await self.complete_task(task_id, result)
+            await self._store_result(task_id, result)
             
             self.logger.error(f"Task {task_id} failed permanently after {max_retries} retries")
         
-        # Remove from processing set
-        processing_entries = await self.redis_client.smembers(self.processing_set)
-        for entry in processing_entries:
-            entry_data = json.loads(entry)
-            if entry_data["task_id"] == task_id:
-                await self.redis_client.srem(self.processing_set, entry)
-                break
+        return True
+    
+    async def record_completion(self, task: Task, result: TaskResult):
+        """记录截止时间达成情况，并按实际耗时校准单位成本耗时"""
+        if not self.redis_client:
+            return
+        
+        if task.cost:
+            observed = result.execution_time / task.cost
+            initial = self.cost_unit_seconds.get(task.type, self.default_cost_unit_seconds)
+            updated = await self._cost_ewma_script(
+                keys=[self.cost_calibration], args=[task.type, observed, initial, 0.2]
+            )
+            self.cost_unit_seconds[task.type] = float(updated)
+        
+        if task.deadline is None:
+            return
+        
+        await self._record_deadline_outcome(task.id, task.deadline, result.completed_at)
+    
+    async def _record_deadline_outcome(self, task_id: str, deadline: float, finished_at: float,
+                                       failed: bool = False):
+        """记录一个有截止时间任务的结束：最终失败或晚于截止时间都计为未达成"""
+        lateness = finished_at - deadline
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrem(self.pending_deadlines, task_id)
+        pipe.hincrby(self.deadline_stats, "with_deadline", 1)
+        if failed or lateness > 0:
+            pipe.hincrby(self.deadline_stats, "missed", 1)
+            if lateness > 0:
+                pipe.hincrbyfloat(self.deadline_stats, "total_lateness", lateness)
+            self.logger.warning(
+                f"Task {task_id} missed its deadline" + (" (failed)" if failed else f" by {lateness:.1f}s")
+            )
+        else:
+            pipe.hincrby(self.deadline_stats, "met", 1)
+        await pipe.execute()
     
     async def get_task_result(self, task_id: str) -> Optional[TaskResult]:
         """Get task result by ID"""
@@ -464,18 +969,19 @@ class AsyncTaskQueue:
             task = Task(**json.loads(task_data))
             if task.id == task_id:
                 await self.redis_client.zrem(self.scheduled_set, task_data)
+                await self.redis_client.zrem(self.pending_deadlines, task_id)
                 await self.update_task_status(task_id, TaskStatus.CANCELLED)
                 return True
         
-        # Check if task is in any priority queue
-        for queue_name in self.priority_queues.values():
-            tasks = await self.redis_client.lrange(queue_name, 0, -1)
-            for i, task_data in enumerate(tasks):
-                task = Task(**json.loads(task_data))
-                if task.id == task_id:
-                    await self.redis_client.lrem(queue_name, 1, task_data)
-                    await self.update_task_status(task_id, TaskStatus.CANCELLED)
-                    return True
+        # Check if task is in the ready queue
+        ready_tasks = await self.redis_client.zrange(self.ready_tasks, 0, -1)
+        for task_data in ready_tasks:
+            task = Task(**json.loads(task_data))
+            if task.id == task_id:
+                await self.redis_client.zrem(self.ready_tasks, task_data)
+                await self.redis_client.zrem(self.pending_deadlines, task_id)
+                await self.update_task_status(task_id, TaskStatus.CANCELLED)
+                return True
         
         return False
     
@@ -486,13 +992,30 @@ class AsyncTaskQueue:
         
         stats = {}
         
-        # Queue lengths
-        for priority, queue_name in self.priority_queues.items():
-            length = await self.redis_client.llen(queue_name)
-            stats[f"queue_{priority.value}"] = length
+        # Queue lengths; overdue = 已过最晚开始时间仍未认领
+        stats["queue_ready"] = await self.redis_client.zcard(self.ready_tasks)
+        stats["queue_overdue"] = await self.redis_client.zcount(self.ready_tasks, "-inf", time.time())
+        
+        # Deadline outcomes; 已过截止时间仍在排队或处理的任务也计入未达成
+        deadline_stats = await self.redis_client.hgetall(self.deadline_stats)
+        with_deadline = int(deadline_stats.get("with_deadline", 0))
+        missed = int(deadline_stats.get("missed", 0))
+        past_deadline = await self.redis_client.zcount(self.pending_deadlines, "-inf", time.time())
+        stats["deadline"] = {
+            "with_deadline": with_deadline,
+            "met": int(deadline_stats.get("met", 0)),
+            "missed": missed,
+            "unfinished_past_deadline": past_deadline,
+            "miss_rate": (
+                (missed + past_deadline) / (with_deadline + past_deadline)
+                if with_deadline + past_deadline else 0.0
+            ),
+            "avg_lateness": float(deadline_stats.get("total_lateness", 0)) / missed if missed else 0.0
+        }
         
-        # Processing count
-        stats["processing"] = await self.redis_client.scard(self.processing_set)
+        # Processing count (leased tasks)
+        stats["processing"] = await self.redis_client.zcard(self.leases_zset)
+        stats["expired_leases"] = await self.redis_client.zcount(self.leases_zset, 0, time.time())
         
         # Scheduled count
         stats["scheduled"] = await self.redis_client.zcard(self.scheduled_set)
@@ -502,6 +1025,7 @@ class AsyncTaskQueue:
         
         # Worker count
         stats["active_workers"] = len([w for w in self.workers if w.running])
+        stats["scheduler_leader"] = self.is_scheduler_leader
         
         return stats
     
@@ -512,16 +1036,24 @@ class AsyncTaskQueue:
         
         self.running = True
         
+        try:
+            await self._migrate_legacy_queues()
+        except Exception as e:
+            self.logger.error(f"Failed to migrate legacy priority queues: {str(e)}")
+        
         # Create and start workers
         for i in range(num_workers):
             worker_id = f"worker-{i+1}"
-            worker = TaskWorker(worker_id, self.task_handlers, self)
+            worker = TaskWorker(worker_id, self.task_handlers, self, prefetch=self.worker_prefetch)
             self.workers.append(worker)
             
             # Start worker task
             task = asyncio.create_task(worker.start())
             self.worker_tasks.append(task)
         
+        if self.scheduler_task is None:
+            self.scheduler_task = asyncio.create_task(self._scheduler_loop())
+        
         self.logger.info(f"Started {num_workers} workers")
     
     async def stop_workers(self):
@@ -540,6 +1072,11 @@ class AsyncTaskQueue:
         if self.worker_tasks:
             await asyncio.gather(*self.worker_tasks, return_exceptions=True)
         
+        if self.scheduler_task is not None:
+            self.scheduler_task.cancel()
+            await asyncio.gather(self.scheduler_task, return_exceptions=True)
+            self.scheduler_task = None
+        
         self.workers.clear()
         self.worker_tasks.clear()
         
@@ -573,8 +1110,9 @@ class TaskType:
 
 
 # Convenience functions
-async def submit_ocr_task(file_id: str, exam_id: str, priority: TaskPriority = TaskPriority.NORMAL) -> str:
-    """Submit OCR processing task"""
+async def submit_ocr_task(file_id: str, exam_id: str, priority: TaskPriority = TaskPriority.NORMAL,
+                          deadline: Optional[float] = None, page_count: Optional[int] = None) -> str:
+    """Submit OCR processing task (cost = page count)"""
     task = Task(
         type=TaskType.OCR_PROCESSING,
         data={
@@ -582,14 +1120,17 @@ async def submit_ocr_task(file_id: str, exam_id: str, priority: TaskPriority = T
             "exam_id": exam_id
         },
         priority=priority,
-        timeout=600  # 10 minutes for OCR
+        timeout=600,  # 10 minutes for OCR
+        deadline=deadline,
+        cost=page_count
     )
     
     return await task_queue.submit_task(task)
 
 
-async def submit_grading_task(exam_id: str, student_id: str, ocr_result: Dict[str, Any], priority: TaskPriority = TaskPriority.HIGH) -> str:
-    """Submit grading task"""
+async def submit_grading_task(exam_id: str, student_id: str, ocr_result: Dict[str, Any], priority: TaskPriority = TaskPriority.HIGH,
+                              deadline: Optional[float] = None, subjective_count: Optional[int] = None) -> str:
+    """Submit grading task (cost = subjective question count)"""
     task = Task(
         type=TaskType.GRADING_EXECUTION,
         data={
@@ -598,19 +1139,24 @@ async def submit_grading_task(exam_id: str, student_id: str, ocr_result: Dict[st
             "ocr_result": ocr_result
         },
         priority=priority,
-        timeout=300  # 5 minutes for grading
+        timeout=300,  # 5 minutes for grading
+        deadline=deadline,
+        cost=subjective_count
     )
     
     return await task_queue.submit_task(task)
 
 
-async def submit_batch_processing_task(batch_data: Dict[str, Any], priority: TaskPriority = TaskPriority.NORMAL) -> str:
-    """Submit batch processing task"""
+async def submit_batch_processing_task(batch_data: Dict[str, Any], priority: TaskPriority = TaskPriority.NORMAL,
+                                      deadline: Optional[float] = None, item_count: Optional[int] = None) -> str:
+    """Submit batch processing task (cost = item count)"""
     task = Task(
         type=TaskType.BATCH_PROCESSING,
         data=batch_data,
         priority=priority,
-        timeout=1800  # 30 minutes for batch processing
+        timeout=1800,  # 30 minutes for batch processing
+        deadline=deadline,
+        cost=item_count
     )
     
     return await task_queue.submit_task(task)
\ No newline at end of file
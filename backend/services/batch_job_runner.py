@@ -0,0 +1,591 @@
+"""
+持久化批处理任务执行器
+
+- 批处理任务和逐条状态保存在 batch_jobs / batch_job_items 表，进程重启不丢失
+- 处理节点按租约领取条目（PostgreSQL 使用 FOR UPDATE SKIP LOCKED，
+  SQLite 依靠条件更新），多个进程可同时处理同一批次的不同条目
+- 处理中的条目定期续约；节点崩溃后租约过期，条目由其他节点重新领取
+- 每个条目完成即写回结果并分配批次内完成序号，批次运行过程中可按序号增量查询
+- 结果摘要（阶段、错误类型、数值指标）单独落列/落表，状态统计在 SQL 中聚合
+"""
+
+import asyncio
+import dataclasses
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.orm import Session
+
+from config.settings import settings
+from db_connection import SessionLocal
+from models.production_models import BatchJob, BatchJobItem, BatchJobItemMetric
+
+logger = logging.getLogger(__name__)
+
+# 处理函数：(payload, config) -> (条目状态 completed/review/failed, 结果)
+ItemHandler = Callable[[Dict[str, Any], Dict[str, Any]], Awaitable[Tuple[str, Dict[str, Any]]]]
+
+ACTIVE_JOB_STATUSES = ("queued", "processing")
+FINISHED_JOB_STATUSES = ("completed", "failed")
+FINISHED_ITEM_STATUSES = ("completed", "review", "failed")
+
+# 条目最终状态 -> 任务计数字段
+ITEM_COUNTERS = {
+    "completed": "completed_items",
+    "review": "review_items",
+    "failed": "failed_items",
+}
+
+
+@dataclasses.dataclass
+class ItemSummary:
+    """条目结果的可聚合摘要：阶段和错误类型写入条目列，数值指标写入指标表"""
+    stage: Optional[str] = None
+    error_type: Optional[str] = None
+    metrics: Dict[str, float] = dataclasses.field(default_factory=dict)
+
+
+# 摘要函数：(条目状态, 结果) -> ItemSummary
+ItemSummarizer = Callable[[str, Optional[Dict[str, Any]]], ItemSummary]
+
+
+def to_jsonable(value: Any) -> Any:
+    """处理结果转换为可写入 JSON 列的结构"""
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Path):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return to_jsonable(dataclasses.asdict(value))
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class BatchJobRunner:
+    """批处理任务执行器
+
+    每个进程运行 worker_count 个 worker，从数据库领取已注册类型的条目。
+    同一批次的条目自然分片到所有运行执行器的进程上；任务配置中的
+    max_concurrent 限制单个批次同时处理的条目数（跨进程，近似）。
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        worker_count: int = 4,
+        lease_seconds: int = 60,
+        max_attempts: int = 3,
+        poll_interval: float = 2.0
+    ):
+        self.session_factory = session_factory
+        self.worker_count = worker_count
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = lease_seconds / 3
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.handlers: Dict[str, ItemHandler] = {}
+        self.summarizers: Dict[str, ItemSummarizer] = {}
+        self.running = False
+        self.workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.stats = {
+            "claimed": 0,
+            "completed": 0,
+            "review": 0,
+            "failed": 0,
+            "retried": 0,
+            "lease_lost": 0
+        }
+
+    def register_handler(self, job_type: str, handler: ItemHandler,
+                         summarize: Optional[ItemSummarizer] = None):
+        """注册条目处理函数；summarize 提取可在 SQL 中聚合的结果摘要"""
+        self.handlers[job_type] = handler
+        if summarize is not None:
+            self.summarizers[job_type] = summarize
+
+    async def start(self):
+        """启动 worker（重复调用无副作用）；未完成的批次由租约机制自动续跑"""
+        if self.running:
+            return
+        self.running = True
+        self._wakeup = asyncio.Event()
+        self.workers = [
+            asyncio.create_task(self._worker_loop(f"{self.node_id}/{i + 1}"))
+            for i in range(self.worker_count)
+        ]
+        logger.info(
+            f"Batch job runner started with {self.worker_count} workers, "
+            f"job types: {sorted(self.handlers)}"
+        )
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self._wakeup.set()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        logger.info("Batch job runner stopped")
+
+    def notify(self):
+        """唤醒本进程空闲的 worker（其他进程按 poll_interval 轮询）"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ---- 任务创建与查询（使用调用方的数据库会话）----
+
+    def create_job(
+        self,
+        db: Session,
+        job_type: str,
+        payloads: List[Dict[str, Any]],
+        config: Optional[Dict[str, Any]] = None,
+        job_id: Optional[str] = None,
+        exam_id: Optional[str] = None,
+        created_by: Optional[str] = None,
+        enqueue: bool = True
+    ) -> BatchJob:
+        """创建批处理任务及其条目；enqueue=False 时等待 enqueue_job 后再处理"""
+        job = BatchJob(
+            job_type=job_type,
+            exam_id=exam_id,
+            created_by=created_by,
+            status="queued" if enqueue else "created",
+            config=to_jsonable(config or {}),
+            total_items=len(payloads),
+            completed_items=0,
+            failed_items=0,
+            review_items=0
+        )
+        if job_id:
+            job.id = job_id
+        db.add(job)
+        db.flush()
+        db.add_all([
+            BatchJobItem(
+                job_id=job.id,
+                item_index=index,
+                status="pending",
+                payload=to_jsonable(payload),
+                attempts=0
+            )
+            for index, payload in enumerate(payloads)
+        ])
+        db.commit()
+        if enqueue:
+            self.notify()
+        return job
+
+    def enqueue_job(
+        self,
+        db: Session,
+        job_id: str,
+        config: Optional[Dict[str, Any]] = None
+    ) -> Optional[BatchJob]:
+        """启动手动处理的批次，返回 None 表示批次不存在或已启动"""
+        updates = {BatchJob.status: "queued", BatchJob.updated_at: datetime.utcnow()}
+        if config is not None:
+            updates[BatchJob.config] = to_jsonable(config)
+        updated = db.query(BatchJob).filter(
+            BatchJob.id == job_id, BatchJob.status == "created"
+        ).update(updates, synchronize_session=False)
+        db.commit()
+        if not updated:
+            return None
+        self.notify()
+        return db.query(BatchJob).filter(BatchJob.id == job_id).first()
+
+    def get_job(self, db: Session, job_id: str) -> Optional[BatchJob]:
+        return db.query(BatchJob).filter(BatchJob.id == job_id).first()
+
+    def get_item_counts(self, db: Session, job_id: str) -> Dict[str, int]:
+        """按状态统计条目数"""
+        rows = db.query(BatchJobItem.status, func.count(BatchJobItem.id)).filter(
+            BatchJobItem.job_id == job_id
+        ).group_by(BatchJobItem.status).all()
+        counts = {status: 0 for status in ("pending", "processing", *FINISHED_ITEM_STATUSES)}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def get_finished_items(
+        self,
+        db: Session,
+        job_id: str,
+        after_seq: int = 0,
+        limit: Optional[int] = None
+    ) -> List[BatchJobItem]:
+        """按完成序号返回已完成的条目，after_seq 为上次查询最后一个条目的 finish_seq
+
+        完成序号在累加任务计数的同一事务中分配，任务行锁保证序号按提交
+        顺序可见，不受节点时钟偏差和同一时刻完成的影响，游标不会漏读。
+        """
+        query = db.query(BatchJobItem).filter(
+            BatchJobItem.job_id == job_id,
+            BatchJobItem.finish_seq > after_seq
+        ).order_by(BatchJobItem.finish_seq)
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    def get_stage_counts(self, db: Session, job_id: str) -> Dict[str, int]:
+        """已结束条目的最终阶段分布"""
+        rows = db.query(BatchJobItem.result_stage, func.count(BatchJobItem.id)).filter(
+            BatchJobItem.job_id == job_id,
+            BatchJobItem.status.in_(FINISHED_ITEM_STATUSES)
+        ).group_by(BatchJobItem.result_stage).all()
+        return {stage: count for stage, count in rows if stage is not None}
+
+    def get_error_counts(self, db: Session, job_id: str) -> Dict[str, int]:
+        """失败条目按错误类型统计"""
+        rows = db.query(BatchJobItem.error_type, func.count(BatchJobItem.id)).filter(
+            BatchJobItem.job_id == job_id,
+            BatchJobItem.status == "failed",
+            BatchJobItem.error_type.isnot(None)
+        ).group_by(BatchJobItem.error_type).all()
+        return dict(rows)
+
+    def get_metric_stats(self, db: Session, job_id: str,
+                         prefix: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        """按名称聚合数值指标（数量、均值、最小、最大）"""
+        query = db.query(
+            BatchJobItemMetric.name,
+            func.count(BatchJobItemMetric.id),
+            func.avg(BatchJobItemMetric.value),
+            func.min(BatchJobItemMetric.value),
+            func.max(BatchJobItemMetric.value)
+        ).filter(BatchJobItemMetric.job_id == job_id)
+        if prefix:
+            query = query.filter(BatchJobItemMetric.name.like(f"{prefix}%"))
+        return {
+            name: {"count": count, "avg": float(avg), "min": float(low), "max": float(high)}
+            for name, count, avg, low, high in query.group_by(BatchJobItemMetric.name).all()
+        }
+
+    def get_metric_histogram(self, db: Session, job_id: str, name: str,
+                             buckets: List[Tuple[str, float]]) -> Dict[str, int]:
+        """指标分布：buckets 为按下界降序排列的 (名称, 下界)，低于所有下界的计入最后一档"""
+        bucket = case(
+            *[(BatchJobItemMetric.value >= lower, label) for label, lower in buckets[:-1]],
+            else_=buckets[-1][0]
+        )
+        rows = db.query(bucket, func.count(BatchJobItemMetric.id)).filter(
+            BatchJobItemMetric.job_id == job_id,
+            BatchJobItemMetric.name == name
+        ).group_by(bucket).all()
+        histogram = {label: 0 for label, _ in buckets}
+        histogram.update(dict(rows))
+        return histogram
+
+    def estimate_completion(self, job: BatchJob, counts: Dict[str, int]) -> Optional[datetime]:
+        """按已完成条目的平均耗时估算完成时间"""
+        finished = sum(counts[status] for status in FINISHED_ITEM_STATUSES)
+        if job.status in FINISHED_JOB_STATUSES:
+            return job.completed_at
+        if not job.started_at or not finished:
+            return None
+        elapsed = (datetime.utcnow() - job.started_at).total_seconds()
+        remaining = counts["pending"] + counts["processing"]
+        return datetime.utcnow() + timedelta(seconds=elapsed / finished * remaining)
+
+    # ---- worker ----
+
+    async def _worker_loop(self, worker_id: str):
+        while self.running:
+            try:
+                claimed = await asyncio.to_thread(self._claim_items, worker_id, 1)
+                if not claimed:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+
+                for claim in claimed:
+                    await self._process_item(worker_id, claim)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Batch job worker {worker_id} error: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+
+    def _claim_items(self, worker_id: str, limit: int) -> List[Dict[str, Any]]:
+        """领取待处理或租约过期的条目，返回条目快照"""
+        if not self.handlers:
+            return []
+
+        session = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            jobs = session.query(BatchJob.id, BatchJob.job_type, BatchJob.status, BatchJob.config).filter(
+                BatchJob.status.in_(ACTIVE_JOB_STATUSES),
+                BatchJob.job_type.in_(list(self.handlers))
+            ).order_by(BatchJob.created_at).all()
+            if not jobs:
+                return []
+
+            in_flight = dict(session.query(BatchJobItem.job_id, func.count(BatchJobItem.id)).filter(
+                BatchJobItem.job_id.in_([job.id for job in jobs]),
+                BatchJobItem.status == "processing",
+                BatchJobItem.lease_expires_at >= now
+            ).group_by(BatchJobItem.job_id).all())
+
+            claimable = or_(
+                BatchJobItem.status == "pending",
+                and_(BatchJobItem.status == "processing", BatchJobItem.lease_expires_at < now)
+            )
+            lease_expires_at = now + timedelta(seconds=self.lease_seconds)
+            claimed = []
+
+            for job in jobs:
+                config = job.config or {}
+                capacity = limit - len(claimed)
+                if config.get("max_concurrent"):
+                    capacity = min(capacity, config["max_concurrent"] - in_flight.get(job.id, 0))
+                if capacity <= 0:
+                    continue
+
+                candidates = session.query(BatchJobItem).filter(
+                    BatchJobItem.job_id == job.id, claimable
+                ).order_by(BatchJobItem.item_index).limit(capacity).with_for_update(skip_locked=True).all()
+
+                for item in candidates:
+                    # 条件更新保证同一条目只被一个节点领取
+                    updated = session.query(BatchJobItem).filter(
+                        BatchJobItem.id == item.id, claimable
+                    ).update({
+                        BatchJobItem.status: "processing",
+                        BatchJobItem.worker_id: worker_id,
+                        BatchJobItem.lease_expires_at: lease_expires_at,
+                        BatchJobItem.attempts: BatchJobItem.attempts + 1,
+                        BatchJobItem.started_at: now
+                    }, synchronize_session=False)
+                    if updated:
+                        claimed.append({
+                            "id": item.id,
+                            "job_id": job.id,
+                            "job_type": job.job_type,
+                            "item_index": item.item_index,
+                            "payload": item.payload or {},
+                            "config": config,
+                            "attempts": (item.attempts or 0) + 1
+                        })
+
+                if candidates and job.status == "queued":
+                    session.query(BatchJob).filter(
+                        BatchJob.id == job.id, BatchJob.status == "queued"
+                    ).update({BatchJob.status: "processing", BatchJob.started_at: now},
+                             synchronize_session=False)
+
+                if len(claimed) >= limit:
+                    break
+
+            session.commit()
+            self.stats["claimed"] += len(claimed)
+            return claimed
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    async def _process_item(self, worker_id: str, claim: Dict[str, Any]):
+        if claim["attempts"] > self.max_attempts:
+            await asyncio.to_thread(
+                self._finish_item, worker_id, claim, "failed", None,
+                f"超过最大尝试次数 {self.max_attempts}", self._summarize(claim, "failed", None)
+            )
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat_loop(worker_id, claim["id"]))
+        error_message = None
+        try:
+            status, result = await self.handlers[claim["job_type"]](claim["payload"], claim["config"])
+            result = to_jsonable(result)
+            if status == "failed":
+                error_message = (result or {}).get("error") or (result or {}).get("error_message")
+        except Exception as e:
+            logger.error(f"批处理条目失败: {claim['job_id']}#{claim['item_index']}, 错误: {str(e)}")
+            if claim["attempts"] < self.max_attempts:
+                await asyncio.to_thread(self._release_item, worker_id, claim["id"])
+                return
+            status, result, error_message = "failed", None, str(e)
+        finally:
+            heartbeat.cancel()
+
+        summary = self._summarize(claim, status, result)
+        await asyncio.to_thread(self._finish_item, worker_id, claim, status, result, error_message, summary)
+
+    def _summarize(self, claim: Dict[str, Any], status: str, result: Optional[Dict[str, Any]]) -> ItemSummary:
+        summarize = self.summarizers.get(claim["job_type"])
+        if summarize is None:
+            return ItemSummary(stage=status)
+        try:
+            return summarize(status, result)
+        except Exception as e:
+            logger.warning(f"批处理条目摘要失败: {claim['job_id']}#{claim['item_index']}, 错误: {str(e)}")
+            return ItemSummary(stage=status)
+
+    async def _heartbeat_loop(self, worker_id: str, item_id: str):
+        """处理期间续约，避免长耗时条目被其他节点重复领取"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await asyncio.to_thread(self._extend_lease, worker_id, item_id)
+            except Exception as e:
+                logger.warning(f"批处理条目续约失败: {item_id}, 错误: {str(e)}")
+
+    def _extend_lease(self, worker_id: str, item_id: str):
+        session = self.session_factory()
+        try:
+            session.query(BatchJobItem).filter(
+                BatchJobItem.id == item_id,
+                BatchJobItem.worker_id == worker_id,
+                BatchJobItem.status == "processing"
+            ).update({
+                BatchJobItem.lease_expires_at: datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+            }, synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+    def _release_item(self, worker_id: str, item_id: str):
+        """处理异常且仍可重试：条目放回待处理"""
+        session = self.session_factory()
+        try:
+            session.query(BatchJobItem).filter(
+                BatchJobItem.id == item_id,
+                BatchJobItem.worker_id == worker_id,
+                BatchJobItem.status == "processing"
+            ).update({
+                BatchJobItem.status: "pending",
+                BatchJobItem.worker_id: None,
+                BatchJobItem.lease_expires_at: None
+            }, synchronize_session=False)
+            session.commit()
+            self.stats["retried"] += 1
+        finally:
+            session.close()
+
+    def _finish_item(
+        self,
+        worker_id: str,
+        claim: Dict[str, Any],
+        status: str,
+        result: Optional[Dict[str, Any]],
+        error_message: Optional[str],
+        summary: Optional[ItemSummary] = None
+    ):
+        """写回条目结果并累加任务计数，最后一个条目完成时结束任务
+
+        累加计数会锁定任务行，完成序号取累加后的已结束条目数，同一批次的
+        序号因此唯一且按提交顺序递增。
+        """
+        if status not in ITEM_COUNTERS:
+            status = "completed"
+        summary = summary or ItemSummary(stage=status)
+
+        session = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            updated = session.query(BatchJobItem).filter(
+                BatchJobItem.id == claim["id"],
+                BatchJobItem.worker_id == worker_id,
+                BatchJobItem.status == "processing"
+            ).update({
+                BatchJobItem.status: status,
+                BatchJobItem.result: result,
+                BatchJobItem.error_message: error_message,
+                BatchJobItem.lease_expires_at: None,
+                BatchJobItem.completed_at: now,
+                BatchJobItem.result_stage: summary.stage,
+                BatchJobItem.error_type: summary.error_type
+            }, synchronize_session=False)
+            if not updated:
+                # 租约已过期并被其他节点领取，以对方结果为准
+                session.rollback()
+                self.stats["lease_lost"] += 1
+                logger.warning(f"批处理条目租约已失效，丢弃结果: {claim['job_id']}#{claim['item_index']}")
+                return
+
+            counter = getattr(BatchJob, ITEM_COUNTERS[status])
+            session.query(BatchJob).filter(BatchJob.id == claim["job_id"]).update(
+                {counter: counter + 1, BatchJob.updated_at: now}, synchronize_session=False
+            )
+            finish_seq = session.query(
+                BatchJob.completed_items + BatchJob.review_items + BatchJob.failed_items
+            ).filter(BatchJob.id == claim["job_id"]).scalar()
+            session.query(BatchJobItem).filter(BatchJobItem.id == claim["id"]).update(
+                {BatchJobItem.finish_seq: finish_seq}, synchronize_session=False
+            )
+            session.add_all([
+                BatchJobItemMetric(job_id=claim["job_id"], item_id=claim["id"], name=name, value=float(value))
+                for name, value in summary.metrics.items() if value is not None
+            ])
+
+            remaining = session.query(func.count(BatchJobItem.id)).filter(
+                BatchJobItem.job_id == claim["job_id"],
+                BatchJobItem.status.in_(("pending", "processing"))
+            ).scalar()
+            if not remaining:
+                job = session.query(BatchJob).filter(BatchJob.id == claim["job_id"]).first()
+                all_failed = job.failed_items >= job.total_items
+                session.query(BatchJob).filter(
+                    BatchJob.id == claim["job_id"],
+                    BatchJob.status.in_(ACTIVE_JOB_STATUSES)
+                ).update({
+                    BatchJob.status: "failed" if all_failed else "completed",
+                    BatchJob.completed_at: now
+                }, synchronize_session=False)
+                logger.info(
+                    f"批处理任务完成: {claim['job_id']}, 成功: {job.completed_items}, "
+                    f"需要审核: {job.review_items}, 失败: {job.failed_items}"
+                )
+
+            session.commit()
+            self.stats[status] += 1
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "node_id": self.node_id,
+            "workers": len(self.workers),
+            "job_types": sorted(self.handlers),
+            **self.stats
+        }
+
+
+# 全局实例
+batch_job_runner = BatchJobRunner(
+    worker_count=settings.BATCH_JOB_WORKERS,
+    lease_seconds=settings.BATCH_JOB_LEASE_SECONDS
+)
@@ -12,12 +12,14 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass, asdict, field
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Dict, List, Optional, Set, Any, Callable, Union
+from typing import Dict, List, Optional, Set, Any, Callable, Union, Tuple
 from collections import defaultdict, deque
 import hashlib
 import uuid
 from contextlib import asynccontextmanager
 
+from sqlalchemy import event, inspect as sa_inspect
+
 logger = logging.getLogger(__name__)
 
 class ConsistencyLevel(str, Enum):
@@ -96,6 +98,61 @@ class CacheObserver(ABC):
         """缓存事件回调"""
         pass
 
+# 表 -> 缓存标签模式，与缓存写入方设置的标签保持一致：
+# services.cache_manager (cache_warm_exam_data / cache_warm_user_data / get_user_exams)
+# services.distributed_cache (cache_exam_data / cache_grading_result)
+DEFAULT_INVALIDATION_PATTERNS: Dict[str, List[str]] = {
+    'exams': ['exam_{pk}', 'exam_list'],
+    'users': ['user_{pk}'],
+    'students': ['student_{pk}'],
+    'answer_sheets': ['grading_results'],
+    'grading_tasks': ['grading_results']
+}
+
+class InvalidationTarget(ABC):
+    """失效目标接口 - 接收按表/标签批量下发的失效请求"""
+    
+    name: str = "target"
+    
+    @abstractmethod
+    async def invalidate(self, tables: Set[str], tags: List[str]) -> int:
+        """批量失效，返回失效条目数"""
+        pass
+
+class L1CacheTarget(InvalidationTarget):
+    """L1应用缓存失效目标 (services.cache_manager.CacheManager)"""
+    
+    name = "l1_cache"
+    
+    def __init__(self, cache_manager: Any):
+        self.cache_manager = cache_manager
+        
+    async def invalidate(self, tables: Set[str], tags: List[str]) -> int:
+        return self.cache_manager.invalidate_by_tags(tags) if tags else 0
+
+class DistributedCacheTarget(InvalidationTarget):
+    """L2 Redis缓存失效目标 (services.distributed_cache.RedisDistributedCache)"""
+    
+    name = "l2_cache"
+    
+    def __init__(self, distributed_cache: Any):
+        self.distributed_cache = distributed_cache
+        
+    async def invalidate(self, tables: Set[str], tags: List[str]) -> int:
+        # L1 由 L1CacheTarget 负责，这里只失效 Redis
+        return await self.distributed_cache.invalidate_by_tags(tags, include_l1=False) if tags else 0
+
+class QueryCacheTarget(InvalidationTarget):
+    """查询结果缓存失效目标 (database.query_optimizer.QueryCache)"""
+    
+    name = "query_cache"
+    
+    def __init__(self, query_cache: Any):
+        self.query_cache = query_cache
+        
+    async def invalidate(self, tables: Set[str], tags: List[str]) -> int:
+        return self.query_cache.invalidate_tables(tables) if tables else 0
+
 class ConsistencyStrategy(ABC):
     """一致性策略接口"""
     
@@ -175,17 +232,32 @@ class CacheConsistencyManager:
         self.pending_events: deque = deque()
         self.cache_relationships: Dict[str, List[str]] = {}  # cache -> dependent caches
         self.invalidation_patterns: Dict[str, List[str]] = {}  # table -> cache keys
+        self.invalidation_targets: List[InvalidationTarget] = []
+        self.pending_changes: deque = deque(maxlen=1000)  # 管理器启动前提交的变更
         self.running = False
         self._event_processor_task = None
+        self._invalidation_tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
         
     def register_cache_relationship(self, source_cache: str, dependent_caches: List[str]):
         """注册缓存依赖关系"""
         self.cache_relationships[source_cache] = dependent_caches
         
     def register_invalidation_pattern(self, table_name: str, cache_key_patterns: List[str]):
-        """注册失效模式"""
+        """注册失效模式
+        
+        模式即缓存标签，可包含 {pk} 占位符，例如 'exam_{pk}'，
+        提交时按变更行的主键展开。标签按字面匹配，不支持通配符。
+        """
+        wildcards = [pattern for pattern in cache_key_patterns if "*" in pattern]
+        if wildcards:
+            raise ValueError(f"Invalidation patterns are literal tags, wildcards not supported: {wildcards}")
         self.invalidation_patterns[table_name] = cache_key_patterns
         
+    def register_invalidation_target(self, target: InvalidationTarget):
+        """注册失效目标 (L1 / Redis / QueryCache 等)"""
+        self.invalidation_targets.append(target)
+        
     def set_strategy(self, cache_name: str, strategy: ConsistencyStrategy):
         """为指定缓存设置一致性策略"""
         self.strategies[cache_name] = strategy
@@ -205,7 +277,10 @@ class CacheConsistencyManager:
             return
             
         self.running = True
+        self._loop = asyncio.get_running_loop()
         self._event_processor_task = asyncio.create_task(self._process_events())
+        while self.pending_changes:
+            self._schedule_invalidation(self.pending_changes.popleft())
         logger.info("Cache consistency manager started")
         
     async def stop(self):
@@ -214,6 +289,7 @@ class CacheConsistencyManager:
             return
             
         self.running = False
+        await self.flush()
         if self._event_processor_task:
             self._event_processor_task.cancel()
             try:
@@ -288,19 +364,139 @@ class CacheConsistencyManager:
                 
     async def invalidate_by_table(self, table_name: str, operation: str = "update"):
         """基于表操作失效缓存"""
-        patterns = self.invalidation_patterns.get(table_name, [])
-        if not patterns:
+        return await self.invalidate_changes({table_name: set()})
+        
+    def build_invalidation_tags(self, changes: Dict[str, Set[Any]]) -> List[str]:
+        """根据变更的表和主键生成缓存标签"""
+        tags: Set[str] = set()
+        for table_name, primary_keys in changes.items():
+            for pattern in self.invalidation_patterns.get(table_name, []):
+                if "{pk}" in pattern:
+                    tags.update(pattern.replace("{pk}", str(pk)) for pk in primary_keys)
+                else:
+                    tags.add(pattern)
+        return sorted(tags)
+        
+    async def invalidate_changes(self, changes: Dict[str, Set[Any]]) -> int:
+        """对一次事务的全部变更执行一次批量失效
+        
+        每个失效目标只调用一次，携带该事务涉及的全部表和标签。
+        """
+        if not changes:
+            return 0
+            
+        tables = set(changes)
+        tags = self.build_invalidation_tags(changes)
+        results = await asyncio.gather(
+            *(target.invalidate(tables, tags) for target in self.invalidation_targets),
+            return_exceptions=True
+        )
+        
+        total_invalidated = 0
+        for target, result in zip(self.invalidation_targets, results):
+            if isinstance(result, Exception):
+                logger.error(f"Invalidation target {target.name} failed: {str(result)}")
+                continue
+            total_invalidated += result or 0
+            for observer in self.observers:
+                try:
+                    await observer.on_cache_event(target.name, CacheEvent.INVALIDATE, ",".join(tags))
+                except Exception as e:
+                    logger.error(f"Observer error: {str(e)}")
+                    
+        logger.debug(f"Invalidated {total_invalidated} cache entries for tables {sorted(tables)}")
+        return total_invalidated
+        
+    def dispatch_invalidation(self, changes: Dict[str, Set[Any]]):
+        """从同步上下文（如ORM提交钩子）调度批量失效
+        
+        失效总在管理器所在的事件循环中执行：同一循环内直接创建任务，
+        其他线程（线程池中的同步端点）通过 call_soon_threadsafe 投递，
+        提交线程不会被阻塞。管理器未启动时变更暂存，启动后处理。
+        """
+        loop = self._loop
+        if not self.running or loop is None or loop.is_closed():
+            self.pending_changes.append(changes)
             return
             
-        affected_keys = []
-        for pattern in patterns:
-            # 这里需要根据模式生成实际的缓存键
-            # 简化实现，实际需要更复杂的模式匹配
-            affected_keys.append(pattern)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+            
+        if running_loop is loop:
+            self._schedule_invalidation(changes)
+        else:
+            loop.call_soon_threadsafe(self._schedule_invalidation, changes)
+            
+    def _schedule_invalidation(self, changes: Dict[str, Set[Any]]):
+        """在管理器事件循环中创建失效任务并持有引用，直到任务结束"""
+        task = asyncio.get_running_loop().create_task(self.invalidate_changes(changes))
+        self._invalidation_tasks.add(task)
+        task.add_done_callback(self._invalidation_done)
+        
+    def _invalidation_done(self, task: asyncio.Task):
+        self._invalidation_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Cache invalidation failed: {str(task.exception())}")
             
-        # 失效所有相关缓存层
-        for cache_name in self.cache_relationships:
-            await self.notify_cache_event(cache_name, CacheEvent.INVALIDATE, pattern)
+    async def flush(self):
+        """等待已调度的失效任务全部完成"""
+        while self._invalidation_tasks:
+            await asyncio.gather(*list(self._invalidation_tasks), return_exceptions=True)
+
+class ORMInvalidationHook:
+    """SQLAlchemy提交钩子 - 收集事务内变更的表和主键，提交后批量失效缓存"""
+    
+    INFO_KEY = "_cache_invalidation_changes"
+    
+    def __init__(self, consistency_manager: CacheConsistencyManager):
+        self.consistency_manager = consistency_manager
+        self._installed: List[Any] = []
+        
+    def install(self, session_factory: Any):
+        """在 sessionmaker 或 Session 类上注册事件监听"""
+        event.listen(session_factory, "after_flush", self._after_flush)
+        event.listen(session_factory, "after_commit", self._after_commit)
+        event.listen(session_factory, "after_rollback", self._after_rollback)
+        self._installed.append(session_factory)
+        logger.info("ORM cache invalidation hook installed")
+        
+    def uninstall(self):
+        """移除全部事件监听"""
+        for session_factory in self._installed:
+            event.remove(session_factory, "after_flush", self._after_flush)
+            event.remove(session_factory, "after_commit", self._after_commit)
+            event.remove(session_factory, "after_rollback", self._after_rollback)
+        self._installed.clear()
+        
+    def _after_flush(self, session, flush_context):
+        """记录本次flush涉及的表和主键（flush后new/dirty/deleted仍为flush前状态）"""
+        changes = session.info.setdefault(self.INFO_KEY, defaultdict(set))
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if obj in session.dirty and not session.is_modified(obj):
+                continue
+            try:
+                mapper = sa_inspect(obj).mapper
+            except Exception:
+                continue
+            table_name = mapper.local_table.name
+            primary_key = mapper.primary_key_from_instance(obj)
+            if primary_key and all(value is not None for value in primary_key):
+                changes[table_name].add(primary_key[0] if len(primary_key) == 1 else primary_key)
+            else:
+                changes.setdefault(table_name, set())
+                
+    def _after_commit(self, session):
+        changes = session.info.pop(self.INFO_KEY, None)
+        if changes:
+            try:
+                self.consistency_manager.dispatch_invalidation(dict(changes))
+            except Exception as e:
+                logger.error(f"Failed to dispatch cache invalidation: {str(e)}")
+                
+    def _after_rollback(self, session):
+        session.info.pop(self.INFO_KEY, None)
 
 class CacheMonitor:
     """缓存监控系统"""
@@ -532,6 +728,7 @@ class CacheSystemManager:
         self.consistency_manager = CacheConsistencyManager()
         self.monitor = CacheMonitor()
         self.metrics_collector = CacheMetricsCollector(self.monitor)
+        self.orm_hook = ORMInvalidationHook(self.consistency_manager)
         
         # 注册指标收集器为观察者
         self.consistency_manager.add_observer(self.metrics_collector)
@@ -548,13 +745,30 @@ class CacheSystemManager:
         for table, cache_patterns in patterns.items():
             self.consistency_manager.register_invalidation_pattern(table, cache_patterns)
             
+        # 注册失效目标
+        targets = config.get('invalidation_targets', [])
+        for target in targets:
+            self.consistency_manager.register_invalidation_target(target)
+            
         # 启动一致性管理器
         await self.consistency_manager.start()
         
+        # 挂载ORM提交钩子
+        session_factory = config.get('session_factory')
+        if session_factory is not None:
+            self.orm_hook.install(session_factory)
+            
+        if session_factory is None or not targets:
+            logger.warning(
+                "Commit-driven cache invalidation disabled: "
+                "config needs both 'session_factory' and 'invalidation_targets'"
+            )
+        
         logger.info("Cache system manager initialized")
         
     async def shutdown(self):
         """关闭缓存系统"""
+        self.orm_hook.uninstall()
         await self.consistency_manager.stop()
         logger.info("Cache system manager shutdown")
         
@@ -564,12 +778,41 @@ class CacheSystemManager:
             'consistency_manager': {
                 'running': self.consistency_manager.running,
                 'pending_events': len(self.consistency_manager.pending_events),
-                'registered_caches': len(self.consistency_manager.cache_relationships)
+                'registered_caches': len(self.consistency_manager.cache_relationships),
+                'invalidation_targets': [t.name for t in self.consistency_manager.invalidation_targets]
             },
             'monitor': self.monitor.get_metrics_summary(),
             'recent_alerts': self.monitor.get_recent_alerts(hours=1)
         }
 
+# 全局实例
+cache_system_manager = CacheSystemManager()
+
+async def start_commit_invalidation(session_factory: Any) -> CacheSystemManager:
+    """为应用挂载提交驱动的缓存失效：L1 应用缓存、L2 Redis 缓存和查询结果缓存"""
+    # cache_manager 导入时会创建后台清理任务，需在事件循环中导入
+    from services.cache_manager import cache_manager
+    from database.query_optimizer import get_query_optimizer
+    
+    targets: List[InvalidationTarget] = [L1CacheTarget(cache_manager)]
+    try:
+        from services.distributed_cache import distributed_cache
+        targets.append(DistributedCacheTarget(distributed_cache))
+    except ImportError as e:
+        logger.warning(f"Redis cache invalidation disabled: {str(e)}")
+        
+    # 与数据库优化接口共用同一个查询优化器实例
+    query_optimizer = get_query_optimizer()
+    if query_optimizer.cache is not None:
+        targets.append(QueryCacheTarget(query_optimizer.cache))
+        
+    await cache_system_manager.initialize({
+        'invalidation_patterns': DEFAULT_INVALIDATION_PATTERNS,
+        'invalidation_targets': targets,
+        'session_factory': session_factory
+    })
+    return cache_system_manager
+
 # 使用示例
 async def demo_cache_consistency():
     """缓存一致性演示"""
@@ -583,10 +826,7 @@ async def demo_cache_consistency():
             'l1_cache': ['l2_cache'],
             'l2_cache': ['l3_cache']
         },
-        'invalidation_patterns': {
-            'users': ['user:*', 'profile:*'],
-            'exams': ['exam:*', 'grading:*']
-        }
+        'invalidation_patterns': DEFAULT_INVALIDATION_PATTERNS
     }
     
     await system_manager.initialize(config)
@@ -4,17 +4,21 @@
 """
 
 import asyncio
+import heapq
+import itertools
 import time
 import logging
 from typing import Any, Dict, List, Optional, Callable, Coroutine, AsyncIterator
-from dataclasses import dataclass, field
+from collections import deque
 from enum import Enum
-import weakref
 from contextlib import asynccontextmanager
 import threading
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import multiprocessing as mp
 
+from config.settings import settings
+from services.result_retention import RetentionStore
+
 logger = logging.getLogger(__name__)
 
 class TaskPriority(Enum):
@@ -24,18 +28,32 @@ class TaskPriority(Enum):
     HIGH = 3
     URGENT = 4
 
-@dataclass
 class TaskInfo:
-    """任务信息"""
-    task_id: str
-    priority: TaskPriority = TaskPriority.NORMAL
-    created_at: float = field(default_factory=time.time)
-    started_at: Optional[float] = None
-    completed_at: Optional[float] = None
-    retries: int = 0
-    max_retries: int = 3
-    timeout: Optional[float] = None
-    metadata: Dict[str, Any] = field(default_factory=dict)
+    """任务信息（__slots__，完成后按保留策略存放）"""
+    
+    # 手写 __slots__：dataclass(slots=True) 需要 Python 3.10+
+    __slots__ = ("task_id", "priority", "created_at", "started_at", "completed_at", "retries",
+                 "max_retries", "timeout", "metadata", "result", "exception")
+    
+    def __init__(self, task_id: str, priority: TaskPriority = TaskPriority.NORMAL,
+                 created_at: Optional[float] = None, started_at: Optional[float] = None,
+                 completed_at: Optional[float] = None, retries: int = 0, max_retries: int = 3,
+                 timeout: Optional[float] = None, metadata: Optional[Dict[str, Any]] = None,
+                 result: Any = None, exception: Optional[BaseException] = None):
+        self.task_id = task_id
+        self.priority = priority
+        self.created_at = time.time() if created_at is None else created_at
+        self.started_at = started_at
+        self.completed_at = completed_at
+        self.retries = retries
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.metadata = {} if metadata is None else metadata
+        self.result = result
+        self.exception = exception
+    
+    def __repr__(self) -> str:
+        return f"TaskInfo(task_id={self.task_id!r}, priority={self.priority}, retries={self.retries})"
 
 class ConcurrencyManager:
     """并发管理器"""
@@ -46,7 +64,10 @@ class ConcurrencyManager:
         max_thread_workers: int = 20,
         max_process_workers: int = None,
         task_timeout: float = 300.0,
-        enable_process_pool: bool = False
+        enable_process_pool: bool = False,
+        completed_retention: int = 1000,
+        completed_ttl: float = 600.0,
+        spill_dir: Optional[str] = None
     ):
         self.max_concurrent_tasks = max_concurrent_tasks
         self.max_thread_workers = max_thread_workers
@@ -57,10 +78,18 @@ class ConcurrencyManager:
         # 任务队列和管理
         self.task_queue = asyncio.PriorityQueue()
         self.running_tasks: Dict[str, TaskInfo] = {}
-        self.completed_tasks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        # 已完成任务按 TTL/数量上限保留，供 wait_for_task 和状态查询读取
+        self.completed_tasks = RetentionStore(
+            max_items=completed_retention, ttl_seconds=completed_ttl,
+            spill_dir=spill_dir, name="concurrency"
+        )
         
         # 信号量控制并发数
         self.semaphore = asyncio.Semaphore(max_concurrent_tasks)
+        # priority_slot 等待者：[优先级值, 序号]，堆顶先获得信号量
+        self._slot_waiters: List[List[int]] = []
+        self._slot_sequence = itertools.count()
+        self._slot_condition: Optional[asyncio.Condition] = None
         
         # 线程池和进程池
         self.thread_pool = ThreadPoolExecutor(max_workers=max_thread_workers)
@@ -129,6 +158,33 @@ class ConcurrencyManager:
         
         return task_id
     
+    @asynccontextmanager
+    async def priority_slot(self, priority: TaskPriority = TaskPriority.NORMAL):
+        """按优先级获取一个并发槽位
+        
+        与任务执行共用信号量；槽位不足时等待者按优先级获得信号量，同级先到先得。
+        """
+        if self._slot_condition is None:
+            self._slot_condition = asyncio.Condition()
+        condition = self._slot_condition
+        entry = [5 - priority.value, next(self._slot_sequence)]
+        
+        async with condition:
+            heapq.heappush(self._slot_waiters, entry)
+            try:
+                await condition.wait_for(lambda: self._slot_waiters[0] is entry)
+                # 堆顶等待信号量，其余等待者排在其后
+                await self.semaphore.acquire()
+            finally:
+                self._slot_waiters.remove(entry)
+                heapq.heapify(self._slot_waiters)
+                condition.notify_all()
+        
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+    
     async def submit_cpu_task(
         self,
         func: Callable,
@@ -174,13 +230,12 @@ class ConcurrencyManager:
             
             await asyncio.sleep(0.1)
         
-        task_info = self.completed_tasks[task_id]
-        if hasattr(task_info, 'result'):
-            return task_info.result
-        elif hasattr(task_info, 'exception'):
+        task_info = self.completed_tasks.get(task_id)
+        if task_info is None:
+            raise RuntimeError(f"任务 {task_id} 结果已过期")
+        if task_info.exception is not None:
             raise task_info.exception
-        else:
-            raise RuntimeError(f"任务 {task_id} 状态异常")
+        return task_info.result
     
     async def get_task_status(self, task_id: str) -> Dict[str, Any]:
         """获取任务状态"""
@@ -195,8 +250,9 @@ class ConcurrencyManager:
                 "retries": task_info.retries,
                 "metadata": task_info.metadata
             }
-        elif task_id in self.completed_tasks:
-            task_info = self.completed_tasks[task_id]
+        
+        task_info = self.completed_tasks.get(task_id)
+        if task_info is not None:
             return {
                 "status": "completed",
                 "task_id": task_id,
@@ -225,6 +281,7 @@ class ConcurrencyManager:
         
         self.stats["current_concurrent_tasks"] = current_concurrent
         self.stats["queue_size"] = queue_size
+        self.stats["retention"] = self.completed_tasks.get_stats()
         self.stats["peak_concurrent_tasks"] = max(
             self.stats.get("peak_concurrent_tasks", 0),
             current_concurrent
@@ -329,53 +386,166 @@ class ConcurrencyManager:
             )
 
 class BatchProcessor:
-    """批量处理器"""
+    """批量处理器
+    
+    批内项目分发到各 worker 的本地队列，空闲 worker 从最长队列尾部
+    窃取一半，避免长耗时项目（如作文）集中在个别 worker 上形成长尾。
+    流式处理的批大小按观测到的单项耗时（EWMA）和目标批耗时自适应调整。
+    """
     
     def __init__(
         self,
         concurrency_manager: ConcurrencyManager,
         batch_size: int = 10,
-        max_batch_wait_time: float = 5.0
+        max_batch_wait_time: float = 5.0,
+        num_workers: int = 8,
+        target_batch_duration: float = 2.0,
+        min_batch_size: int = 1,
+        max_batch_size: int = 200,
+        latency_alpha: float = 0.2
     ):
         self.concurrency_manager = concurrency_manager
         self.batch_size = batch_size
         self.max_batch_wait_time = max_batch_wait_time
+        self.num_workers = num_workers
+        self.target_batch_duration = target_batch_duration
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.latency_alpha = latency_alpha
+        
+        # 单项耗时 EWMA（秒），首批完成前为 None
+        self.item_latency: Optional[float] = None
+        self.batch_history: deque = deque(maxlen=100)
+    
+    def current_batch_size(self) -> int:
+        """按单项耗时和目标批耗时计算批大小"""
+        if not self.item_latency:
+            return self.batch_size
+        size = int(self.target_batch_duration * self.num_workers / self.item_latency)
+        return max(self.min_batch_size, min(self.max_batch_size, size))
+    
+    def _observe_latency(self, latency: float):
+        if self.item_latency is None:
+            self.item_latency = latency
+        else:
+            self.item_latency += self.latency_alpha * (latency - self.item_latency)
     
     async def process_batch(
         self,
         items: List[Any],
         processor_func: Callable[[Any], Coroutine],
-        priority: TaskPriority = TaskPriority.NORMAL
+        priority: TaskPriority = TaskPriority.NORMAL,
+        timeout: Optional[float] = None,
+        max_retries: int = 3
     ) -> List[Any]:
-        """批量处理项目"""
-        results = []
-        task_ids = []
-        
-        # 提交所有任务
-        for item in items:
-            task_id = await self.concurrency_manager.submit_task(
-                processor_func(item),
-                priority=priority,
-                metadata={"batch_processing": True}
-            )
-            task_ids.append(task_id)
+        """批量处理项目，结果顺序与输入一致，失败项为 None
         
-        # 等待所有任务完成
-        for task_id in task_ids:
-            try:
-                result = await self.concurrency_manager.wait_for_task(task_id)
-                results.append(result)
-            except Exception as e:
-                logger.error(f"批量处理任务 {task_id} 失败: {e}")
-                results.append(None)  # 或者其他错误标记
+        每个项目按 priority 获取并发槽位，单次执行受 timeout 限制（默认取
+        并发管理器的 task_timeout），失败后最多重试 max_retries 次。
+        """
+        results: List[Any] = [None] * len(items)
+        if not items:
+            return results
+        
+        if timeout is None:
+            timeout = self.concurrency_manager.task_timeout
+        worker_count = max(1, min(self.num_workers, len(items)))
+        queues = [deque(range(i, len(items), worker_count)) for i in range(worker_count)]
+        latencies: List[float] = []
+        steals = 0
+        failed = 0
+        retries = 0
+        batch_start = time.time()
+        
+        async def run_item(index: int):
+            nonlocal failed, retries
+            for attempt in range(max_retries + 1):
+                async with self.concurrency_manager.priority_slot(priority):
+                    # 获得槽位后才开始计时，EWMA 只反映执行耗时
+                    item_start = time.time()
+                    try:
+                        if timeout:
+                            results[index] = await asyncio.wait_for(processor_func(items[index]), timeout=timeout)
+                        else:
+                            results[index] = await processor_func(items[index])
+                        return
+                    except Exception as e:
+                        error = f"超时 {timeout}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+                        if attempt < max_retries:
+                            retries += 1
+                            logger.warning(f"批量处理项目 {index} 失败，重试 {attempt + 1}/{max_retries}: {error}")
+                        else:
+                            failed += 1
+                            logger.error(f"批量处理项目 {index} 失败: {error}")
+                    finally:
+                        latency = time.time() - item_start
+                        latencies.append(latency)
+                        self._observe_latency(latency)
+        
+        async def worker(own: deque):
+            nonlocal steals
+            while True:
+                if own:
+                    await run_item(own.popleft())
+                    continue
+                
+                # 本地队列空：从最长队列尾部窃取一半
+                victim = max(queues, key=len)
+                if not victim:
+                    return
+                for _ in range(max(1, len(victim) // 2)):
+                    own.appendleft(victim.pop())
+                steals += 1
         
+        await asyncio.gather(*[worker(queue) for queue in queues])
+        
+        self.batch_history.append(
+            self._summarize_batch(latencies, time.time() - batch_start, steals, failed, retries, priority)
+        )
         return results
     
+    def _summarize_batch(self, latencies: List[float], duration: float, steals: int,
+                         failed: int, retries: int, priority: TaskPriority) -> Dict[str, Any]:
+        """批次耗时与尾延迟统计"""
+        ordered = sorted(latencies)
+        
+        def percentile(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+        
+        p50 = percentile(0.5)
+        return {
+            "completed_at": time.time(),
+            "priority": priority.name,
+            "items": len(ordered),
+            "failed": failed,
+            "retries": retries,
+            "duration": duration,
+            "steals": steals,
+            "latency_p50": p50,
+            "latency_p95": percentile(0.95),
+            "latency_p99": percentile(0.99),
+            "latency_max": ordered[-1],
+            # 最慢项目相对中位数的倍数，衡量长尾
+            "straggler_ratio": ordered[-1] / p50 if p50 > 0 else 0.0,
+            "next_batch_size": self.current_batch_size()
+        }
+    
+    def get_batch_stats(self) -> Dict[str, Any]:
+        """最近批次统计"""
+        return {
+            "item_latency": self.item_latency,
+            "current_batch_size": self.current_batch_size(),
+            "last_batch": self.batch_history[-1] if self.batch_history else None,
+            "recent_batches": list(self.batch_history)
+        }
+    
     async def process_stream(
         self,
         item_stream: AsyncIterator[Any],
         processor_func: Callable[[Any], Coroutine],
-        priority: TaskPriority = TaskPriority.NORMAL
+        priority: TaskPriority = TaskPriority.NORMAL,
+        timeout: Optional[float] = None,
+        max_retries: int = 3
     ) -> AsyncIterator[Any]:
         """流式批量处理"""
         batch = []
@@ -386,13 +556,13 @@ class BatchProcessor:
             
             # 检查是否需要处理批次
             should_process = (
-                len(batch) >= self.batch_size or
+                len(batch) >= self.current_batch_size() or
                 (time.time() - last_batch_time) >= self.max_batch_wait_time
             )
             
             if should_process and batch:
                 # 处理当前批次
-                results = await self.process_batch(batch, processor_func, priority)
+                results = await self.process_batch(batch, processor_func, priority, timeout, max_retries)
                 
                 # 产出结果
                 for result in results:
@@ -404,7 +574,7 @@ class BatchProcessor:
         
         # 处理剩余的项目
         if batch:
-            results = await self.process_batch(batch, processor_func, priority)
+            results = await self.process_batch(batch, processor_func, priority, timeout, max_retries)
             for result in results:
                 yield result
 
@@ -422,5 +592,6 @@ async def concurrent_context(max_concurrent: int = 50):
 global_concurrency_manager = ConcurrencyManager(
     max_concurrent_tasks=100,
     max_thread_workers=20,
-    enable_process_pool=True
+    enable_process_pool=True,
+    spill_dir=settings.RESULT_SPILL_DIR
 )
\ No newline at end of file
@@ -8,6 +8,7 @@ Features:
 - Cache-aside and Write-through patterns
 - Distributed lock for cache warming
 - Connection pooling and failover
+- Pipelined multi-key operations in configurable chunks
 - Performance monitoring and alerting
 """
 
@@ -17,7 +18,7 @@ import logging
 import time
 import hashlib
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Union, Set, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union, Set, Tuple
 from dataclasses import dataclass, asdict
 import pickle
 import zlib
@@ -30,6 +31,23 @@ from .cache_manager import cache_manager
 
 logger = logging.getLogger(__name__)
 
+# Atomically unlink every member of the given tag sets, then the tag sets.
+# KEYS = tag set keys, ARGV[1] = max keys per UNLINK call (Lua unpack limit).
+# Returns the number of cache entries removed.
+INVALIDATE_TAGS_SCRIPT = """
+local chunk = tonumber(ARGV[1])
+local deleted = 0
+for _, tag_key in ipairs(KEYS) do
+    local members = redis.call('SMEMBERS', tag_key)
+    for i = 1, #members, chunk do
+        local last = math.min(i + chunk - 1, #members)
+        deleted = deleted + redis.call('UNLINK', unpack(members, i, last))
+    end
+    redis.call('UNLINK', tag_key)
+end
+return deleted
+"""
+
 
 @dataclass
 class CacheConfig:
@@ -42,6 +60,8 @@ class CacheConfig:
     retry_delay: float = 1.0
     compression_threshold: int = 1024  # bytes
     serialization: str = "json"  # json, pickle
+    pipeline_chunk_size: int = 500  # keys per pipelined command batch
+    tag_ttl_extension: int = 3600  # tag sets outlive their members by this many seconds
 
 
 @dataclass
@@ -78,6 +98,7 @@ class RedisDistributedCache:
         # Cache invalidation tracking
         self.invalidation_patterns: Set[str] = set()
         self.tag_tracking: Dict[str, Set[str]] = {}
+        self._invalidate_tags_script = None
         
         logger.info(f"Redis distributed cache initialized with config: {config}")
     
@@ -92,6 +113,7 @@ class RedisDistributedCache:
             )
             
             self.redis_client = Redis(connection_pool=self.connection_pool)
+            self._invalidate_tags_script = None
             
             # Test connection
             await self.redis_client.ping()
@@ -133,6 +155,40 @@ class RedisDistributedCache:
         """Generate namespaced cache key"""
         return f"{self.config.key_prefix}{namespace}:{key}"
     
+    def _tag_key(self, tag: str) -> str:
+        """Generate Redis set key holding the members of a tag"""
+        return f"{self.config.key_prefix}tags:{tag}"
+    
+    def _chunks(self, items: List[Any]) -> Iterable[List[Any]]:
+        """Split items into pipeline-sized chunks"""
+        size = max(1, self.config.pipeline_chunk_size)
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+    
+    async def _run_pipeline(self, build: Callable[[Any], None]) -> List[Any]:
+        """Build and execute a non-transactional pipeline in one round trip
+        
+        The pipeline is rebuilt on every call so that retries issued by
+        _execute_with_retry never execute an already-drained pipeline.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        build(pipe)
+        return await pipe.execute()
+    
+    def _queue_tag_updates(self, pipe, cache_keys: List[str], tags: List[str], ttl: int):
+        """Queue SADD/EXPIRE commands registering cache keys under tags"""
+        for tag in tags:
+            tag_key = self._tag_key(tag)
+            for chunk in self._chunks(cache_keys):
+                pipe.sadd(tag_key, *chunk)
+            pipe.expire(tag_key, ttl + self.config.tag_ttl_extension)
+    
+    def _tags_script(self):
+        """Tag invalidation script bound to the current client"""
+        if self._invalidate_tags_script is None:
+            self._invalidate_tags_script = self.redis_client.register_script(INVALIDATE_TAGS_SCRIPT)
+        return self._invalidate_tags_script
+    
     def _serialize_value(self, value: Any) -> bytes:
         """Serialize value for storage"""
         try:
@@ -245,10 +301,13 @@ class RedisDistributedCache:
             serialized_value = self._serialize_value(value)
             self.metrics.total_size_bytes += len(serialized_value)
             
-            # Set in Redis
-            await self._execute_with_retry(
-                self.redis_client.setex, cache_key, ttl, serialized_value
-            )
+            # Set value and tag sets in Redis in a single round trip
+            def build(pipe):
+                pipe.setex(cache_key, ttl, serialized_value)
+                if tags:
+                    self._queue_tag_updates(pipe, [cache_key], tags, ttl)
+            
+            await self._execute_with_retry(self._run_pipeline, build)
             
             # Set in L1 cache with shorter TTL
             l1_ttl = min(ttl, 300) if ttl > 0 else 300
@@ -257,18 +316,7 @@ class RedisDistributedCache:
             # Track tags for invalidation
             if tags:
                 for tag in tags:
-                    if tag not in self.tag_tracking:
-                        self.tag_tracking[tag] = set()
-                    self.tag_tracking[tag].add(cache_key)
-                    
-                    # Store tag mapping in Redis
-                    tag_key = f"{self.config.key_prefix}tags:{tag}"
-                    await self._execute_with_retry(
-                        self.redis_client.sadd, tag_key, cache_key
-                    )
-                    await self._execute_with_retry(
-                        self.redis_client.expire, tag_key, ttl + 3600  # Tags live longer
-                    )
+                    self.tag_tracking.setdefault(tag, set()).add(cache_key)
             
             self.metrics.sets += 1
             logger.debug(f"Cached {cache_key} with TTL {ttl}")
@@ -302,73 +350,77 @@ class RedisDistributedCache:
             return cache_manager.delete(namespace, key)
     
     async def invalidate_by_pattern(self, pattern: str) -> int:
-        """Invalidate keys matching pattern"""
+        """Invalidate keys matching pattern
+        
+        Uses incremental SCAN instead of KEYS so the server is never blocked,
+        and unlinks each scanned page in a single pipelined round trip.
+        Prefer invalidate_by_tags where possible - it needs no keyspace scan.
+        """
         try:
             full_pattern = f"{self.config.key_prefix}{pattern}"
+            count = max(1, self.config.pipeline_chunk_size)
+            deleted_count = 0
+            cursor = 0
             
-            # Get matching keys
-            keys = await self._execute_with_retry(
-                self.redis_client.keys, full_pattern
-            )
-            
-            if keys:
-                # Delete in batches
-                batch_size = 100
-                deleted_count = 0
+            while True:
+                scan_result = await self._execute_with_retry(
+                    self.redis_client.scan, cursor, match=full_pattern, count=count
+                )
+                if not scan_result:
+                    break
                 
-                for i in range(0, len(keys), batch_size):
-                    batch = keys[i:i + batch_size]
+                cursor, keys = scan_result
+                if keys:
                     result = await self._execute_with_retry(
-                        self.redis_client.delete, *batch
+                        self.redis_client.unlink, *keys
                     )
                     deleted_count += result or 0
                 
-                logger.info(f"Invalidated {deleted_count} keys matching pattern: {pattern}")
-                return deleted_count
+                if not cursor:
+                    break
             
-            return 0
+            if deleted_count:
+                logger.info(f"Invalidated {deleted_count} keys matching pattern: {pattern}")
+            return deleted_count
             
         except Exception as e:
             logger.error(f"Pattern invalidation error for {pattern}: {e}")
             return 0
     
-    async def invalidate_by_tags(self, tags: List[str]) -> int:
-        """Invalidate all keys with specified tags"""
+    async def invalidate_by_tags(self, tags: List[str], include_l1: bool = True) -> int:
+        """Invalidate all keys with specified tags
+        
+        Tag membership is stored in Redis sets. Reading the members and
+        unlinking them together with the tag sets runs as one Lua script,
+        so a key tagged concurrently is either removed with its tag or keeps
+        its tag set for the next invalidation - never orphaned.
+        
+        Args:
+            include_l1: also invalidate the local L1 cache. Callers that
+                invalidate L1 separately (e.g. commit-driven invalidation
+                targets) pass False to avoid doing it twice.
+        """
         try:
             total_invalidated = 0
+            tag_keys = [self._tag_key(tag) for tag in tags]
+            
+            if tag_keys:
+                chunk_size = max(1, self.config.pipeline_chunk_size)
+                total_invalidated = await self._execute_with_retry(
+                    lambda: self._tags_script()(keys=tag_keys, args=[chunk_size])
+                ) or 0
             
             for tag in tags:
-                tag_key = f"{self.config.key_prefix}tags:{tag}"
-                
-                # Get all keys with this tag
-                keys = await self._execute_with_retry(
-                    self.redis_client.smembers, tag_key
-                )
-                
-                if keys:
-                    # Delete the keys
-                    result = await self._execute_with_retry(
-                        self.redis_client.delete, *keys
-                    )
-                    total_invalidated += result or 0
-                    
-                    # Clean up tag tracking
-                    await self._execute_with_retry(
-                        self.redis_client.delete, tag_key
-                    )
-                    
-                    if tag in self.tag_tracking:
-                        del self.tag_tracking[tag]
+                self.tag_tracking.pop(tag, None)
             
-            # Also invalidate from L1 cache
-            l1_invalidated = cache_manager.invalidate_by_tags(tags)
+            l1_invalidated = cache_manager.invalidate_by_tags(tags) if include_l1 else 0
             
             logger.info(f"Invalidated {total_invalidated} keys from Redis and {l1_invalidated} from L1 by tags: {tags}")
             return total_invalidated + l1_invalidated
             
         except Exception as e:
             logger.error(f"Tag invalidation error for {tags}: {e}")
-            return cache_manager.invalidate_by_tags(tags)
+            return cache_manager.invalidate_by_tags(tags) if include_l1 else 0
     
     async def exists(self, namespace: str, key: str) -> bool:
         """Check if key exists in cache"""
@@ -459,15 +511,17 @@ class RedisDistributedCache:
                     missing_keys.append(key)
                     missing_cache_keys.append(cache_keys[i])
             
-            # Get missing keys from Redis
+            # Get missing keys from Redis, one MGET per chunk in a single pipeline
             if missing_cache_keys:
-                redis_results = await self._execute_with_retry(
-                    self.redis_client.mget, *missing_cache_keys
-                )
+                chunks = list(self._chunks(missing_cache_keys))
+                chunk_results = await self._execute_with_retry(
+                    self._run_pipeline,
+                    lambda pipe: [pipe.mget(chunk) for chunk in chunks]
+                ) or []
                 
-                for i, redis_result in enumerate(redis_results):
+                redis_results = [r for chunk in chunk_results for r in chunk]
+                for key, redis_result in zip(missing_keys, redis_results):
                     if redis_result is not None:
-                        key = missing_keys[i]
                         value = self._deserialize_value(redis_result)
                         results[key] = value
                         
@@ -485,32 +539,49 @@ class RedisDistributedCache:
     
     async def mset(self, namespace: str, key_value_pairs: Dict[str, Any], 
                   ttl: Optional[int] = None, tags: Optional[List[str]] = None):
-        """Set multiple values"""
+        """Set multiple values
+        
+        All values, TTLs and tag registrations are written through one
+        non-transactional pipeline, chunked by config.pipeline_chunk_size.
+        """
+        if ttl is None:
+            ttl = self.config.default_ttl
+        
         try:
             # Prepare data for Redis
-            redis_data = {}
+            redis_data: List[Tuple[str, bytes]] = []
+            l1_ttl = min(ttl, 300) if ttl > 0 else 300
             for key, value in key_value_pairs.items():
                 cache_key = self._generate_key(namespace, key)
                 serialized_value = self._serialize_value(value)
-                redis_data[cache_key] = serialized_value
+                self.metrics.total_size_bytes += len(serialized_value)
+                redis_data.append((cache_key, serialized_value))
                 
                 # Set in L1 cache
-                l1_ttl = min(ttl, 300) if ttl and ttl > 0 else 300
                 cache_manager.set(namespace, key, value, l1_ttl, tags)
             
-            # Set in Redis
-            if redis_data:
-                pipe = self.redis_client.pipeline()
-                pipe.mset(redis_data)
-                
-                # Set TTL for all keys
-                if ttl:
-                    for cache_key in redis_data.keys():
-                        pipe.expire(cache_key, ttl)
-                
-                await self._execute_with_retry(pipe.execute)
-                
-                self.metrics.sets += len(redis_data)
+            if not redis_data:
+                return
+            
+            cache_keys = [cache_key for cache_key, _ in redis_data]
+            
+            def build(pipe):
+                for chunk in self._chunks(redis_data):
+                    if ttl > 0:
+                        for cache_key, serialized_value in chunk:
+                            pipe.setex(cache_key, ttl, serialized_value)
+                    else:
+                        pipe.mset(dict(chunk))
+                if tags:
+                    self._queue_tag_updates(pipe, cache_keys, tags, ttl)
+            
+            await self._execute_with_retry(self._run_pipeline, build)
+            
+            if tags:
+                for tag in tags:
+                    self.tag_tracking.setdefault(tag, set()).update(cache_keys)
+            
+            self.metrics.sets += len(redis_data)
                 
         except Exception as e:
             logger.error(f"Multi-set error: {e}")
@@ -655,8 +726,8 @@ async def warm_distributed_cache():
         "template_list": ["template1", "template2", "template3"]
     }
     
-    for key, value in warm_data.items():
-        await distributed_cache.set("system", key, value, ttl=86400, tags=["warm_cache"])
+    # Single pipelined write instead of one round trip per key and tag
+    await distributed_cache.mset("system", warm_data, ttl=86400, tags=["warm_cache"])
     
     logger.info("Distributed cache warming completed")
 
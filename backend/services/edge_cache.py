@@ -8,6 +8,8 @@ import hashlib
 import json
 import mimetypes
 import os
+import sqlite3
+import threading
 import time
 from dataclasses import dataclass, asdict
 from enum import Enum
@@ -18,9 +20,10 @@ import aiofiles
 import aiohttp
 from datetime import datetime, timedelta
 import logging
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import gzip
 import brotli
+from fastapi.responses import FileResponse, Response
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +66,88 @@ class CacheEntry:
         if self.created_at is None:
             self.created_at = datetime.now()
 
+def _entry_to_json(entry: CacheEntry) -> str:
+    """序列化缓存条目"""
+    entry_dict = asdict(entry)
+    for time_field in ['expires', 'last_accessed', 'created_at']:
+        if entry_dict.get(time_field):
+            entry_dict[time_field] = entry_dict[time_field].isoformat()
+    return json.dumps(entry_dict)
+
+def _entry_from_dict(entry_data: Dict[str, Any]) -> CacheEntry:
+    """反序列化缓存条目"""
+    for time_field in ['expires', 'last_accessed', 'created_at']:
+        if entry_data.get(time_field):
+            entry_data[time_field] = datetime.fromisoformat(entry_data[time_field])
+    entry_data['resource_type'] = ResourceType(entry_data['resource_type'])
+    entry_data['compression'] = CompressionType(entry_data['compression'])
+    return CacheEntry(**entry_data)
+
+class EdgeCacheIndexStore:
+    """SQLite持久化缓存索引
+    
+    每次新增/删除只写一行（WAL模式），进程崩溃不会丢失或损坏整个索引；
+    访问时间批量回写，按 last_accessed 建索引以便按LRU顺序加载。
+    """
+    
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "cache_key TEXT PRIMARY KEY, last_accessed REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_entries_last_accessed ON entries (last_accessed)"
+        )
+        self._conn.commit()
+        
+    def load(self) -> List[Tuple[str, CacheEntry]]:
+        """按最近访问时间升序加载全部条目"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cache_key, data FROM entries ORDER BY last_accessed"
+            ).fetchall()
+        entries = []
+        for cache_key, data in rows:
+            try:
+                entries.append((cache_key, _entry_from_dict(json.loads(data))))
+            except Exception as e:
+                logger.warning(f"Skipping corrupt cache index row {cache_key}: {str(e)}")
+        return entries
+        
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is None
+        
+    def upsert_many(self, items: List[Tuple[str, CacheEntry]]):
+        """写入或更新条目"""
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (cache_key, last_accessed, data) VALUES (?, ?, ?)",
+                [(key, entry.last_accessed.timestamp(), _entry_to_json(entry)) for key, entry in items]
+            )
+            self._conn.commit()
+            
+    def delete_many(self, cache_keys: List[str]):
+        """删除条目"""
+        if not cache_keys:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM entries WHERE cache_key = ?", [(key,) for key in cache_keys]
+            )
+            self._conn.commit()
+            
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
 class CDNProvider(str, Enum):
     """CDN提供商"""
     CLOUDFLARE = "cloudflare"
@@ -100,10 +185,15 @@ class EdgeCache:
         self.default_ttl = default_ttl
         self.cdn_config = cdn_config
         
-        # 缓存元数据
-        self.cache_index: Dict[str, CacheEntry] = {}
+        # 缓存元数据 - 按访问顺序排列，队首为最久未使用
+        self.cache_index: "OrderedDict[str, CacheEntry]" = OrderedDict()
         self.size_by_type: Dict[ResourceType, int] = defaultdict(int)
         self.total_size = 0
+        self.index_store = EdgeCacheIndexStore(self.cache_dir / "cache_index.sqlite3")
+        self._dirty_keys: set = set()  # 访问时间待回写的条目
+        
+        # 同一URL的并发回源合并为一次
+        self._inflight: Dict[str, asyncio.Future] = {}
         
         # 性能统计
         self.stats = {
@@ -111,7 +201,8 @@ class EdgeCache:
             "misses": 0,
             "evictions": 0,
             "compression_savings": 0,
-            "total_requests": 0
+            "total_requests": 0,
+            "coalesced_fetches": 0
         }
         
         self.session: Optional[aiohttp.ClientSession] = None
@@ -128,6 +219,7 @@ class EdgeCache:
         if self.session:
             await self.session.close()
         await self._save_cache_index()
+        self.index_store.close()
         
     def _get_resource_type(self, url: str, content_type: str) -> ResourceType:
         """根据URL和Content-Type确定资源类型"""
@@ -233,74 +325,151 @@ class EdgeCache:
             return None
             
     async def _evict_lru_entries(self, required_space: int):
-        """基于LRU策略清理缓存"""
-        # 按最后访问时间排序
-        entries_by_access = sorted(
-            self.cache_index.values(),
-            key=lambda x: x.last_accessed
-        )
-        
+        """基于LRU策略清理缓存 - 从访问顺序队首逐个淘汰"""
         freed_space = 0
-        for entry in entries_by_access:
-            if freed_space >= required_space:
-                break
-                
-            await self._remove_cache_entry(entry.url)
+        evicted_keys = []
+        while self.cache_index and freed_space < required_space:
+            cache_key, entry = next(iter(self.cache_index.items()))
+            self._drop_entry(cache_key)
+            evicted_keys.append(cache_key)
             freed_space += entry.content_length
             self.stats["evictions"] += 1
             
-        logger.info(f"Evicted entries, freed {freed_space} bytes")
+        self.index_store.delete_many(evicted_keys)
+        logger.info(f"Evicted {len(evicted_keys)} entries, freed {freed_space} bytes")
+        
+    def _drop_entry(self, cache_key: str) -> Optional[CacheEntry]:
+        """从内存索引移除条目并删除缓存文件（不写持久化索引）"""
+        entry = self.cache_index.pop(cache_key, None)
+        if entry is None:
+            return None
+            
+        # 删除文件
+        cache_path = Path(entry.file_path)
+        if cache_path.exists():
+            cache_path.unlink()
+            
+        # 更新统计
+        self.total_size -= entry.content_length
+        self.size_by_type[entry.resource_type] -= entry.content_length
+        self._dirty_keys.discard(cache_key)
+        return entry
         
     async def _remove_cache_entry(self, url: str):
         """删除缓存条目"""
         cache_key = self._get_cache_key(url)
-        if cache_key in self.cache_index:
-            entry = self.cache_index[cache_key]
-            
-            # 删除文件
-            cache_path = Path(entry.file_path)
-            if cache_path.exists():
-                cache_path.unlink()
-                
-            # 更新统计
-            self.total_size -= entry.content_length
-            self.size_by_type[entry.resource_type] -= entry.content_length
+        if self._drop_entry(cache_key) is not None:
+            self.index_store.delete_many([cache_key])
             
-            # 从索引中移除
-            del self.cache_index[cache_key]
+    def _lookup(self, url: str) -> Optional[CacheEntry]:
+        """查找未过期的缓存条目并记录访问"""
+        cache_key = self._get_cache_key(url)
+        entry = self.cache_index.get(cache_key)
+        if entry is None:
+            return None
+        if datetime.now() >= entry.expires:
+            return None
             
+        entry.hit_count += 1
+        entry.last_accessed = datetime.now()
+        self.cache_index.move_to_end(cache_key)
+        self._dirty_keys.add(cache_key)
+        return entry
+        
     async def get(self, url: str, force_refresh: bool = False) -> Optional[bytes]:
         """获取资源"""
         self.stats["total_requests"] += 1
-        cache_key = self._get_cache_key(url)
         
         # 检查缓存
-        if not force_refresh and cache_key in self.cache_index:
-            entry = self.cache_index[cache_key]
-            
-            # 检查过期
-            if datetime.now() < entry.expires:
-                # 缓存命中
-                try:
-                    async with aiofiles.open(entry.file_path, 'rb') as f:
-                        compressed_content = await f.read()
-                        content = self._decompress_content(compressed_content, entry.compression)
-                        
-                    # 更新统计
-                    entry.hit_count += 1
-                    entry.last_accessed = datetime.now()
-                    self.stats["hits"] += 1
-                    
-                    return content
-                except Exception as e:
-                    logger.error(f"Error reading cache file {entry.file_path}: {str(e)}")
-                    await self._remove_cache_entry(url)
-            else:
-                # 缓存过期
-                await self._remove_cache_entry(url)
+        entry = None if force_refresh else self._lookup(url)
+        if entry is not None:
+            # 缓存命中
+            try:
+                async with aiofiles.open(entry.file_path, 'rb') as f:
+                    compressed_content = await f.read()
+                content = self._decompress_content(compressed_content, entry.compression)
+                self.stats["hits"] += 1
+                return content
+            except Exception as e:
+                logger.error(f"Error reading cache file {entry.file_path}: {str(e)}")
                 
-        # 缓存未命中，从源获取
+        # 缓存未命中或已过期，从源获取
+        await self._remove_cache_entry(url)
         self.stats["misses"] += 1
+        return await self._fetch_single_flight(url)
+        
+    async def get_file_response(self, url: str, accept_encoding: str = "") -> Optional[Response]:
+        """以文件响应返回缓存资源
+        
+        命中时直接返回磁盘上的缓存文件（客户端接受对应压缩编码时连同
+        Content-Encoding 原样下发），由ASGI服务器从磁盘流式发送，无需在
+        Python中读入、解压再复制。
+        """
+        self.stats["total_requests"] += 1
+        entry = self._lookup(url)
+        if entry is not None:
+            self.stats["hits"] += 1
+        else:
+            await self._remove_cache_entry(url)
+            self.stats["misses"] += 1
+            content = await self._fetch_single_flight(url)
+            if content is None:
+                return None
+            entry = self.cache_index.get(self._get_cache_key(url))
+            if entry is None:
+                # 未能写入缓存（如超过单文件大小限制）
+                return Response(content=content)
+                
+        headers = {"Cache-Control": f"public, max-age={self.default_ttl}"}
+        if entry.etag:
+            headers["ETag"] = entry.etag
+        if entry.last_modified:
+            headers["Last-Modified"] = entry.last_modified
+            
+        encoding = {CompressionType.GZIP: "gzip", CompressionType.BROTLI: "br"}.get(entry.compression)
+        if encoding is None or encoding in accept_encoding:
+            if encoding:
+                headers["Content-Encoding"] = encoding
+                headers["Vary"] = "Accept-Encoding"
+            return FileResponse(entry.file_path, media_type=entry.content_type or None, headers=headers)
+            
+        # 客户端不支持该压缩编码，回退为解压后返回
+        async with aiofiles.open(entry.file_path, 'rb') as f:
+            compressed_content = await f.read()
+        return Response(
+            content=self._decompress_content(compressed_content, entry.compression),
+            media_type=entry.content_type or None,
+            headers=headers
+        )
+        
+    async def _fetch_single_flight(self, url: str) -> Optional[bytes]:
+        """同一URL的并发回源只执行一次，其余调用等待同一结果"""
+        cache_key = self._get_cache_key(url)
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None:
+            self.stats["coalesced_fetches"] += 1
+            return await asyncio.shield(inflight)
+            
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            content = await self._fetch_and_store(url)
+            future.set_result(content)
+            return content
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免无人等待时出现 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+            
+    async def _fetch_and_store(self, url: str) -> Optional[bytes]:
+        """回源获取资源并写入缓存"""
+        cache_key = self._get_cache_key(url)
         result = await self._fetch_resource(url)
         if result is None:
             return None
@@ -327,11 +496,13 @@ class EdgeCache:
         if self.total_size + required_space > self.max_size_bytes:
             await self._evict_lru_entries(required_space)
             
-        # 保存到缓存
+        # 保存到缓存 - 先写临时文件再原子替换，崩溃时不会留下半截文件
         cache_path = self._get_cache_path(cache_key, compression)
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
         try:
-            async with aiofiles.open(cache_path, 'wb') as f:
+            async with aiofiles.open(tmp_path, 'wb') as f:
                 await f.write(compressed_content)
+            os.replace(tmp_path, cache_path)
                 
             # 创建缓存条目
             entry = CacheEntry(
@@ -350,11 +521,14 @@ class EdgeCache:
             self.cache_index[cache_key] = entry
             self.total_size += len(compressed_content)
             self.size_by_type[resource_type] += len(compressed_content)
+            self.index_store.upsert_many([(cache_key, entry)])
             
             logger.info(f"Cached {url} ({resource_type.value}, {compression.value}, {len(compressed_content)} bytes)")
             
         except Exception as e:
             logger.error(f"Error saving cache file {cache_path}: {str(e)}")
+            if tmp_path.exists():
+                tmp_path.unlink()
             
         return content
         
@@ -406,48 +580,47 @@ class EdgeCache:
         
     async def _load_cache_index(self):
         """加载缓存索引"""
-        index_file = self.cache_dir / "cache_index.json"
-        if index_file.exists():
-            try:
-                async with aiofiles.open(index_file, 'r') as f:
-                    content = await f.read()
-                    data = json.loads(content)
-                    
-                for key, entry_data in data.items():
-                    # 转换时间字段
-                    for time_field in ['expires', 'last_accessed', 'created_at']:
-                        if entry_data.get(time_field):
-                            entry_data[time_field] = datetime.fromisoformat(entry_data[time_field])
-                            
-                    entry = CacheEntry(**entry_data)
+        self._migrate_json_index()
+        try:
+            for key, entry in self.index_store.load():
+                # 检查文件是否存在
+                if Path(entry.file_path).exists():
+                    self.cache_index[key] = entry
+                    self.total_size += entry.content_length
+                    self.size_by_type[entry.resource_type] += entry.content_length
+                else:
+                    self.index_store.delete_many([key])
                     
-                    # 检查文件是否存在
-                    if Path(entry.file_path).exists():
-                        self.cache_index[key] = entry
-                        self.total_size += entry.content_length
-                        self.size_by_type[entry.resource_type] += entry.content_length
-                        
-                logger.info(f"Loaded cache index with {len(self.cache_index)} entries")
-            except Exception as e:
-                logger.error(f"Error loading cache index: {str(e)}")
-                
-    async def _save_cache_index(self):
-        """保存缓存索引"""
+            logger.info(f"Loaded cache index with {len(self.cache_index)} entries")
+        except Exception as e:
+            logger.error(f"Error loading cache index: {str(e)}")
+            
+    def _migrate_json_index(self):
+        """将旧版 cache_index.json 导入SQLite索引"""
         index_file = self.cache_dir / "cache_index.json"
+        if not index_file.exists() or not self.index_store.is_empty():
+            return
         try:
-            data = {}
-            for key, entry in self.cache_index.items():
-                entry_dict = asdict(entry)
-                # 转换时间字段为字符串
-                for time_field in ['expires', 'last_accessed', 'created_at']:
-                    if entry_dict.get(time_field):
-                        entry_dict[time_field] = entry_dict[time_field].isoformat()
-                data[key] = entry_dict
-                
-            async with aiofiles.open(index_file, 'w') as f:
-                await f.write(json.dumps(data, indent=2))
+            data = json.loads(index_file.read_text())
+            self.index_store.upsert_many(
+                [(key, _entry_from_dict(entry_data)) for key, entry_data in data.items()]
+            )
+            index_file.rename(index_file.with_suffix(".json.migrated"))
+            logger.info(f"Migrated {len(data)} entries from legacy JSON cache index")
+        except Exception as e:
+            logger.error(f"Error migrating legacy cache index: {str(e)}")
                 
-            logger.info("Saved cache index")
+    async def _save_cache_index(self):
+        """回写访问时间等变更（新增/删除已实时持久化）"""
+        try:
+            dirty = [
+                (key, self.cache_index[key]) for key in self._dirty_keys
+                if key in self.cache_index
+            ]
+            self.index_store.upsert_many(dirty)
+            self._dirty_keys.clear()
+            
+            logger.info(f"Saved cache index ({len(dirty)} updated entries)")
         except Exception as e:
             logger.error(f"Error saving cache index: {str(e)}")
 
@@ -8,14 +8,21 @@ Features:
 - Dead letter queue handling
 - Event type registration
 - Consumer group management
+- Pipelined batch publish and batched consume/ack
+- Keyed ordered lanes: per-key ordering with cross-key parallelism
+- Pluggable transport: Redis Streams or in-memory (optionally segment-backed)
+- Projection snapshots with offset-based and bulk replay
 """
 
 import asyncio
 import json
 import logging
+import os
 import time
+import zlib
+from collections import deque
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Callable, Union
+from typing import Any, Dict, List, Optional, Callable, Set, Union
 from dataclasses import dataclass, asdict
 from enum import Enum
 
@@ -67,6 +74,8 @@ class EventMetadata:
     correlation_id: Optional[str] = None
     user_id: Optional[str] = None
     trace_id: Optional[str] = None
+    stream_id: Optional[str] = None  # set when read back from a stream
+    retry_handlers: Optional[List[str]] = None  # set on retried copies: only these handlers run again
 
 
 class Event(BaseModel):
@@ -87,6 +96,16 @@ class EventHandler:
         self.event_types = event_types
         self.logger = logging.getLogger(f"{self.__class__.__module__}.{self.__class__.__name__}")
     
+    @property
+    def handler_id(self) -> str:
+        """Name recorded on retried events to target this handler"""
+        return self.__class__.__name__
+    
+    def should_handle(self, event: Event) -> bool:
+        """False for retried copies of events this handler already processed"""
+        retry_handlers = event.metadata.retry_handlers
+        return retry_handlers is None or self.handler_id in retry_handlers
+    
     async def handle(self, event: Event) -> bool:
         """Handle event - return True if successful"""
         try:
@@ -102,39 +121,243 @@ class EventHandler:
     async def process_event(self, event: Event):
         """Override this method to implement event processing logic"""
         raise NotImplementedError
+    
+    async def handle_batch(self, events: List[Event]) -> List[bool]:
+        """Handle a batch of events read together from a stream
+        
+        Returns one success flag per event. Override for handlers that can
+        process a batch more cheaply than event by event.
+        """
+        return [await self.handle(event) for event in events]
+
+
+def _stream_id_key(stream_id: str) -> tuple:
+    ms, _, seq = stream_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class EventProjection(EventHandler):
+    """Read model rebuilt from events
+    
+    ``apply`` must only change in-memory state (no I/O or notifications), so
+    the bus can bulk-replay history into it. ``offsets`` records the last
+    stream ID applied per event type; snapshots store state and offsets
+    together, and replay resumes after them.
+    
+    While consuming, projections follow the whole stream with a plain XREAD
+    instead of the consumer group, so every process holds the complete read
+    model and any of them may write the shared snapshot.
+    """
+    
+    def __init__(self, name: str, event_types: List[EventType]):
+        super().__init__(event_types)
+        self.name = name
+        self.offsets: Dict[str, str] = {}
+        self.events_since_snapshot = 0
+    
+    @property
+    def handler_id(self) -> str:
+        return self.name
+    
+    def apply(self, event: Event):
+        """Apply one event to the projection state"""
+        raise NotImplementedError
+    
+    def get_state(self) -> Dict[str, Any]:
+        raise NotImplementedError
+    
+    def set_state(self, state: Dict[str, Any]):
+        raise NotImplementedError
+    
+    def apply_event(self, event: Event) -> bool:
+        """Apply an event unless its stream offset is already covered
+        
+        Retried copies that do not target this projection advance the offset
+        without being applied again.
+        """
+        stream_id = event.metadata.stream_id
+        offset = self.offsets.get(event.type.value)
+        if stream_id and offset and _stream_id_key(stream_id) <= _stream_id_key(offset):
+            return False
+        if not self.should_handle(event):
+            if stream_id:
+                self.offsets[event.type.value] = stream_id
+            return False
+        self.apply(event)
+        if stream_id:
+            self.offsets[event.type.value] = stream_id
+        self.events_since_snapshot += 1
+        return True
+    
+    async def process_event(self, event: Event):
+        self.apply_event(event)
+
+
+class PartitionLane:
+    """Ordered worker lane: sub-batches routed here run one after another"""
+    
+    def __init__(self, index: int, run: Callable):
+        self.index = index
+        self.run = run
+        # Created in start() so the queue binds to the consuming loop
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        # Submitted sub-batches not finished yet (queued or running)
+        self.in_flight: Set[asyncio.Future] = set()
+        self.stats = {
+            "processed_events": 0,
+            "processed_batches": 0,
+            "last_event_lag": 0.0,
+            "max_event_lag": 0.0
+        }
+        self._oldest_enqueued_at: deque = deque()
+    
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+    
+    def start(self):
+        if not self.running:
+            if self.queue is None:
+                self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._worker())
+    
+    async def stop(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        # Sub-batches still queued will not run; their messages stay pending
+        while self.queue is not None and not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            self._oldest_enqueued_at.popleft()
+            future.cancel()
+    
+    def submit(self, event_type: 'EventType', events: List['Event']) -> asyncio.Future:
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight.add(future)
+        future.add_done_callback(self.in_flight.discard)
+        self._oldest_enqueued_at.append(time.monotonic())
+        self.queue.put_nowait((event_type, events, future))
+        return future
+    
+    async def _worker(self):
+        while True:
+            event_type, events, future = await self.queue.get()
+            self._oldest_enqueued_at.popleft()
+            try:
+                results = await self.run(event_type, events)
+                if not future.done():
+                    future.set_result(results)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                # Lag: time from publish to completion of the last event
+                lag = max(0.0, time.time() - events[-1].metadata.timestamp)
+                self.stats["last_event_lag"] = lag
+                self.stats["max_event_lag"] = max(self.stats["max_event_lag"], lag)
+                self.stats["processed_events"] += len(events)
+                self.stats["processed_batches"] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "lane": self.index,
+            "queued_batches": self.queue.qsize() if self.queue is not None else 0,
+            "in_flight_batches": len(self.in_flight),
+            "oldest_queued_seconds": (
+                time.monotonic() - self._oldest_enqueued_at[0] if self._oldest_enqueued_at else 0.0
+            ),
+            **self.stats
+        }
 
 
 class EventBus:
-    """Redis Streams-based Event Bus Implementation"""
+    """Redis Streams-based Event Bus Implementation
+    
+    ``transport="memory"`` swaps Redis for an in-process stream client with
+    the same semantics (consumer groups, pending entries, ranges); set
+    ``segment_dir`` to persist it to append-only segment files.
+    """
     
     def __init__(self, 
                  redis_url: str = "redis://localhost:6379",
                  stream_prefix: str = "zhiyue:events",
                  consumer_group: str = "zhiyue-processors",
                  max_retries: int = 3,
-                 dead_letter_stream: str = "zhiyue:events:dlq"):
+                 dead_letter_stream: str = "zhiyue:events:dlq",
+                 publish_batch_size: int = 100,
+                 publish_flush_interval: float = 0.005,
+                 consume_batch_size: int = 100,
+                 lane_count: int = 8,
+                 lane_queue_depth: int = 4,
+                 partition_fields: tuple = ("exam_id", "sheet_id", "batch_id"),
+                 transport: str = "redis",
+                 segment_dir: Optional[str] = None,
+                 snapshot_interval: float = 300.0,
+                 shutdown_timeout: float = 30.0):
         
         self.redis_url = redis_url
+        self.transport = transport
+        self.segment_dir = segment_dir
+        self.snapshot_interval = snapshot_interval
+        self.shutdown_timeout = shutdown_timeout
         self.stream_prefix = stream_prefix
         self.consumer_group = consumer_group
         self.max_retries = max_retries
         self.dead_letter_stream = dead_letter_stream
         
+        # Publish buffer: events arriving during an in-flight flush share the next pipeline
+        self.publish_batch_size = publish_batch_size
+        self.publish_flush_interval = publish_flush_interval
+        self.consume_batch_size = consume_batch_size
+        self._publish_buffer: List[tuple] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flushes_in_flight = 0
+        
+        # Keyed lanes: events sharing a partition key stay ordered,
+        # different keys are handled in parallel
+        self.partition_fields = partition_fields
+        # Sub-batches a lane may hold before the consumers stop reading
+        self.lane_queue_depth = max(1, lane_queue_depth)
+        self.lanes: List[PartitionLane] = [
+            PartitionLane(index, self._run_lane_handlers) for index in range(max(1, lane_count))
+        ]
+        self.batch_stats = {
+            "publish_flushes": 0,
+            "events_published": 0,
+            "consume_batches": 0,
+            "events_consumed": 0
+        }
+        
         self.redis_client: Optional[aioredis.Redis] = None
         self.handlers: Dict[EventType, List[EventHandler]] = {}
         self.running = False
         self.consumer_tasks: List[asyncio.Task] = []
+        # Sub-batches dispatched to the lanes but not acked / retried yet
+        self._settle_tasks: Set[asyncio.Task] = set()
         
         self.logger = logging.getLogger(__name__)
     
     async def initialize(self):
         """Initialize Redis connection and create consumer groups"""
         try:
-            self.redis_client = aioredis.from_url(self.redis_url, decode_responses=True)
-            
-            # Test connection
-            await self.redis_client.ping()
-            self.logger.info("Redis connection established")
+            if self.transport == "memory":
+                from .event_bus_memory import InMemoryStreamClient
+                self.redis_client = InMemoryStreamClient(segment_dir=self.segment_dir)
+                self.logger.info("In-memory event transport initialized")
+            else:
+                self.redis_client = aioredis.from_url(self.redis_url, decode_responses=True)
+                
+                # Test connection
+                await self.redis_client.ping()
+                self.logger.info("Redis connection established")
             
             # Create consumer groups for event types
             for event_type in EventType:
@@ -168,11 +391,7 @@ class EventBus:
             self.logger.error(f"Failed to initialize event bus: {str(e)}")
             raise
     
-    async def publish(self, event: Event) -> str:
-        """Publish event to appropriate stream"""
-        if not self.redis_client:
-            raise RuntimeError("Event bus not initialized")
-        
+    def _stream_entry(self, event: Event) -> tuple:
         stream_name = f"{self.stream_prefix}:{event.type.value}"
         
         # Prepare event data for Redis
@@ -183,21 +402,86 @@ class EventBus:
             "version": event.version,
             "published_at": time.time()
         }
+        return stream_name, event_data
+    
+    async def publish(self, event: Event) -> str:
+        """Publish event to appropriate stream
+        
+        With no flush in flight the event is written immediately. Events
+        published while a flush is in flight are buffered and written with
+        one pipelined round trip when it completes, once ``publish_batch_size``
+        events are waiting, or after ``publish_flush_interval`` at the latest.
+        The returned message ID is available after that flush.
+        """
+        if not self.redis_client:
+            raise RuntimeError("Event bus not initialized")
+        
+        stream_name, event_data = self._stream_entry(event)
+        future = asyncio.get_running_loop().create_future()
+        self._publish_buffer.append((stream_name, event_data, event, future))
+        
+        if not self._flushes_in_flight or len(self._publish_buffer) >= self.publish_batch_size:
+            await self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.publish_flush_interval, lambda: asyncio.ensure_future(self.flush())
+            )
+        
+        return await future
+    
+    async def publish_many(self, events: List[Event]) -> List[str]:
+        """Publish several events in a single pipeline"""
+        if not self.redis_client:
+            raise RuntimeError("Event bus not initialized")
+        
+        loop = asyncio.get_running_loop()
+        futures = []
+        for event in events:
+            stream_name, event_data = self._stream_entry(event)
+            future = loop.create_future()
+            self._publish_buffer.append((stream_name, event_data, event, future))
+            futures.append(future)
+        
+        await self.flush()
+        return list(await asyncio.gather(*futures))
+    
+    async def flush(self):
+        """Write all buffered events with one pipeline"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        buffer, self._publish_buffer = self._publish_buffer, []
+        if not buffer:
+            return
         
+        self._flushes_in_flight += 1
         try:
-            # Add to stream
-            message_id = await self.redis_client.xadd(stream_name, event_data)
-            
-            self.logger.info(
+            pipe = self.redis_client.pipeline(transaction=False)
+            for stream_name, event_data, _, _ in buffer:
+                pipe.xadd(stream_name, event_data)
+            message_ids = await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Failed to publish {len(buffer)} events: {str(e)}")
+            for _, _, _, future in buffer:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._flushes_in_flight -= 1
+            # Events buffered behind this flush go out as the next batch
+            if self._publish_buffer and not self._flushes_in_flight:
+                asyncio.ensure_future(self.flush())
+        
+        self.batch_stats["publish_flushes"] += 1
+        self.batch_stats["events_published"] += len(buffer)
+        for (stream_name, _, event, future), message_id in zip(buffer, message_ids):
+            self.logger.debug(
                 f"Published event {event.type.value} with ID {message_id} "
                 f"to stream {stream_name}"
             )
-            
-            return message_id
-            
-        except Exception as e:
-            self.logger.error(f"Failed to publish event {event.type.value}: {str(e)}")
-            raise
+            if not future.done():
+                future.set_result(message_id)
     
     def register_handler(self, handler: EventHandler):
         """Register event handler for specific event types"""
@@ -222,12 +506,22 @@ class EventBus:
         self.running = True
         self.logger.info(f"Starting event consumption with consumer ID: {consumer_id}")
         
-        # Start consumer tasks for each event type with handlers
+        for lane in self.lanes:
+            lane.start()
+        
+        if self.get_projections():
+            self.consumer_tasks.append(asyncio.create_task(self._snapshot_loop()))
+        
+        # Start consumer tasks for each event type with handlers; the group
+        # splits messages across processes, projections read every message
         for event_type in self.handlers.keys():
-            task = asyncio.create_task(
-                self._consume_stream(event_type, consumer_id)
-            )
-            self.consumer_tasks.append(task)
+            if self._lane_handlers(event_type):
+                task = asyncio.create_task(
+                    self._consume_stream(event_type, consumer_id)
+                )
+                self.consumer_tasks.append(task)
+            if self._projections_for(event_type):
+                self.consumer_tasks.append(asyncio.create_task(self._follow_projections(event_type)))
         
         # Wait for all consumer tasks
         try:
@@ -238,17 +532,20 @@ class EventBus:
             self.running = False
     
     async def _consume_stream(self, event_type: EventType, consumer_id: str):
-        """Consume events from a specific stream"""
+        """Consume events from a specific stream in batches"""
         stream_name = f"{self.stream_prefix}:{event_type.value}"
         
         while self.running:
             try:
-                # Read from stream
+                # Keep reading while lanes work; only a full lane holds us back
+                await self._wait_for_lane_capacity()
+                
+                # Read up to consume_batch_size messages per round trip
                 messages = await self.redis_client.xreadgroup(
                     self.consumer_group,
                     consumer_id,
                     {stream_name: ">"},
-                    count=10,
+                    count=self.consume_batch_size,
                     block=1000
                 )
                 
@@ -256,10 +553,7 @@ class EventBus:
                     continue
                 
                 for stream, msgs in messages:
-                    for message_id, fields in msgs:
-                        await self._process_message(
-                            event_type, stream, message_id, fields, consumer_id
-                        )
+                    self._dispatch_batch(event_type, stream, msgs)
                         
             except asyncio.CancelledError:
                 break
@@ -267,6 +561,225 @@ class EventBus:
                 self.logger.error(f"Error consuming from {stream_name}: {str(e)}")
                 await asyncio.sleep(1)
     
+    async def _follow_projections(self, event_type: EventType):
+        """Feed projections from a plain XREAD of the stream, in stream order
+        
+        Starts after the lowest offset the projections already cover, so a
+        restored snapshot resumes where it left off. Failures are logged and
+        not retried: the event stays in the stream for the next rebuild.
+        """
+        stream_name = f"{self.stream_prefix}:{event_type.value}"
+        projections = self._projections_for(event_type)
+        offsets = [projection.offsets.get(event_type.value) for projection in projections]
+        last_id = "0-0" if None in offsets else min(offsets, key=_stream_id_key)
+        
+        while self.running:
+            try:
+                messages = await self.redis_client.xread(
+                    {stream_name: last_id},
+                    count=self.consume_batch_size,
+                    block=1000
+                )
+                if not messages:
+                    continue
+                
+                for _, msgs in messages:
+                    events = []
+                    for message_id, fields in msgs:
+                        last_id = message_id
+                        try:
+                            events.append(self._event_from_fields(fields, message_id))
+                        except Exception as e:
+                            self.logger.error(f"Error processing message {message_id}: {str(e)}")
+                    failures = await self._run_handlers(event_type, events, projections)
+                    failed = sum(1 for failed_handlers in failures if failed_handlers)
+                    if failed:
+                        self.logger.error(f"Projections failed {failed} events on {stream_name}")
+            
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"Error following {stream_name} for projections: {str(e)}")
+                await asyncio.sleep(1)
+    
+    @staticmethod
+    def _event_from_fields(fields: Dict[str, str], message_id: Optional[str] = None) -> Event:
+        event = Event(
+            type=EventType(fields["type"]),
+            data=json.loads(fields["data"]),
+            metadata=EventMetadata(**json.loads(fields["metadata"])),
+            version=fields["version"]
+        )
+        if message_id is not None:
+            event.metadata.stream_id = message_id
+        return event
+    
+    async def _process_batch(self,
+                           event_type: EventType,
+                           stream: str,
+                           msgs: List[tuple],
+                           consumer_id: str):
+        """Process a batch of messages and wait until all of it is acked or retried"""
+        settle_tasks = self._dispatch_batch(event_type, stream, msgs)
+        if settle_tasks:
+            await asyncio.gather(*settle_tasks)
+    
+    def _dispatch_batch(self, event_type: EventType, stream: str, msgs: List[tuple]) -> List[asyncio.Task]:
+        """Route a batch onto the lanes without waiting for it to finish
+        
+        Each lane's sub-batch is acked (or retried) as soon as that lane is
+        done with it, so one slow key only holds back its own messages.
+        Returns the tracked settle tasks.
+        """
+        self.batch_stats["consume_batches"] += 1
+        self.batch_stats["events_consumed"] += len(msgs)
+        
+        # Reconstruct events
+        entries = []
+        failed = []
+        for message_id, fields in msgs:
+            try:
+                entries.append((message_id, fields, self._event_from_fields(fields, message_id)))
+            except Exception as e:
+                self.logger.error(f"Error processing message {message_id}: {str(e)}")
+                failed.append((message_id, fields, None))
+        
+        settle_tasks = []
+        if failed:
+            settle_tasks.append(self._track_settle(self._handle_failed_messages(stream, failed)))
+        if not entries:
+            return settle_tasks
+        
+        if not any(lane.running for lane in self.lanes):
+            # Lanes are not running (e.g. direct calls outside start_consuming)
+            events = [event for _, _, event in entries]
+            settle_tasks.append(self._track_settle(
+                self._settle_sub_batch(event_type, stream, entries, self._run_lane_handlers(event_type, events))
+            ))
+            return settle_tasks
+        
+        groups: Dict[int, List[tuple]] = {}
+        for entry in entries:
+            groups.setdefault(self._lane_for(entry[2]).index, []).append(entry)
+        for lane_index, lane_entries in groups.items():
+            future = self.lanes[lane_index].submit(event_type, [event for _, _, event in lane_entries])
+            settle_tasks.append(self._track_settle(
+                self._settle_sub_batch(event_type, stream, lane_entries, future)
+            ))
+        return settle_tasks
+    
+    def _track_settle(self, awaitable) -> asyncio.Task:
+        task = asyncio.ensure_future(awaitable)
+        self._settle_tasks.add(task)
+        task.add_done_callback(self._settle_tasks.discard)
+        return task
+    
+    async def _settle_sub_batch(self, event_type: EventType, stream: str,
+                                entries: List[tuple], results) -> None:
+        """Wait for one lane's sub-batch, then ack successes with one XACK"""
+        try:
+            failures = await results
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Lane failed for {event_type.value}: {e}")
+            failures = [
+                [h.handler_id for h in self._lane_handlers(event_type) if h.should_handle(event)]
+                for _, _, event in entries
+            ]
+        
+        acked = []
+        failed = []
+        for (message_id, fields, _), failed_handlers in zip(entries, failures):
+            if not failed_handlers:
+                acked.append(message_id)
+            else:
+                failed.append((message_id, fields, failed_handlers))
+        
+        if acked:
+            # Acknowledge successful processing
+            try:
+                await self.redis_client.xack(stream, self.consumer_group, *acked)
+                self.logger.debug(f"Acknowledged {len(acked)} messages on {stream}")
+            except Exception as e:
+                self.logger.error(f"Error acknowledging {len(acked)} messages on {stream}: {str(e)}")
+        
+        if failed:
+            # Handle failed processing
+            await self._handle_failed_messages(stream, failed)
+    
+    async def _wait_for_lane_capacity(self):
+        """Back-pressure: wait while any lane already holds lane_queue_depth sub-batches"""
+        while True:
+            busy = [
+                future
+                for lane in self.lanes if len(lane.in_flight) >= self.lane_queue_depth
+                for future in lane.in_flight
+            ]
+            if not busy:
+                return
+            await asyncio.wait(busy, return_when=asyncio.FIRST_COMPLETED)
+    
+    def partition_key(self, event: Event) -> str:
+        """Ordering key: the first partition field present, else the event itself"""
+        data = event.data if isinstance(event.data, dict) else {}
+        for field in self.partition_fields:
+            value = data.get(field)
+            if value is not None:
+                return f"{field}:{value}"
+        return event.metadata.event_id
+    
+    def _lane_for(self, event: Event) -> PartitionLane:
+        key = self.partition_key(event)
+        return self.lanes[zlib.crc32(key.encode()) % len(self.lanes)]
+    
+    def get_lane_stats(self) -> List[Dict[str, Any]]:
+        return [lane.get_stats() for lane in self.lanes]
+    
+    def _projections_for(self, event_type: EventType) -> List[EventProjection]:
+        return [h for h in self.handlers.get(event_type, []) if isinstance(h, EventProjection)]
+    
+    def _lane_handlers(self, event_type: EventType) -> List[EventHandler]:
+        return [h for h in self.handlers.get(event_type, []) if not isinstance(h, EventProjection)]
+    
+    async def _run_lane_handlers(self, event_type: EventType, events: List[Event]) -> List[List[str]]:
+        return await self._run_handlers(event_type, events, self._lane_handlers(event_type))
+    
+    async def _run_handlers(self, event_type: EventType, events: List[Event],
+                            handlers: Optional[List[EventHandler]] = None) -> List[List[str]]:
+        """Run handlers (all registered by default) over the batch
+        
+        Retried events only go to the handlers that failed them before.
+        Returns the IDs of the handlers that failed, per event.
+        """
+        failures: List[List[str]] = [[] for _ in events]
+        if not events:
+            return failures
+        
+        if handlers is None:
+            handlers = self.handlers.get(event_type, [])
+        for handler in handlers:
+            positions = [index for index, event in enumerate(events) if handler.should_handle(event)]
+            if not positions:
+                continue
+            batch = events if len(positions) == len(events) else [events[index] for index in positions]
+            try:
+                handler_results = await handler.handle_batch(batch)
+            except Exception as e:
+                self.logger.error(
+                    f"Handler {handler.__class__.__name__} error for batch of {len(batch)} events: {str(e)}"
+                )
+                handler_results = [False] * len(batch)
+            
+            for index, handler_success in zip(positions, handler_results):
+                if not handler_success:
+                    failures[index].append(handler.handler_id)
+                    self.logger.warning(
+                        f"Handler {handler.__class__.__name__} failed for event {events[index].metadata.event_id}"
+                    )
+        
+        return failures
+    
     async def _process_message(self, 
                              event_type: EventType, 
                              stream: str, 
@@ -274,71 +787,47 @@ class EventBus:
                              fields: Dict[str, str],
                              consumer_id: str):
         """Process individual message"""
+        await self._process_batch(event_type, stream, [(message_id, fields)], consumer_id)
+    
+    async def _handle_failed_messages(self, stream: str, failed: List[tuple]):
+        """Retry or dead-letter failed messages, then ack them, in one pipeline
+        
+        ``failed`` holds (message_id, fields, failed_handler_ids); the retried
+        copy only targets those handlers, or every handler when None.
+        """
         try:
-            # Reconstruct event
-            event = Event(
-                type=EventType(fields["type"]),
-                data=json.loads(fields["data"]),
-                metadata=EventMetadata(**json.loads(fields["metadata"])),
-                version=fields["version"]
-            )
-            
-            # Process with all registered handlers
-            success = True
-            handlers = self.handlers.get(event_type, [])
+            pipe = self.redis_client.pipeline(transaction=False)
+            for message_id, fields, failed_handlers in failed:
+                # Check retry count
+                retry_count = int(fields.get("retry_count", "0"))
+                
+                if retry_count < self.max_retries:
+                    # Increment retry count and re-add to stream
+                    fields["retry_count"] = str(retry_count + 1)
+                    fields["last_retry"] = str(time.time())
+                    if failed_handlers:
+                        metadata = json.loads(fields["metadata"])
+                        metadata["retry_handlers"] = sorted(set(failed_handlers))
+                        fields["metadata"] = json.dumps(metadata)
+                    pipe.xadd(stream, fields)
+                    self.logger.info(f"Retrying message {message_id}, attempt {retry_count + 1}")
+                else:
+                    # Move to dead letter queue
+                    fields["original_stream"] = stream
+                    fields["failed_at"] = str(time.time())
+                    pipe.xadd(self.dead_letter_stream, fields)
+                    self.logger.warning(f"Moved message {message_id} to dead letter queue")
             
-            for handler in handlers:
-                try:
-                    handler_success = await handler.handle(event)
-                    if not handler_success:
-                        success = False
-                        self.logger.warning(
-                            f"Handler {handler.__class__.__name__} failed for event {message_id}"
-                        )
-                except Exception as e:
-                    success = False
-                    self.logger.error(
-                        f"Handler {handler.__class__.__name__} error for event {message_id}: {str(e)}"
-                    )
+            # Acknowledge the original messages
+            pipe.xack(stream, self.consumer_group, *[message_id for message_id, _, _ in failed])
+            await pipe.execute()
             
-            if success:
-                # Acknowledge successful processing
-                await self.redis_client.xack(stream, self.consumer_group, message_id)
-                self.logger.debug(f"Acknowledged message {message_id}")
-            else:
-                # Handle failed processing
-                await self._handle_failed_message(stream, message_id, fields)
-                
         except Exception as e:
-            self.logger.error(f"Error processing message {message_id}: {str(e)}")
-            await self._handle_failed_message(stream, message_id, fields)
+            self.logger.error(f"Error handling {len(failed)} failed messages on {stream}: {str(e)}")
     
     async def _handle_failed_message(self, stream: str, message_id: str, fields: Dict[str, str]):
         """Handle failed message processing"""
-        try:
-            # Check retry count
-            retry_count = int(fields.get("retry_count", "0"))
-            
-            if retry_count < self.max_retries:
-                # Increment retry count and re-add to stream
-                fields["retry_count"] = str(retry_count + 1)
-                fields["last_retry"] = str(time.time())
-                
-                await self.redis_client.xadd(stream, fields)
-                self.logger.info(f"Retrying message {message_id}, attempt {retry_count + 1}")
-            else:
-                # Move to dead letter queue
-                fields["original_stream"] = stream
-                fields["failed_at"] = str(time.time())
-                
-                await self.redis_client.xadd(self.dead_letter_stream, fields)
-                self.logger.warning(f"Moved message {message_id} to dead letter queue")
-            
-            # Acknowledge the original message
-            await self.redis_client.xack(stream, self.consumer_group, message_id)
-            
-        except Exception as e:
-            self.logger.error(f"Error handling failed message {message_id}: {str(e)}")
+        await self._handle_failed_messages(stream, [(message_id, fields, None)])
     
     async def stop_consuming(self):
         """Stop consuming events"""
@@ -353,6 +842,19 @@ class EventBus:
             await asyncio.gather(*self.consumer_tasks, return_exceptions=True)
         
         self.consumer_tasks.clear()
+        
+        # Let dispatched sub-batches finish and ack; whatever is left stays pending
+        if self._settle_tasks:
+            await asyncio.wait(set(self._settle_tasks), timeout=self.shutdown_timeout)
+        
+        for lane in self.lanes:
+            await lane.stop()
+        
+        if self._settle_tasks:
+            remaining = list(self._settle_tasks)
+            for task in remaining:
+                task.cancel()
+            await asyncio.gather(*remaining, return_exceptions=True)
         self.logger.info("Event consumption stopped")
     
     async def get_stream_info(self, event_type: EventType) -> Dict[str, Any]:
@@ -369,7 +871,8 @@ class EventBus:
                 "length": info["length"],
                 "first_entry": info.get("first-entry"),
                 "last_entry": info.get("last-entry"),
-                "consumer_groups": info.get("groups", 0)
+                "consumer_groups": info.get("groups", 0),
+                "lanes": self.get_lane_stats()
             }
         except Exception as e:
             self.logger.error(f"Error getting stream info for {stream_name}: {str(e)}")
@@ -407,15 +910,21 @@ class EventBus:
     
     async def replay_events(self, 
                           event_type: EventType, 
-                          start_time: datetime, 
-                          end_time: datetime = None) -> List[Event]:
-        """Replay events within a time range"""
+                          start_time: Optional[datetime] = None, 
+                          end_time: datetime = None,
+                          after_id: Optional[str] = None) -> List[Event]:
+        """Replay events within a time range, or after a stream offset"""
         if not self.redis_client:
             raise RuntimeError("Event bus not initialized")
         
         stream_name = f"{self.stream_prefix}:{event_type.value}"
         
-        start_id = f"{int(start_time.timestamp() * 1000)}-0"
+        if after_id:
+            start_id = f"({after_id}"
+        elif start_time:
+            start_id = f"{int(start_time.timestamp() * 1000)}-0"
+        else:
+            start_id = "-"
         end_id = "+" if not end_time else f"{int(end_time.timestamp() * 1000)}-0"
         
         try:
@@ -424,13 +933,7 @@ class EventBus:
             events = []
             for message_id, fields in messages:
                 try:
-                    event = Event(
-                        type=EventType(fields["type"]),
-                        data=json.loads(fields["data"]),
-                        metadata=EventMetadata(**json.loads(fields["metadata"])),
-                        version=fields["version"]
-                    )
-                    events.append(event)
+                    events.append(self._event_from_fields(fields, message_id))
                 except Exception as e:
                     self.logger.warning(f"Error reconstructing event {message_id}: {str(e)}")
             
@@ -440,10 +943,141 @@ class EventBus:
             self.logger.error(f"Error replaying events: {str(e)}")
             return []
     
+    async def iter_stream(self, event_type: EventType, after_id: Optional[str] = None,
+                          chunk_size: int = 1000):
+        """Yield chunks of events after a stream offset, oldest first"""
+        if not self.redis_client:
+            raise RuntimeError("Event bus not initialized")
+        
+        stream_name = f"{self.stream_prefix}:{event_type.value}"
+        start_id = f"({after_id}" if after_id else "-"
+        
+        while True:
+            messages = await self.redis_client.xrange(stream_name, start_id, "+", count=chunk_size)
+            if not messages:
+                return
+            
+            events = []
+            for message_id, fields in messages:
+                try:
+                    events.append(self._event_from_fields(fields, message_id))
+                except Exception as e:
+                    self.logger.warning(f"Error reconstructing event {message_id}: {str(e)}")
+            yield events
+            
+            if len(messages) < chunk_size:
+                return
+            start_id = f"({messages[-1][0]}"
+    
+    # ------------------------------------------------------------------
+    # Projection snapshots
+    # ------------------------------------------------------------------
+    
+    def _snapshot_key(self, projection: EventProjection) -> str:
+        return f"{self.stream_prefix}:snapshots:{projection.name}"
+    
+    def get_projections(self) -> List[EventProjection]:
+        projections = []
+        for handlers in self.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, EventProjection) and handler not in projections:
+                    projections.append(handler)
+        return projections
+    
+    async def save_projection_snapshot(self, projection: EventProjection):
+        """Store projection state together with the stream offsets it covers
+        
+        Every consuming process applies the whole stream, so whichever one
+        writes last stores a complete state for its offsets.
+        """
+        snapshot = {
+            "name": projection.name,
+            "state": projection.get_state(),
+            "offsets": dict(projection.offsets),
+            "created_at": time.time()
+        }
+        await self.redis_client.set(self._snapshot_key(projection), json.dumps(snapshot, default=str))
+        projection.events_since_snapshot = 0
+        self.logger.info(f"Saved snapshot for projection {projection.name} at offsets {projection.offsets}")
+    
+    async def load_projection_snapshot(self, projection: EventProjection) -> bool:
+        raw = await self.redis_client.get(self._snapshot_key(projection))
+        if not raw:
+            return False
+        snapshot = json.loads(raw)
+        projection.set_state(snapshot["state"])
+        projection.offsets = dict(snapshot.get("offsets", {}))
+        projection.events_since_snapshot = 0
+        return True
+    
+    async def rebuild_projection(self, projection: EventProjection, bulk: bool = True,
+                                 chunk_size: int = 1000) -> int:
+        """Restore the latest snapshot, then replay only the events after it
+        
+        In bulk mode events are applied straight to the projection; otherwise
+        they are re-dispatched through every registered handler, side effects
+        included. A fresh snapshot is saved afterwards.
+        """
+        if not self.redis_client:
+            raise RuntimeError("Event bus not initialized")
+        
+        started = time.monotonic()
+        restored = await self.load_projection_snapshot(projection)
+        
+        replayed = 0
+        for event_type in projection.event_types:
+            async for events in self.iter_stream(event_type, projection.offsets.get(event_type.value), chunk_size):
+                if bulk:
+                    for event in events:
+                        projection.apply_event(event)
+                else:
+                    await self._run_handlers(event_type, events)
+                replayed += len(events)
+        
+        if replayed:
+            await self.save_projection_snapshot(projection)
+        
+        self.logger.info(
+            f"Rebuilt projection {projection.name} ({'from snapshot' if restored else 'from start'}) "
+            f"with {replayed} events in {time.monotonic() - started:.2f}s"
+        )
+        return replayed
+    
+    async def rebuild_projections(self, bulk: bool = True) -> Dict[str, int]:
+        """Rebuild every registered projection"""
+        return {
+            projection.name: await self.rebuild_projection(projection, bulk=bulk)
+            for projection in self.get_projections()
+        }
+    
+    async def _snapshot_loop(self):
+        """Periodically snapshot projections that changed"""
+        while self.running:
+            try:
+                await asyncio.sleep(self.snapshot_interval)
+                for projection in self.get_projections():
+                    if projection.events_since_snapshot:
+                        await self.save_projection_snapshot(projection)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"Error saving projection snapshots: {str(e)}")
+    
     async def close(self):
         """Close Redis connection"""
         await self.stop_consuming()
         
+        if self.redis_client and self._publish_buffer:
+            await self.flush()
+        
+        if self.redis_client:
+            for projection in self.get_projections():
+                if projection.events_since_snapshot:
+                    try:
+                        await self.save_projection_snapshot(projection)
+                    except Exception as e:
+                        self.logger.error(f"Failed to snapshot projection {projection.name}: {str(e)}")
+        
         if self.redis_client:
             await self.redis_client.close()
             self.redis_client = None
@@ -452,7 +1086,10 @@ class EventBus:
 
 
 # Global event bus instance
-event_bus = EventBus()
+event_bus = EventBus(
+    transport=os.getenv("EVENT_BUS_TRANSPORT", "redis"),
+    segment_dir=os.getenv("EVENT_BUS_SEGMENT_DIR") or None
+)
 
 
 # Convenience functions
@@ -0,0 +1,505 @@
+"""
+In-memory Redis Streams transport for the EventBus
+单节点部署和测试使用的进程内事件流实现
+
+Implements the subset of the ``redis.asyncio`` client API used by
+``EventBus`` (XADD, XREAD, XREADGROUP, XACK, XGROUP CREATE, XRANGE, XPENDING,
+XINFO STREAM, GET/SET and non-transactional pipelines) on top of asyncio, so the
+bus runs without a Redis server. With ``segment_dir`` set, appended
+entries and acknowledgements are also written to append-only segment
+files and restored on startup. Each new segment starts with a checkpoint
+of group offsets and values, and closed segments whose entries every
+group has acknowledged (or that were trimmed) are deleted.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from redis import ResponseError
+except ImportError:  # redis is optional for the in-memory transport
+    class ResponseError(Exception):
+        pass
+
+logger = logging.getLogger(__name__)
+
+StreamId = Tuple[int, int]
+
+
+def parse_stream_id(value: str, default_seq: int = 0) -> StreamId:
+    """Parse 'ms-seq' (or 'ms') into a comparable tuple"""
+    if "-" in value:
+        ms, seq = value.split("-", 1)
+        return int(ms), int(seq)
+    return int(value), default_seq
+
+
+def format_stream_id(stream_id: StreamId) -> str:
+    return f"{stream_id[0]}-{stream_id[1]}"
+
+
+class _ConsumerGroup:
+    def __init__(self, last_delivered: StreamId):
+        self.last_delivered = last_delivered
+        # message id -> [consumer, delivered_at (monotonic), times_delivered]
+        self.pending: Dict[StreamId, List[Any]] = {}
+        # Entries after last_delivered that were already acked (restored from segments)
+        self.acked_ahead: Set[StreamId] = set()
+
+
+class _Stream:
+    def __init__(self):
+        self.ids: List[StreamId] = []
+        self.entries: Dict[StreamId, Dict[str, str]] = {}
+        self.groups: Dict[str, _ConsumerGroup] = {}
+        self.last_id: StreamId = (0, 0)
+        self.new_entry = asyncio.Event()
+
+    def next_id(self) -> StreamId:
+        ms = int(time.time() * 1000)
+        if ms > self.last_id[0]:
+            return ms, 0
+        return self.last_id[0], self.last_id[1] + 1
+
+    def append(self, stream_id: StreamId, fields: Dict[str, str]):
+        self.ids.append(stream_id)
+        self.entries[stream_id] = fields
+        self.last_id = stream_id
+        # Wake every current reader; later readers wait on a fresh event,
+        # so one reader never clears the wakeup of another
+        self.new_entry.set()
+        self.new_entry = asyncio.Event()
+
+    def trim(self, max_length: int):
+        excess = len(self.ids) - max_length
+        if excess > 0:
+            for stream_id in self.ids[:excess]:
+                del self.entries[stream_id]
+            del self.ids[:excess]
+
+    def range_index(self, start: StreamId, exclusive: bool = False) -> int:
+        if exclusive:
+            return bisect.bisect_right(self.ids, start)
+        return bisect.bisect_left(self.ids, start)
+
+
+class InMemoryPipeline:
+    """Queues client calls and runs them in order on execute()"""
+
+    def __init__(self, client: 'InMemoryStreamClient'):
+        self._client = client
+        self._calls: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        def queue_call(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        queue_call.__doc__ = method.__doc__
+        return queue_call
+
+    async def execute(self) -> List[Any]:
+        calls, self._calls = self._calls, []
+        results = []
+        for name, args, kwargs in calls:
+            results.append(await getattr(self._client, name)(*args, **kwargs))
+        return results
+
+
+class InMemoryStreamClient:
+    """asyncio-native stand-in for the Redis Streams commands used by EventBus"""
+
+    def __init__(self, segment_dir: Optional[str] = None,
+                 segment_max_bytes: int = 64 * 1024 * 1024,
+                 max_stream_length: Optional[int] = 100000):
+        self.streams: Dict[str, _Stream] = {}
+        self.values: Dict[str, str] = {}
+        self.max_stream_length = max_stream_length
+
+        self.segment_dir = Path(segment_dir) if segment_dir else None
+        self.segment_max_bytes = segment_max_bytes
+        self._segment_file = None
+        self._segment_path: Optional[Path] = None
+        self._segment_index = 0
+        # segment path -> {stream: highest entry id written to that segment}
+        self._segment_max_ids: Dict[Path, Dict[str, StreamId]] = {}
+        self.segments_deleted = 0
+        if self.segment_dir is not None:
+            self._load_segments()
+
+    # ------------------------------------------------------------------
+    # Segment files
+    # ------------------------------------------------------------------
+
+    def _segment_paths(self) -> List[Path]:
+        return sorted(self.segment_dir.glob("segment-*.log"))
+
+    def _load_segments(self):
+        """Rebuild streams and group offsets from the append-only segments"""
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        acked: Dict[Tuple[str, str], Set[StreamId]] = {}
+        records = 0
+
+        for path in self._segment_paths():
+            self._segment_index = max(self._segment_index, int(path.stem.split("-")[1]))
+            max_ids = self._segment_max_ids.setdefault(path, {})
+            with open(path, "r", encoding="utf-8") as segment:
+                for line in segment:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping truncated record in {path.name}")
+                        continue
+                    records += 1
+                    op = record["op"]
+                    if op == "add":
+                        stream = self._stream(record["stream"])
+                        stream_id = parse_stream_id(record["id"])
+                        stream.append(stream_id, record["fields"])
+                        max_ids[record["stream"]] = stream_id
+                    elif op == "group":
+                        # Checkpoints repeat the group record with a later offset
+                        stream = self._stream(record["stream"])
+                        offset = parse_stream_id(record["id"])
+                        group = stream.groups.setdefault(record["group"], _ConsumerGroup(offset))
+                        group.last_delivered = max(group.last_delivered, offset)
+                    elif op == "set":
+                        self.values[record["key"]] = record["value"]
+                    elif op == "ack":
+                        acked.setdefault((record["stream"], record["group"]), set()).update(
+                            parse_stream_id(message_id) for message_id in record["ids"]
+                        )
+
+        # Each group resumes after its contiguous acked prefix; entries acked
+        # out of order beyond it are skipped instead of redelivered.
+        for (stream_name, group_name), acked_ids in acked.items():
+            stream = self.streams.get(stream_name)
+            group = stream.groups.get(group_name) if stream else None
+            if group is None:
+                continue
+            index = stream.range_index(group.last_delivered, exclusive=True)
+            while index < len(stream.ids) and stream.ids[index] in acked_ids:
+                group.last_delivered = stream.ids[index]
+                index += 1
+            group.acked_ahead = {
+                stream_id for stream_id in acked_ids if stream_id > group.last_delivered
+            }
+
+        for stream in self.streams.values():
+            stream.new_entry.clear()
+            if self.max_stream_length:
+                stream.trim(self.max_stream_length)
+
+        if records:
+            logger.info(f"Restored {records} event records from {self.segment_dir}")
+
+    def _append_record(self, record: Dict[str, Any]):
+        if self.segment_dir is None:
+            return
+        if self._segment_file is None or self._segment_file.tell() >= self.segment_max_bytes:
+            self._roll_segment()
+        self._write_record(record)
+        if record["op"] == "add":
+            self._segment_max_ids[self._segment_path][record["stream"]] = parse_stream_id(record["id"])
+
+    def _write_record(self, record: Dict[str, Any]):
+        self._segment_file.write(json.dumps(record, default=str) + "\n")
+        self._segment_file.flush()
+
+    def _roll_segment(self):
+        """Open the next segment, checkpoint into it and drop settled segments"""
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment_index += 1
+        self._segment_path = self.segment_dir / f"segment-{self._segment_index:06d}.log"
+        self._segment_file = open(self._segment_path, "a", encoding="utf-8")
+        self._segment_max_ids[self._segment_path] = {}
+
+        # The checkpoint makes group/set/ack records in older segments redundant
+        for key, value in self.values.items():
+            self._write_record({"op": "set", "key": key, "value": value})
+        floors: Dict[str, Optional[StreamId]] = {}
+        for name, stream in self.streams.items():
+            for group_name, group in stream.groups.items():
+                floor = self._acked_floor(stream, group)
+                self._write_record({"op": "group", "stream": name, "group": group_name,
+                                    "id": format_stream_id(floor)})
+                acked = [
+                    stream_id for stream_id in stream.ids[stream.range_index(floor, exclusive=True):]
+                    if stream_id <= group.last_delivered and stream_id not in group.pending
+                ]
+                acked.extend(sorted(group.acked_ahead))
+                if acked:
+                    self._write_record({"op": "ack", "stream": name, "group": group_name,
+                                        "ids": [format_stream_id(stream_id) for stream_id in acked]})
+                floors[name] = floor if name not in floors else min(floors[name], floor)
+
+        for path in list(self._segment_max_ids):
+            if path != self._segment_path and self._segment_settled(self._segment_max_ids[path], floors):
+                path.unlink(missing_ok=True)
+                del self._segment_max_ids[path]
+                self.segments_deleted += 1
+                logger.debug(f"Deleted fully acknowledged segment {path.name}")
+
+    def _segment_settled(self, max_ids: Dict[str, StreamId], floors: Dict[str, Optional[StreamId]]) -> bool:
+        """True once every entry in a segment was trimmed or acked by all groups"""
+        for name, max_id in max_ids.items():
+            stream = self.streams.get(name)
+            if stream is None or not stream.ids or max_id < stream.ids[0]:
+                continue
+            floor = floors.get(name)
+            if floor is None or max_id > floor:
+                return False
+        return True
+
+    @staticmethod
+    def _acked_floor(stream: _Stream, group: _ConsumerGroup) -> StreamId:
+        """Highest ID up to which the group has acknowledged every entry"""
+        if not group.pending:
+            return group.last_delivered
+        index = stream.range_index(min(group.pending))
+        return stream.ids[index - 1] if index > 0 else (0, 0)
+
+    # ------------------------------------------------------------------
+    # Redis client API subset
+    # ------------------------------------------------------------------
+
+    def _stream(self, name: str) -> _Stream:
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = _Stream()
+            self.streams[name] = stream
+        return stream
+
+    async def ping(self) -> bool:
+        return True
+
+    def pipeline(self, transaction: bool = True) -> InMemoryPipeline:
+        return InMemoryPipeline(self)
+
+    async def get(self, name: str) -> Optional[str]:
+        return self.values.get(name)
+
+    async def set(self, name: str, value: Any, **kwargs) -> bool:
+        self.values[name] = str(value)
+        self._append_record({"op": "set", "key": name, "value": str(value)})
+        return True
+
+    async def xgroup_create(self, name: str, groupname: str, id: str = "$", mkstream: bool = False):
+        if name not in self.streams and not mkstream:
+            raise ResponseError("ERR The XGROUP subcommand requires the key to exist")
+        stream = self._stream(name)
+        if groupname in stream.groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        start = stream.last_id if id == "$" else parse_stream_id(id)
+        stream.groups[groupname] = _ConsumerGroup(start)
+        self._append_record({"op": "group", "stream": name, "group": groupname, "id": format_stream_id(start)})
+        return True
+
+    async def xadd(self, name: str, fields: Dict[str, Any], id: str = "*", **kwargs) -> str:
+        stream = self._stream(name)
+        stream_id = stream.next_id() if id == "*" else parse_stream_id(id)
+        if stream_id <= stream.last_id and stream.ids:
+            raise ResponseError("ERR The ID specified in XADD is equal or smaller than the target stream top item")
+        # Redis stores field values as strings
+        entry = {str(key): str(value) for key, value in fields.items()}
+        stream.append(stream_id, entry)
+        message_id = format_stream_id(stream_id)
+        self._append_record({"op": "add", "stream": name, "id": message_id, "fields": entry})
+        if self.max_stream_length:
+            stream.trim(self.max_stream_length)
+        return message_id
+
+    async def xreadgroup(self, groupname: str, consumername: str, streams: Dict[str, str],
+                         count: Optional[int] = None, block: Optional[int] = None,
+                         noack: bool = False) -> List[Tuple[str, List[Tuple[str, Dict[str, str]]]]]:
+        deadline = time.monotonic() + block / 1000 if block else None
+        while True:
+            result = []
+            for name, offset in streams.items():
+                stream = self.streams.get(name)
+                if stream is None or groupname not in stream.groups:
+                    raise ResponseError(f"NOGROUP No such key '{name}' or consumer group '{groupname}'")
+                messages = self._read_group(stream, stream.groups[groupname], consumername, offset, count, noack)
+                if messages:
+                    result.append((name, messages))
+
+            if result or deadline is None:
+                return result
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            await self._wait_for_entries(streams, remaining)
+
+    async def xread(self, streams: Dict[str, str], count: Optional[int] = None,
+                    block: Optional[int] = None) -> List[Tuple[str, List[Tuple[str, Dict[str, str]]]]]:
+        """Plain read of entries after each given ID, outside any consumer group"""
+        deadline = time.monotonic() + block / 1000 if block else None
+        offsets = {}
+        for name, offset in streams.items():
+            if offset == "$":
+                stream = self.streams.get(name)
+                offsets[name] = stream.last_id if stream else (0, 0)
+            else:
+                offsets[name] = parse_stream_id(offset)
+
+        while True:
+            result = []
+            for name, start in offsets.items():
+                stream = self.streams.get(name)
+                if stream is None:
+                    continue
+                index = stream.range_index(start, exclusive=True)
+                end = index + count if count else len(stream.ids)
+                messages = [
+                    (format_stream_id(stream_id), dict(stream.entries[stream_id]))
+                    for stream_id in stream.ids[index:end]
+                ]
+                if messages:
+                    result.append((name, messages))
+
+            if result or deadline is None:
+                return result
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            for name in offsets:
+                self._stream(name)
+            await self._wait_for_entries(offsets, remaining)
+
+    async def _wait_for_entries(self, names, timeout: float):
+        waiters = [asyncio.ensure_future(self.streams[name].new_entry.wait()) for name in names]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    def _read_group(self, stream: _Stream, group: _ConsumerGroup, consumer: str,
+                    offset: str, count: Optional[int], noack: bool) -> List[Tuple[str, Dict[str, str]]]:
+        limit = count or len(stream.ids)
+        messages = []
+
+        if offset != ">":
+            # Re-read this consumer's pending entries
+            start = parse_stream_id(offset)
+            for stream_id in sorted(group.pending):
+                if stream_id > start and group.pending[stream_id][0] == consumer and stream_id in stream.entries:
+                    messages.append((format_stream_id(stream_id), dict(stream.entries[stream_id])))
+                    if len(messages) >= limit:
+                        break
+            return messages
+
+        index = stream.range_index(group.last_delivered, exclusive=True)
+        now = time.monotonic()
+        while index < len(stream.ids) and len(messages) < limit:
+            stream_id = stream.ids[index]
+            index += 1
+            group.last_delivered = stream_id
+            if stream_id in group.acked_ahead:
+                group.acked_ahead.discard(stream_id)
+                continue
+            if not noack:
+                group.pending[stream_id] = [consumer, now, 1]
+            messages.append((format_stream_id(stream_id), dict(stream.entries[stream_id])))
+        return messages
+
+    async def xack(self, name: str, groupname: str, *ids: str) -> int:
+        stream = self.streams.get(name)
+        group = stream.groups.get(groupname) if stream else None
+        if group is None or not ids:
+            return 0
+        removed = [message_id for message_id in ids if group.pending.pop(parse_stream_id(message_id), None)]
+        if removed:
+            self._append_record({"op": "ack", "stream": name, "group": groupname, "ids": removed})
+        return len(removed)
+
+    async def xrange(self, name: str, min: str = "-", max: str = "+",
+                     count: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+        stream = self.streams.get(name)
+        if stream is None:
+            return []
+
+        if min == "-":
+            start_index = 0
+        elif min.startswith("("):
+            start_index = stream.range_index(parse_stream_id(min[1:]), exclusive=True)
+        else:
+            start_index = stream.range_index(parse_stream_id(min))
+
+        if max == "+":
+            end = None
+            end_exclusive = False
+        elif max.startswith("("):
+            end = parse_stream_id(max[1:], default_seq=0)
+            end_exclusive = True
+        else:
+            end = parse_stream_id(max, default_seq=2 ** 63)
+            end_exclusive = False
+
+        messages = []
+        for stream_id in stream.ids[start_index:]:
+            if end is not None and (stream_id >= end if end_exclusive else stream_id > end):
+                break
+            messages.append((format_stream_id(stream_id), dict(stream.entries[stream_id])))
+            if count is not None and len(messages) >= count:
+                break
+        return messages
+
+    async def xinfo_stream(self, name: str) -> Dict[str, Any]:
+        stream = self.streams.get(name)
+        if stream is None:
+            raise ResponseError("ERR no such key")
+        first = last = None
+        if stream.ids:
+            first = (format_stream_id(stream.ids[0]), dict(stream.entries[stream.ids[0]]))
+            last = (format_stream_id(stream.ids[-1]), dict(stream.entries[stream.ids[-1]]))
+        return {
+            "length": len(stream.ids),
+            "first-entry": first,
+            "last-entry": last,
+            "groups": len(stream.groups),
+            "last-generated-id": format_stream_id(stream.last_id)
+        }
+
+    async def xpending_range(self, name: str, groupname: str, min: str, max: str,
+                             count: int, consumername: Optional[str] = None,
+                             consumer: Optional[str] = None) -> List[Dict[str, Any]]:
+        consumer = consumer or consumername
+        stream = self.streams.get(name)
+        group = stream.groups.get(groupname) if stream else None
+        if group is None:
+            return []
+
+        low = (0, 0) if min == "-" else parse_stream_id(min)
+        high = None if max == "+" else parse_stream_id(max, default_seq=2 ** 63)
+        now = time.monotonic()
+        pending = []
+        for stream_id in sorted(group.pending):
+            if stream_id < low or (high is not None and stream_id > high):
+                continue
+            owner, delivered_at, times_delivered = group.pending[stream_id]
+            if consumer and owner != consumer:
+                continue
+            pending.append({
+                "message_id": format_stream_id(stream_id),
+                "consumer": owner,
+                "time_since_delivered": int((now - delivered_at) * 1000),
+                "times_delivered": times_delivered
+            })
+            if len(pending) >= count:
+                break
+        return pending
+
+    async def close(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment_file = None
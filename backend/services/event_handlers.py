@@ -16,7 +16,7 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 
-from .event_bus import EventHandler, Event, EventType, publish_event
+from .event_bus import EventHandler, EventProjection, Event, EventType, publish_event
 from .websocket_manager import websocket_manager
 from .prometheus_metrics import metrics
 from ..models.exam import Exam
@@ -478,11 +478,15 @@ class NotificationEventHandler(EventHandler):
         })
 
 
-class AnalyticsEventHandler(EventHandler):
-    """Handle analytics and reporting events"""
+class AnalyticsEventHandler(EventProjection):
+    """Handle analytics and reporting events
+    
+    Analytics counters are a projection: they are snapshotted with their
+    stream offsets and rebuilt by bulk replay after a restart.
+    """
     
     def __init__(self):
-        super().__init__([
+        super().__init__("analytics", [
             EventType.EXAM_CREATED,
             EventType.GRADING_COMPLETED,
             EventType.STUDENT_CREATED,
@@ -495,31 +499,37 @@ class AnalyticsEventHandler(EventHandler):
     async def process_event(self, event: Event):
         """Process analytics events"""
         # Update analytics data based on events
-        await self._update_analytics(event)
+        self.apply_event(event)
         
         # Periodically aggregate and cache analytics
         await self._aggregate_analytics(event)
     
-    async def _update_analytics(self, event: Event):
+    def apply(self, event: Event):
         """Update analytics data"""
         event_date = datetime.fromtimestamp(event.metadata.timestamp).date()
         
         if event.type == EventType.EXAM_CREATED:
-            await self._increment_metric("exams_created", event_date)
+            self._increment_metric("exams_created", event_date)
         elif event.type == EventType.GRADING_COMPLETED:
-            await self._increment_metric("gradings_completed", event_date)
-            await self._record_score(event.data.get("score"), event_date)
+            self._increment_metric("gradings_completed", event_date)
+            self._record_score(event.data.get("score"), event_date)
         elif event.type == EventType.STUDENT_CREATED:
-            await self._increment_metric("students_created", event_date)
+            self._increment_metric("students_created", event_date)
+    
+    def get_state(self) -> Dict[str, Any]:
+        return {"analytics_cache": self.analytics_cache}
+    
+    def set_state(self, state: Dict[str, Any]):
+        self.analytics_cache = dict(state.get("analytics_cache", {}))
     
-    async def _increment_metric(self, metric_name: str, date):
+    def _increment_metric(self, metric_name: str, date):
         """Increment analytics metric"""
         key = f"{metric_name}:{date}"
         if key not in self.analytics_cache:
             self.analytics_cache[key] = 0
         self.analytics_cache[key] += 1
     
-    async def _record_score(self, score: float, date):
+    def _record_score(self, score: float, date):
         """Record score for analytics"""
         if score is not None:
             key = f"scores:{date}"
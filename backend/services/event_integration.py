@@ -44,6 +44,7 @@ from .async_task_queue import (
     submit_ocr_task, submit_grading_task, submit_batch_processing_task
 )
 from .websocket_manager import websocket_manager
+from .websocket_backplane import create_backplane
 from ..config.settings import get_settings
 
 logger = logging.getLogger(__name__)
@@ -302,9 +303,17 @@ class EventDrivenSystem:
             # Register event handlers with event bus
             await register_all_handlers(self.event_bus)
             
+            # Restore projections from their latest snapshots and replay the tail
+            await self.event_bus.rebuild_projections()
+            
             # Register WebSocket event handler
             self.event_bus.register_handler(self.websocket_manager.event_handler)
             
+            # Join the cross-worker WebSocket backplane when configured
+            backplane = create_backplane(self.settings.WEBSOCKET_BACKPLANE, self.settings.REDIS_URL)
+            if backplane is not None:
+                await self.websocket_manager.start_backplane(backplane)
+            
             self.initialized = True
             logger.info("Event-driven system initialized successfully")
             
@@ -397,22 +406,26 @@ class EventDrivenSystem:
     
     # Convenience methods for task submission
     
-    async def submit_ocr_task(self, file_id: str, exam_id: str, priority: TaskPriority = TaskPriority.NORMAL) -> str:
+    async def submit_ocr_task(self, file_id: str, exam_id: str, priority: TaskPriority = TaskPriority.NORMAL,
+                              deadline: Optional[float] = None, page_count: Optional[int] = None) -> str:
         """Submit OCR processing task"""
         self.metrics["tasks_submitted"] += 1
-        return await submit_ocr_task(file_id, exam_id, priority)
+        return await submit_ocr_task(file_id, exam_id, priority, deadline=deadline, page_count=page_count)
     
     async def submit_grading_task(self, exam_id: str, student_id: str, ocr_result: Dict[str, Any], 
-                                 priority: TaskPriority = TaskPriority.HIGH) -> str:
+                                 priority: TaskPriority = TaskPriority.HIGH,
+                                 deadline: Optional[float] = None, subjective_count: Optional[int] = None) -> str:
         """Submit grading task"""
         self.metrics["tasks_submitted"] += 1
-        return await submit_grading_task(exam_id, student_id, ocr_result, priority)
+        return await submit_grading_task(exam_id, student_id, ocr_result, priority,
+                                         deadline=deadline, subjective_count=subjective_count)
     
     async def submit_batch_processing_task(self, batch_data: Dict[str, Any], 
-                                         priority: TaskPriority = TaskPriority.NORMAL) -> str:
+                                         priority: TaskPriority = TaskPriority.NORMAL,
+                                         deadline: Optional[float] = None, item_count: Optional[int] = None) -> str:
         """Submit batch processing task"""
         self.metrics["tasks_submitted"] += 1
-        return await submit_batch_processing_task(batch_data, priority)
+        return await submit_batch_processing_task(batch_data, priority, deadline=deadline, item_count=item_count)
     
     # System status and monitoring
     
@@ -0,0 +1,411 @@
+"""
+OCR批处理任务调度器
+
+- 条件变量唤醒：提交即唤醒空闲 worker，无轮询延迟
+- N 个并发批处理 worker
+- 按租户公平调度：同一优先级内按租户轮转，单个租户的大量提交
+  不会饿死其他租户
+- 任务状态写入 SQLite，进程重启后未完成的任务从剩余答题卡继续
+- 未完成任务带持有者租约：多个进程共用存储时，只有通过条件 UPDATE
+  认领成功的进程恢复该任务；持有进程退出后租约过期，由其他进程接管
+- 已结束的任务移出内存，存储中超过保留期的记录定期清理
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# 任务状态中以 datetime 保存的字段
+DATETIME_FIELDS = ("started_at", "queue_time", "completed_at")
+
+BatchHandler = Callable[[str, List[str], int], Awaitable[None]]
+
+UNFINISHED_STATUSES = "('queued', 'processing')"
+
+
+def _encode_job(job: Dict[str, Any]) -> str:
+    return json.dumps({
+        key: value.isoformat() if key in DATETIME_FIELDS and isinstance(value, datetime) else value
+        for key, value in job.items()
+    }, default=str)
+
+
+def _decode_job(payload: str) -> Dict[str, Any]:
+    job = json.loads(payload)
+    for key in DATETIME_FIELDS:
+        if isinstance(job.get(key), str):
+            job[key] = datetime.fromisoformat(job[key])
+    return job
+
+
+class OCRJobStore:
+    """OCR批处理任务状态存储（SQLite，WAL 模式，支持多进程读写）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """首次使用时打开数据库"""
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_batch_jobs ("
+                "task_id TEXT PRIMARY KEY, tenant_id TEXT, priority INTEGER, "
+                "status TEXT, created_at REAL, updated_at REAL, payload TEXT, "
+                "owner TEXT, lease_expires_at REAL)"
+            )
+            # 旧版存储没有持有者列
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(ocr_batch_jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("lease_expires_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE ocr_batch_jobs ADD COLUMN {column} {column_type}")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ocr_batch_jobs_status ON ocr_batch_jobs (status)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def save(self, task_id: str, job: Dict[str, Any], owner: str, lease_expires_at: float) -> bool:
+        """写入任务状态并续期租约；记录已被其他进程认领时不覆盖，返回 False"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO ocr_batch_jobs "
+                "(task_id, tenant_id, priority, status, created_at, updated_at, payload, owner, lease_expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(task_id) DO UPDATE SET tenant_id = excluded.tenant_id, "
+                "priority = excluded.priority, status = excluded.status, updated_at = excluded.updated_at, "
+                "payload = excluded.payload, lease_expires_at = excluded.lease_expires_at "
+                "WHERE ocr_batch_jobs.owner IS NULL OR ocr_batch_jobs.owner = excluded.owner",
+                (task_id, job.get("tenant_id"), job.get("priority_value"), job.get("status"),
+                 job.get("created_ts", time.time()), time.time(), _encode_job(job), owner, lease_expires_at)
+            )
+        return cursor.rowcount > 0
+
+    def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT payload FROM ocr_batch_jobs WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return _decode_job(row[0]) if row else None
+
+    def claim_unfinished(self, owner: str, lease_expires_at: float) -> List[Tuple[str, Dict[str, Any]]]:
+        """认领无持有者或租约已过期的未完成任务
+
+        逐条以条件 UPDATE 认领，多个进程同时恢复时每个任务只有一个进程认领成功。
+        """
+        now = time.time()
+        claimable = (
+            f"status IN {UNFINISHED_STATUSES} "
+            "AND (owner IS NULL OR lease_expires_at IS NULL OR lease_expires_at < ?)"
+        )
+        claimed = []
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT task_id FROM ocr_batch_jobs WHERE {claimable} ORDER BY created_at", (now,)
+            ).fetchall()
+            for (task_id,) in rows:
+                cursor = self.conn.execute(
+                    f"UPDATE ocr_batch_jobs SET owner = ?, lease_expires_at = ? WHERE task_id = ? AND {claimable}",
+                    (owner, lease_expires_at, task_id, now)
+                )
+                if cursor.rowcount:
+                    row = self.conn.execute(
+                        "SELECT payload FROM ocr_batch_jobs WHERE task_id = ?", (task_id,)
+                    ).fetchone()
+                    claimed.append((task_id, _decode_job(row[0])))
+        return claimed
+
+    def renew_leases(self, owner: str, lease_expires_at: float) -> int:
+        """续期该进程持有的全部未完成任务"""
+        with self._lock:
+            cursor = self.conn.execute(
+                f"UPDATE ocr_batch_jobs SET lease_expires_at = ? "
+                f"WHERE owner = ? AND status IN {UNFINISHED_STATUSES}",
+                (lease_expires_at, owner)
+            )
+        return cursor.rowcount
+
+    def release(self, owner: str) -> int:
+        """进程退出时让出未完成任务，其他进程可立即接管"""
+        with self._lock:
+            cursor = self.conn.execute(
+                f"UPDATE ocr_batch_jobs SET lease_expires_at = 0 "
+                f"WHERE owner = ? AND status IN {UNFINISHED_STATUSES}",
+                (owner,)
+            )
+        return cursor.rowcount
+
+    def purge_finished(self, older_than: float) -> int:
+        """删除 older_than 秒前结束的任务记录"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "DELETE FROM ocr_batch_jobs "
+                "WHERE status IN ('completed', 'failed') AND updated_at < ?",
+                (time.time() - older_than,)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class OCRBatchScheduler:
+    """OCR批处理调度器
+
+    内存中的 jobs 是排队和处理中任务的工作副本，处理函数原地更新后调用
+    save() 写回存储；任务结束后移出 jobs，之后（以及其他进程提交的任务）
+    从存储读取，存储中的记录保留 retention_seconds 秒。
+
+    每个进程以 owner_id 持有自己提交或认领的任务，每 lease_seconds / 3
+    续期一次，并认领租约过期（持有进程已退出）的任务。
+    """
+
+    # 存储清理的最小间隔（秒）
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, store: OCRJobStore, worker_count: int = 2,
+                 retention_seconds: float = 7 * 86400, lease_seconds: float = 60.0):
+        self.store = store
+        self.worker_count = worker_count
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self.owner_id = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._last_purge: Optional[float] = None
+
+        # 租户 -> (优先级, 序号, task_id) 堆；有待处理任务的租户轮转队列
+        self.tenant_queues: Dict[str, List[Tuple[int, int, str]]] = {}
+        self.active_tenants: Deque[str] = deque()
+        self._sequence = itertools.count()
+
+        self.handler: Optional[BatchHandler] = None
+        self.running = False
+        self.workers: List[asyncio.Task] = []
+        self.lease_task: Optional[asyncio.Task] = None
+        self._condition: Optional[asyncio.Condition] = None
+
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "recovered": 0,
+            "purged": 0,
+            "lost_ownership": 0
+        }
+
+    async def start(self, handler: BatchHandler):
+        """启动 worker 并恢复未完成的任务（重复调用无副作用）"""
+        if self.running:
+            return
+        self.running = True
+        self.handler = handler
+        self._condition = asyncio.Condition()
+        self._purge_finished()
+        self._recover()
+        self.workers = [
+            asyncio.create_task(self._worker_loop(f"ocr-batch-{i + 1}"))
+            for i in range(self.worker_count)
+        ]
+        self.lease_task = asyncio.create_task(self._lease_loop())
+        logger.info(f"OCR batch scheduler started with {self.worker_count} workers")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        async with self._condition:
+            self._condition.notify_all()
+        tasks = [*self.workers, self.lease_task] if self.lease_task else self.workers
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self.lease_task = None
+        try:
+            self.store.release(self.owner_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to release OCR batch job leases: {str(e)}")
+        self.store.close()
+        logger.info("OCR batch scheduler stopped")
+
+    def _lease_expiry(self) -> float:
+        return time.time() + self.lease_seconds
+
+    def _recover(self) -> int:
+        """认领并恢复未完成的任务，已处理的答题卡不再重复处理"""
+        recovered = 0
+        for task_id, job in self.store.claim_unfinished(self.owner_id, self._lease_expiry()):
+            if task_id in self.jobs:
+                continue
+            processed = {result.get("answer_sheet_id") for result in job.get("results", [])}
+            job["pending_sheet_ids"] = [
+                sheet_id for sheet_id in job.get("answer_sheet_ids", []) if sheet_id not in processed
+            ]
+            job["status"] = "queued"
+            self.jobs[task_id] = job
+            self._push(task_id, job)
+            recovered += 1
+        if recovered:
+            self.stats["recovered"] += recovered
+            logger.info(f"Recovered {recovered} unfinished OCR batch jobs")
+        return recovered
+
+    async def _lease_loop(self):
+        """续期持有的任务，并接管持有进程已退出的任务"""
+        while self.running:
+            try:
+                await asyncio.sleep(self.lease_seconds / 3)
+                self.store.renew_leases(self.owner_id, self._lease_expiry())
+                async with self._condition:
+                    if self._recover():
+                        self._condition.notify_all()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"OCR batch lease renewal error: {str(e)}")
+
+    def _push(self, task_id: str, job: Dict[str, Any]):
+        tenant_id = job.get("tenant_id") or "default"
+        queue = self.tenant_queues.setdefault(tenant_id, [])
+        if not queue:
+            self.active_tenants.append(tenant_id)
+        job["queue_sequence"] = next(self._sequence)
+        heapq.heappush(queue, (job["priority_value"], job["queue_sequence"], task_id))
+
+    def _pop(self) -> Optional[str]:
+        """取下一个任务：最高优先级中，按租户轮转"""
+        if not self.active_tenants:
+            return None
+
+        best_priority = min(self.tenant_queues[tenant][0][0] for tenant in self.active_tenants)
+        while self.tenant_queues[self.active_tenants[0]][0][0] != best_priority:
+            self.active_tenants.rotate(-1)
+
+        tenant_id = self.active_tenants.popleft()
+        queue = self.tenant_queues[tenant_id]
+        _, _, task_id = heapq.heappop(queue)
+        if queue:
+            self.active_tenants.append(tenant_id)
+        else:
+            del self.tenant_queues[tenant_id]
+        return task_id
+
+    def queue_position(self, task_id: str) -> int:
+        """排队位置（1 起，按优先级和提交顺序估算，不计租户轮转）"""
+        job = self.jobs.get(task_id)
+        if not job or job.get("status") != "queued":
+            return 0
+        key = (job["priority_value"], job["queue_sequence"])
+        return 1 + sum(
+            1 for queue in self.tenant_queues.values() for entry in queue
+            if (entry[0], entry[1]) < key
+        )
+
+    async def submit(self, task_id: str, job: Dict[str, Any]):
+        """持久化任务并唤醒一个空闲 worker"""
+        job.setdefault("created_ts", time.time())
+        job["pending_sheet_ids"] = list(job["answer_sheet_ids"])
+        self.jobs[task_id] = job
+        self.store.save(task_id, job, self.owner_id, self._lease_expiry())
+        self.stats["submitted"] += 1
+
+        async with self._condition:
+            self._push(task_id, job)
+            job["queue_position"] = self.queue_position(task_id)
+            self._condition.notify()
+
+    def get_job(self, task_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(task_id)
+        if job is None:
+            job = self.store.load(task_id)
+        return job
+
+    def save(self, task_id: str):
+        """处理进度写回存储"""
+        job = self.jobs.get(task_id)
+        if job is not None and not self.store.save(task_id, job, self.owner_id, self._lease_expiry()):
+            # 租约过期期间已被其他进程接管，以接管方的进度为准
+            self.stats["lost_ownership"] += 1
+            logger.warning(f"OCR batch job {task_id} was claimed by another process, progress not saved")
+
+    async def _worker_loop(self, worker_id: str):
+        while self.running:
+            try:
+                async with self._condition:
+                    await self._condition.wait_for(lambda: self.active_tenants or not self.running)
+                    if not self.running:
+                        break
+                    task_id = self._pop()
+
+                job = self.jobs[task_id]
+                job["worker_id"] = worker_id
+                await self.handler(task_id, job["pending_sheet_ids"], job["priority_value"])
+
+                if job.get("status") == "failed":
+                    self.stats["failed"] += 1
+                else:
+                    self.stats["completed"] += 1
+                job["pending_sheet_ids"] = []
+                self.save(task_id)
+                self.jobs.pop(task_id, None)
+                self._purge_finished()
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"OCR batch worker {worker_id} error: {str(e)}")
+                await asyncio.sleep(1)
+
+    def _purge_finished(self):
+        """按保留期清理存储中已结束的任务（最多每 PURGE_INTERVAL 秒一次）"""
+        now = time.monotonic()
+        if self._last_purge is not None and now - self._last_purge < self.PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        try:
+            self.stats["purged"] += self.store.purge_finished(self.retention_seconds)
+        except sqlite3.Error as e:
+            logger.warning(f"OCR batch job purge failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self.workers),
+            "jobs_in_memory": len(self.jobs),
+            "queued": sum(len(queue) for queue in self.tenant_queues.values()),
+            "tenants": len(self.active_tenants),
+            **self.stats
+        }
+
+
+# 全局实例
+ocr_batch_scheduler = OCRBatchScheduler(
+    OCRJobStore(str(settings.OCR_JOB_STORE_PATH)),
+    worker_count=settings.OCR_BATCH_WORKERS,
+    retention_seconds=settings.OCR_JOB_RETENTION_SECONDS,
+    lease_seconds=settings.OCR_JOB_LEASE_SECONDS
+)
@@ -2,6 +2,7 @@
 
 import asyncio
 from typing import Dict, Any, Optional
+from services.result_retention import RetentionStore
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -10,10 +11,11 @@ logger = get_logger(__name__)
 class ProcessingQueueService:
     """处理队列服务类"""
     
-    def __init__(self):
+    def __init__(self, max_results: int = 10000, result_ttl: float = 3600.0):
         self.queue = asyncio.Queue()
         self.processing_tasks = {}
-        self.results = {}
+        # 处理结果按 TTL/数量上限保留
+        self.results = RetentionStore(max_items=max_results, ttl_seconds=result_ttl, name="processing_queue")
     
     async def add_task(self, task_id: str, task_data: Dict[str, Any]) -> bool:
         """添加任务到队列"""
@@ -76,8 +78,9 @@ class ProcessingQueueService:
     
     def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
         """获取任务状态"""
-        if task_id in self.results:
-            return self.results[task_id]
+        result = self.results.get(task_id)
+        if result is not None:
+            return result
         elif task_id in self.processing_tasks:
             return {"status": "processing"}
         else:
@@ -0,0 +1,186 @@
+"""
+任务结果保留策略
+
+长期运行的处理节点中，已完成任务的结果只保留有限时间和数量：
+- RetentionStore：按 TTL 和数量上限淘汰的结果存储（按写入顺序淘汰）
+- 超过阈值的大结果溢写到磁盘，内存中只保留文件引用，读取时再加载
+- TaskRecord：__slots__ 紧凑任务记录，用于保留更久的状态/依赖查询
+"""
+
+import hashlib
+import logging
+import pickle
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TaskRecord:
+    """紧凑任务记录（不含输入输出）"""
+
+    __slots__ = ("task_id", "status", "created_at", "started_at", "completed_at", "error_message")
+
+    def __init__(self, task_id: str, status: Any, created_at: Any = None, started_at: Any = None,
+                 completed_at: Any = None, error_message: Optional[str] = None):
+        self.task_id = task_id
+        self.status = status
+        self.created_at = created_at
+        self.started_at = started_at
+        self.completed_at = completed_at
+        self.error_message = error_message
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _Spilled:
+    """已溢写到磁盘的结果引用"""
+
+    __slots__ = ("path", "size")
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = size
+
+
+class RetentionStore(MutableMapping):
+    """TTL + 数量上限的结果存储
+
+    条目按写入顺序排列（重复写入移到末尾），过期和超量条目从头部淘汰，
+    淘汰为均摊 O(1)。配置 spill_dir 时，序列化后超过 spill_threshold
+    字节的结果写入磁盘，淘汰时一并删除文件。
+    """
+
+    def __init__(
+        self,
+        max_items: int = 10000,
+        ttl_seconds: Optional[float] = 3600.0,
+        spill_dir: Optional[str] = None,
+        spill_threshold: int = 256 * 1024,
+        name: str = "results"
+    ):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.spill_threshold = spill_threshold
+        self.name = name
+        # key -> (写入时间, 值或溢写引用)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+        self.stats = {
+            "expired": 0,
+            "evicted": 0,
+            "spilled": 0,
+            "spill_errors": 0
+        }
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self._entries:
+            self._discard(key)
+        self._entries[key] = (time.monotonic(), self._maybe_spill(key, value))
+        self._evict()
+
+    def __getitem__(self, key: str) -> Any:
+        stored_at, stored = self._entries[key]
+        if self._is_expired(stored_at):
+            self._discard(key)
+            self.stats["expired"] += 1
+            raise KeyError(key)
+        if isinstance(stored, _Spilled):
+            return self._load(key, stored)
+        return stored
+
+    def __delitem__(self, key: str):
+        if key not in self._entries:
+            raise KeyError(key)
+        self._discard(key)
+
+    def __contains__(self, key: object) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and not self._is_expired(entry[0])
+
+    def __iter__(self) -> Iterator[str]:
+        self.purge_expired()
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        self.purge_expired()
+        return len(self._entries)
+
+    def purge_expired(self) -> int:
+        """淘汰过期条目，返回淘汰数量"""
+        purged = 0
+        while self._entries:
+            key, (stored_at, _) = next(iter(self._entries.items()))
+            if not self._is_expired(stored_at):
+                break
+            self._discard(key)
+            purged += 1
+        self.stats["expired"] += purged
+        return purged
+
+    def clear(self):
+        for key in list(self._entries):
+            self._discard(key)
+
+    def _is_expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds
+
+    def _evict(self):
+        self.purge_expired()
+        while len(self._entries) > self.max_items:
+            key = next(iter(self._entries))
+            self._discard(key)
+            self.stats["evicted"] += 1
+
+    def _discard(self, key: str):
+        _, stored = self._entries.pop(key)
+        if isinstance(stored, _Spilled):
+            stored.path.unlink(missing_ok=True)
+
+    def _maybe_spill(self, key: str, value: Any) -> Any:
+        if self.spill_dir is None or value is None:
+            return value
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # 不可序列化的结果只能留在内存
+            return value
+        if len(data) <= self.spill_threshold:
+            return value
+
+        path = self.spill_dir / f"{self.name}-{hashlib.sha1(key.encode()).hexdigest()}.pkl"
+        try:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+        except OSError as e:
+            self.stats["spill_errors"] += 1
+            logger.warning(f"结果溢写失败，保留在内存: {key}, 错误: {str(e)}")
+            return value
+        self.stats["spilled"] += 1
+        return _Spilled(path, len(data))
+
+    def _load(self, key: str, stored: _Spilled) -> Any:
+        try:
+            return pickle.loads(stored.path.read_bytes())
+        except (OSError, pickle.UnpicklingError) as e:
+            # 溢写文件丢失：条目视为已淘汰
+            self._entries.pop(key, None)
+            logger.warning(f"溢写结果读取失败: {key}, 错误: {str(e)}")
+            raise KeyError(key) from e
+
+    def get_stats(self) -> Dict[str, Any]:
+        self.purge_expired()
+        spilled = [stored for _, stored in self._entries.values() if isinstance(stored, _Spilled)]
+        return {
+            "items": len(self._entries),
+            "max_items": self.max_items,
+            "ttl_seconds": self.ttl_seconds,
+            "spilled_items": len(spilled),
+            "spilled_bytes": sum(stored.size for stored in spilled),
+            **self.stats
+        }
@@ -0,0 +1,342 @@
+"""
+WebSocket跨进程广播总线
+多个 uvicorn worker 之间转发事件，使任一进程发布的事件
+都能到达连接在其他进程上的客户端。
+
+- WebSocketBackplane: 抽象接口
+- InProcessBackplane: 进程内实现（单 worker / 测试）
+- RedisBackplane: Redis pub/sub 实现
+
+路由按节点进行：每个节点登记本地订阅的事件类型，事件只发往
+有订阅的节点，且每个节点只收到一次，再由节点本地分发。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from .event_bus import Event, EventMetadata, EventType
+
+logger = logging.getLogger(__name__)
+
+EventCallback = Callable[[Event], Awaitable[None]]
+
+
+def generate_node_id() -> str:
+    """生成节点ID（主机名-进程号-随机后缀）"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def encode_backplane_event(origin: str, event: Event) -> str:
+    return json.dumps({
+        "origin": origin,
+        "type": event.type.value,
+        "data": event.data,
+        "metadata": asdict(event.metadata),
+        "version": event.version
+    }, default=str)
+
+
+def decode_backplane_event(payload: str) -> tuple:
+    message = json.loads(payload)
+    event = Event(
+        type=EventType(message["type"]),
+        data=message["data"],
+        metadata=EventMetadata(**message["metadata"]),
+        version=message.get("version", "1.0")
+    )
+    return message.get("origin"), event
+
+
+class WebSocketBackplane(ABC):
+    """跨进程事件转发接口"""
+
+    def __init__(self):
+        self.node_id: Optional[str] = None
+        self.on_event: Optional[EventCallback] = None
+        self.stats = {
+            "published": 0,
+            "received": 0,
+            "errors": 0
+        }
+
+    @abstractmethod
+    async def start(self, node_id: str, on_event: EventCallback):
+        """加入总线，on_event 接收其他节点转发来的事件"""
+
+    @abstractmethod
+    async def stop(self):
+        """离开总线"""
+
+    @abstractmethod
+    def set_local_interest(self, event_types: Iterable[EventType]):
+        """登记本节点有订阅的事件类型"""
+
+    @abstractmethod
+    def interested_nodes(self, event_type: EventType) -> Set[str]:
+        """订阅了该事件类型的其他节点"""
+
+    @abstractmethod
+    async def publish(self, node_ids: Set[str], event: Event):
+        """将事件发往指定节点，每个节点一次"""
+
+    async def _dispatch(self, payload: str):
+        try:
+            origin, event = decode_backplane_event(payload)
+            if origin == self.node_id:
+                return
+            self.stats["received"] += 1
+            await self.on_event(event)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Failed to dispatch backplane event: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.__class__.__name__,
+            "node_id": self.node_id,
+            **self.stats
+        }
+
+
+class InProcessBackplane(WebSocketBackplane):
+    """进程内总线：共享同一 hub 的管理器互为节点"""
+
+    _default_hub: Dict[str, 'InProcessBackplane'] = {}
+
+    def __init__(self, hub: Optional[Dict[str, 'InProcessBackplane']] = None):
+        super().__init__()
+        self.hub = hub if hub is not None else self._default_hub
+        self.local_interest: Set[EventType] = set()
+
+    async def start(self, node_id: str, on_event: EventCallback):
+        self.node_id = node_id
+        self.on_event = on_event
+        self.hub[node_id] = self
+        logger.info(f"In-process backplane started for node {node_id}")
+
+    async def stop(self):
+        if self.node_id is not None:
+            self.hub.pop(self.node_id, None)
+
+    def set_local_interest(self, event_types: Iterable[EventType]):
+        self.local_interest = set(event_types)
+
+    def interested_nodes(self, event_type: EventType) -> Set[str]:
+        return {
+            node_id for node_id, node in self.hub.items()
+            if node_id != self.node_id and event_type in node.local_interest
+        }
+
+    async def publish(self, node_ids: Set[str], event: Event):
+        payload = encode_backplane_event(self.node_id, event)
+        for node_id in node_ids:
+            node = self.hub.get(node_id)
+            if node is not None:
+                self.stats["published"] += 1
+                asyncio.create_task(node._dispatch(payload))
+
+
+class RedisBackplane(WebSocketBackplane):
+    """Redis pub/sub 总线
+
+    每个节点订阅自己的频道 ``{prefix}:node:{node_id}`` 和控制频道。
+    节点兴趣保存在哈希 ``{prefix}:interest`` 中，变更时经控制频道
+    即时通知其他节点；节点存活键过期后其兴趣会在下次刷新时清除。
+    """
+
+    def __init__(self, redis_url: str = "redis://localhost:6379",
+                 prefix: str = "zhiyue:ws", node_ttl: int = 30,
+                 refresh_interval: float = 10.0):
+        super().__init__()
+        self.redis_url = redis_url
+        self.prefix = prefix
+        self.node_ttl = node_ttl
+        self.refresh_interval = refresh_interval
+
+        self.redis_client = None
+        self.pubsub = None
+        self.local_interest: Set[str] = set()
+        self.remote_interest: Dict[str, Set[str]] = {}
+        self._interest_changed = asyncio.Event()
+        self._tasks: list = []
+
+    @property
+    def _control_channel(self) -> str:
+        return f"{self.prefix}:control"
+
+    @property
+    def _interest_key(self) -> str:
+        return f"{self.prefix}:interest"
+
+    def _node_channel(self, node_id: str) -> str:
+        return f"{self.prefix}:node:{node_id}"
+
+    def _alive_key(self, node_id: str) -> str:
+        return f"{self.prefix}:alive:{node_id}"
+
+    async def start(self, node_id: str, on_event: EventCallback):
+        import redis.asyncio as aioredis
+
+        self.node_id = node_id
+        self.on_event = on_event
+        self.redis_client = aioredis.from_url(self.redis_url, decode_responses=True)
+        self.pubsub = self.redis_client.pubsub()
+        await self.pubsub.subscribe(self._node_channel(node_id), self._control_channel)
+
+        await self._publish_interest()
+        await self._reload_interest()
+
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._refresh_loop())
+        ]
+        logger.info(f"Redis backplane started for node {node_id}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.hdel(self._interest_key, self.node_id)
+                pipe.delete(self._alive_key(self.node_id))
+                pipe.publish(self._control_channel, json.dumps({"node": self.node_id, "event_types": []}))
+                await pipe.execute()
+                await self.pubsub.close()
+                await self.redis_client.close()
+            except Exception as e:
+                logger.error(f"Error stopping Redis backplane: {e}")
+            self.redis_client = None
+
+    def set_local_interest(self, event_types: Iterable[EventType]):
+        interest = {event_type.value for event_type in event_types}
+        if interest != self.local_interest:
+            self.local_interest = interest
+            self._interest_changed.set()
+
+    def interested_nodes(self, event_type: EventType) -> Set[str]:
+        return {
+            node_id for node_id, event_types in self.remote_interest.items()
+            if event_type.value in event_types
+        }
+
+    async def publish(self, node_ids: Set[str], event: Event):
+        if not node_ids or self.redis_client is None:
+            return
+
+        payload = encode_backplane_event(self.node_id, event)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for node_id in node_ids:
+            pipe.publish(self._node_channel(node_id), payload)
+        try:
+            await pipe.execute()
+            self.stats["published"] += len(node_ids)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Failed to publish {event.type} to backplane: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                if message["channel"] == self._control_channel:
+                    self._apply_control(message["data"])
+                else:
+                    await self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error in backplane listener: {e}")
+                await asyncio.sleep(1)
+
+    def _apply_control(self, payload: str):
+        message = json.loads(payload)
+        node_id = message.get("node")
+        if not node_id or node_id == self.node_id:
+            return
+        event_types = set(message.get("event_types", []))
+        if event_types:
+            self.remote_interest[node_id] = event_types
+        else:
+            self.remote_interest.pop(node_id, None)
+
+    async def _publish_interest(self):
+        interest = json.dumps(sorted(self.local_interest))
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset(self._interest_key, self.node_id, interest)
+        pipe.set(self._alive_key(self.node_id), int(time.time()), ex=self.node_ttl)
+        pipe.publish(self._control_channel, json.dumps({"node": self.node_id, "event_types": sorted(self.local_interest)}))
+        await pipe.execute()
+
+    async def _reload_interest(self):
+        """重新加载全部节点兴趣，并清除已失活节点"""
+        interest = await self.redis_client.hgetall(self._interest_key)
+        node_ids = [node_id for node_id in interest if node_id != self.node_id]
+        if not node_ids:
+            self.remote_interest = {}
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for node_id in node_ids:
+            pipe.exists(self._alive_key(node_id))
+        alive = await pipe.execute()
+
+        remote_interest = {}
+        dead_nodes = []
+        for node_id, is_alive in zip(node_ids, alive):
+            if is_alive:
+                remote_interest[node_id] = set(json.loads(interest[node_id]))
+            else:
+                dead_nodes.append(node_id)
+        if dead_nodes:
+            await self.redis_client.hdel(self._interest_key, *dead_nodes)
+        self.remote_interest = remote_interest
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._interest_changed.wait(), timeout=self.refresh_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._interest_changed.clear()
+                await self._publish_interest()
+                await self._reload_interest()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error refreshing backplane interest: {e}")
+                await asyncio.sleep(1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **super().get_stats(),
+            "remote_nodes": len(self.remote_interest),
+            "local_interest": sorted(self.local_interest)
+        }
+
+
+def create_backplane(kind: str, redis_url: Optional[str] = None) -> Optional[WebSocketBackplane]:
+    """按配置创建总线：none / memory / redis"""
+    kind = (kind or "none").lower()
+    if kind == "redis":
+        return RedisBackplane(redis_url or "redis://localhost:6379")
+    if kind == "memory":
+        return InProcessBackplane()
+    return None
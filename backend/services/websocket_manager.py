@@ -8,18 +8,27 @@ Features:
 - Connection pooling and management
 - Heartbeat and reconnection handling
 - Event subscription management
+- Subscription index for event fan-out
+- Serialize-once broadcast with per-connection bounded send queues
+- Progress event coalescing per (exam, batch)
+- Cross-process fan-out through a pluggable backplane
+- Timing-wheel heartbeat and idle detection
 """
 
 import json
 import asyncio
 import logging
-from typing import Dict, List, Set, Optional, Any, Callable
+import time
+from typing import Deque, Dict, List, Set, Optional, Any, Callable
+from collections import deque
 from datetime import datetime
 from fastapi import WebSocket, WebSocketDisconnect
 from enum import Enum
 import uuid
 
 from .event_bus import EventType, Event, EventHandler
+from .websocket_performance import TimingWheel, performance_monitor
+from .websocket_backplane import WebSocketBackplane, generate_node_id
 
 logger = logging.getLogger(__name__)
 
@@ -67,11 +76,161 @@ class ConnectionType(str, Enum):
     GENERAL = "general"
 
 
+class SlowConsumerPolicy(str, Enum):
+    """慢消费者策略 - 连接发送队列满时的处理方式"""
+    DROP_OLDEST = "drop_oldest"  # 丢弃最旧消息
+    COALESCE = "coalesce"        # 同键消息合并为最新一条，否则丢弃最旧消息
+    DISCONNECT = "disconnect"    # 断开连接
+
+
+def encode_message(message_type: str, data: Any = None, error: Optional[str] = None,
+                   connection_id: Optional[str] = None) -> str:
+    """Encode a message envelope once so it can be shared by every recipient"""
+    message = {
+        "type": message_type,
+        "timestamp": datetime.utcnow().isoformat(),
+        "data": data,
+        "error": error
+    }
+    if connection_id is not None:
+        message["connection_id"] = connection_id
+    return json.dumps(message, default=str)
+
+
+def encode_event(event: Event) -> str:
+    """Encode an event message once for all subscribed connections"""
+    return json.dumps({
+        "type": "event",
+        "event_type": event.type.value,
+        "event_data": event.data,
+        "event_metadata": {
+            "event_id": event.metadata.event_id,
+            "timestamp": event.metadata.timestamp,
+            "source_service": event.metadata.source_service,
+            "correlation_id": event.metadata.correlation_id
+        },
+        "timestamp": datetime.utcnow().isoformat()
+    }, default=str)
+
+
+class SubscriptionIndex:
+    """Subscription index keyed by (event type, exam_id, user_id)
+    
+    Broadcasting an event only touches connections that subscribed to its
+    type and whose exam/user scope can match, instead of every connection.
+    """
+    
+    def __init__(self):
+        # event type -> connections without user/exam scope (or with custom filters)
+        self._unscoped: Dict[EventType, Set[str]] = {}
+        # event type -> user_id -> connections scoped to that user
+        self._by_user: Dict[EventType, Dict[str, Set[str]]] = {}
+        # event type -> exam_id -> connections scoped to that exam
+        self._by_exam: Dict[EventType, Dict[str, Set[str]]] = {}
+        # connection_id -> {event type: (bucket, scope key)}
+        self._placements: Dict[str, Dict[EventType, tuple]] = {}
+        # Called when an event type gains its first or loses its last subscriber
+        self.on_interest_change: Optional[Callable[[], None]] = None
+    
+    def event_types(self) -> Set[EventType]:
+        """Event types with at least one subscriber"""
+        return set(self._unscoped) | set(self._by_user) | set(self._by_exam)
+    
+    def _has_subscribers(self, event_type: EventType) -> bool:
+        return event_type in self._unscoped or event_type in self._by_user or event_type in self._by_exam
+    
+    def _notify_interest_change(self):
+        if self.on_interest_change is not None:
+            self.on_interest_change()
+    
+    def add(self, connection: 'WebSocketConnection', event_type: EventType):
+        """Index (or re-index) a connection's subscription to an event type"""
+        self.remove(connection.connection_id, event_type)
+        is_new_type = not self._has_subscribers(event_type)
+        
+        exam_scope = connection.event_exam_scopes.get(event_type)
+        if exam_scope is not None:
+            placement = ("exam", exam_scope)
+            self._by_exam.setdefault(event_type, {}).setdefault(exam_scope, set()).add(connection.connection_id)
+        elif connection.user_id and event_type not in connection.event_filters:
+            placement = ("user", connection.user_id)
+            self._by_user.setdefault(event_type, {}).setdefault(connection.user_id, set()).add(connection.connection_id)
+        else:
+            placement = ("all", None)
+            self._unscoped.setdefault(event_type, set()).add(connection.connection_id)
+        
+        self._placements.setdefault(connection.connection_id, {})[event_type] = placement
+        if is_new_type:
+            self._notify_interest_change()
+    
+    def remove(self, connection_id: str, event_type: EventType):
+        """Remove a connection's subscription to an event type"""
+        placements = self._placements.get(connection_id)
+        if not placements or event_type not in placements:
+            return
+        
+        bucket, scope = placements.pop(event_type)
+        if bucket == "all":
+            self._discard(self._unscoped, event_type, connection_id)
+        else:
+            index = self._by_exam if bucket == "exam" else self._by_user
+            scoped = index.get(event_type)
+            if scoped is not None:
+                self._discard(scoped, scope, connection_id)
+                if not scoped:
+                    del index[event_type]
+        
+        if not placements:
+            del self._placements[connection_id]
+        if not self._has_subscribers(event_type):
+            self._notify_interest_change()
+    
+    def remove_connection(self, connection_id: str):
+        """Remove every subscription of a connection"""
+        for event_type in list(self._placements.get(connection_id, {})):
+            self.remove(connection_id, event_type)
+    
+    def candidates(self, event: Event) -> Set[str]:
+        """Connection ids that may receive the event"""
+        event_type = event.type
+        result: Set[str] = set(self._unscoped.get(event_type, ()))
+        
+        exam_id = event.data.get('exam_id') if isinstance(event.data, dict) else None
+        if exam_id is not None:
+            result.update(self._by_exam.get(event_type, {}).get(str(exam_id), ()))
+        
+        by_user = self._by_user.get(event_type)
+        if by_user:
+            event_user_id = getattr(event.metadata, 'user_id', None)
+            if event_user_id:
+                result.update(by_user.get(event_user_id, ()))
+            else:
+                # Events without a user go to every user-scoped subscriber
+                for connection_ids in by_user.values():
+                    result.update(connection_ids)
+        
+        return result
+    
+    @staticmethod
+    def _discard(index: Dict[Any, Set[str]], key: Any, connection_id: str):
+        connection_ids = index.get(key)
+        if connection_ids is not None:
+            connection_ids.discard(connection_id)
+            if not connection_ids:
+                del index[key]
+
+
 class WebSocketConnection:
-    """Enhanced WebSocket连接包装器 with event subscriptions"""
+    """Enhanced WebSocket连接包装器 with event subscriptions
+    
+    Outbound messages go through a bounded queue drained by a dedicated
+    writer task, so a slow client never delays other recipients.
+    """
     
     def __init__(self, websocket: WebSocket, connection_type: ConnectionType, 
-                 user_id: Optional[str] = None, exam_id: Optional[str] = None):
+                 user_id: Optional[str] = None, exam_id: Optional[str] = None,
+                 max_queue_size: int = 1000,
+                 slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy.DROP_OLDEST):
         self.websocket = websocket
         self.connection_type = connection_type
         self.user_id = user_id
@@ -79,47 +238,146 @@ class WebSocketConnection:
         self.connection_id = str(uuid.uuid4())
         self.connected_at = datetime.utcnow()
         self.last_heartbeat = datetime.utcnow()
+        self.last_activity = time.monotonic()
         self.is_active = True
         
         # Event subscription management
         self.subscribed_events: Set[EventType] = set()
         self.event_filters: Dict[EventType, Callable[[Event], bool]] = {}
-        self.message_queue: List[Dict] = []
-        self.max_queue_size = 1000
+        self.event_exam_scopes: Dict[EventType, str] = {}
+        self.subscription_index: Optional[SubscriptionIndex] = None
         
-    async def send_message(self, message_type: MessageType, data: Any = None, 
-                          error: Optional[str] = None):
-        """发送消息到客户端"""
+        # Outbound queue: items are [payload, coalesce_key]
+        self.message_queue: Deque[List[Any]] = deque()
+        self.max_queue_size = max_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.slow_consumer_disconnected = False
+        self._pending_by_key: Dict[str, List[Any]] = {}
+        self._queue_ready = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self.queue_stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "peak_depth": 0
+        }
+    
+    def touch(self):
+        """记录客户端活动（心跳响应或消息）"""
+        self.last_heartbeat = datetime.utcnow()
+        self.last_activity = time.monotonic()
+    
+    @property
+    def queue_depth(self) -> int:
+        return len(self.message_queue)
+    
+    def start_writer(self):
+        """Start the writer task draining the outbound queue"""
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
+    
+    def enqueue(self, payload: str, coalesce_key: Optional[str] = None) -> bool:
+        """Queue an already-encoded payload, applying the slow-consumer policy"""
         if not self.is_active:
             return False
+        
+        if coalesce_key is not None and self.slow_consumer_policy == SlowConsumerPolicy.COALESCE:
+            pending = self._pending_by_key.get(coalesce_key)
+            if pending is not None:
+                # Replace the queued message in place, keeping its position
+                pending[0] = payload
+                self.queue_stats["coalesced"] += 1
+                return True
+        
+        if len(self.message_queue) >= self.max_queue_size:
+            if self.slow_consumer_policy == SlowConsumerPolicy.DISCONNECT:
+                logger.warning(f"Slow consumer {self.connection_id} exceeded {self.max_queue_size} queued messages, disconnecting")
+                self.queue_stats["dropped"] += 1
+                self.slow_consumer_disconnected = True
+                self.is_active = False
+                self._queue_ready.set()
+                return False
             
+            self._forget(self.message_queue.popleft())
+            self.queue_stats["dropped"] += 1
+        
+        item = [payload, coalesce_key]
+        self.message_queue.append(item)
+        if coalesce_key is not None:
+            self._pending_by_key[coalesce_key] = item
+        
+        self.queue_stats["enqueued"] += 1
+        if len(self.message_queue) > self.queue_stats["peak_depth"]:
+            self.queue_stats["peak_depth"] = len(self.message_queue)
+        self._queue_ready.set()
+        return True
+    
+    def _forget(self, item: List[Any]):
+        key = item[1]
+        if key is not None and self._pending_by_key.get(key) is item:
+            del self._pending_by_key[key]
+    
+    async def _writer_loop(self):
+        """Drain the outbound queue to the socket"""
         try:
-            message = {
-                "type": message_type.value,
-                "timestamp": datetime.utcnow().isoformat(),
-                "connection_id": self.connection_id,
-                "data": data,
-                "error": error
-            }
-            
-            await self.websocket.send_text(json.dumps(message))
-            return True
+            while self.is_active:
+                if not self.message_queue:
+                    self._queue_ready.clear()
+                    await self._queue_ready.wait()
+                    continue
+                
+                item = self.message_queue.popleft()
+                self._forget(item)
+                await self.websocket.send_text(item[0])
+                self.queue_stats["sent"] += 1
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Failed to send message to {self.connection_id}: {e}")
             self.is_active = False
+        
+    async def send_message(self, message_type: MessageType, data: Any = None, 
+                          error: Optional[str] = None):
+        """发送消息到客户端"""
+        if not self.is_active:
+            return False
+        
+        try:
+            payload = encode_message(message_type.value, data, error, self.connection_id)
+        except Exception as e:
+            logger.error(f"Failed to encode message for {self.connection_id}: {e}")
             return False
+        
+        return self.enqueue(payload)
     
-    def subscribe_to_event(self, event_type: EventType, filter_func: Optional[Callable[[Event], bool]] = None):
-        """Subscribe to an event type with optional filter"""
+    def subscribe_to_event(self, event_type: EventType, filter_func: Optional[Callable[[Event], bool]] = None,
+                           exam_id: Optional[str] = None):
+        """Subscribe to an event type with optional filter and exam scope
+        
+        An exam scope is indexed by the manager, so scoped subscriptions are
+        only considered for events carrying that exam_id.
+        """
         self.subscribed_events.add(event_type)
         if filter_func:
             self.event_filters[event_type] = filter_func
+        else:
+            self.event_filters.pop(event_type, None)
+        if exam_id is not None:
+            self.event_exam_scopes[event_type] = str(exam_id)
+        else:
+            self.event_exam_scopes.pop(event_type, None)
+        if self.subscription_index is not None:
+            self.subscription_index.add(self, event_type)
         logger.debug(f"Connection {self.connection_id} subscribed to {event_type}")
     
     def unsubscribe_from_event(self, event_type: EventType):
         """Unsubscribe from an event type"""
         self.subscribed_events.discard(event_type)
         self.event_filters.pop(event_type, None)
+        self.event_exam_scopes.pop(event_type, None)
+        if self.subscription_index is not None:
+            self.subscription_index.remove(self.connection_id, event_type)
         logger.debug(f"Connection {self.connection_id} unsubscribed from {event_type}")
     
     def should_receive_event(self, event: Event) -> bool:
@@ -127,11 +385,21 @@ class WebSocketConnection:
         if event.type not in self.subscribed_events:
             return False
         
+        # Exam-scoped subscription
+        exam_scope = self.event_exam_scopes.get(event.type)
+        if exam_scope is not None:
+            exam_id = event.data.get('exam_id') if isinstance(event.data, dict) else None
+            if exam_id is None or str(exam_id) != exam_scope:
+                return False
+        
         # Apply event filter if exists
         filter_func = self.event_filters.get(event.type)
         if filter_func:
             return filter_func(event)
         
+        if exam_scope is not None:
+            return True
+        
         # Default filters based on connection context
         if self.user_id and hasattr(event, 'metadata') and event.metadata.user_id:
             return event.metadata.user_id == self.user_id
@@ -146,71 +414,168 @@ class WebSocketConnection:
         if not self.should_receive_event(event):
             return False
         
-        event_message = {
-            "type": "event",
-            "event_type": event.type.value,
-            "event_data": event.data,
-            "event_metadata": {
-                "event_id": event.metadata.event_id,
-                "timestamp": event.metadata.timestamp,
-                "source_service": event.metadata.source_service,
-                "correlation_id": event.metadata.correlation_id
-            },
-            "timestamp": datetime.utcnow().isoformat(),
-            "connection_id": self.connection_id
-        }
-        
-        return await self._send_raw_message(event_message)
+        return self.enqueue(encode_event(event))
     
     async def _send_raw_message(self, message: Dict) -> bool:
-        """Send raw message with queueing support"""
+        """Send raw message through the outbound queue"""
         if not self.is_active:
             return False
         
-        try:
-            # If connection is busy, queue the message
-            if len(self.message_queue) < self.max_queue_size:
-                await self.websocket.send_text(json.dumps(message))
-                return True
-            else:
-                # Queue is full, drop oldest messages
-                self.message_queue = self.message_queue[-(self.max_queue_size-1):]
-                self.message_queue.append(message)
-                logger.warning(f"Message queue full for connection {self.connection_id}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Failed to send message to {self.connection_id}: {e}")
-            self.is_active = False
-            return False
+        return self.enqueue(json.dumps(message, default=str))
     
     async def flush_message_queue(self):
         """Flush queued messages"""
-        if not self.message_queue or not self.is_active:
-            return
-        
-        messages_to_send = self.message_queue.copy()
-        self.message_queue.clear()
-        
-        for message in messages_to_send:
+        while self.message_queue:
+            item = self.message_queue.popleft()
+            self._forget(item)
             try:
-                await self.websocket.send_text(json.dumps(message))
+                await self.websocket.send_text(item[0])
+                self.queue_stats["sent"] += 1
             except Exception as e:
                 logger.error(f"Failed to flush message for {self.connection_id}: {e}")
-                self.is_active = False
+                self.message_queue.clear()
+                self._pending_by_key.clear()
                 break
     
     async def close(self, code: int = 1000, reason: str = ""):
         """关闭连接"""
         try:
             self.is_active = False
-            # Flush any remaining messages before closing
-            await self.flush_message_queue()
+            if self._writer_task and not self._writer_task.done():
+                self._writer_task.cancel()
+                try:
+                    await self._writer_task
+                except asyncio.CancelledError:
+                    pass
+            # Flush any remaining messages before closing (not for slow consumers)
+            if not self.slow_consumer_disconnected:
+                await self.flush_message_queue()
             await self.websocket.close(code=code, reason=reason)
         except Exception as e:
             logger.error(f"Error closing connection {self.connection_id}: {e}")
 
 
+class ProgressCoalescer:
+    """Coalesce high-frequency progress events per (exam, batch)
+    
+    Progress events for the same exam/batch arriving within ``window``
+    seconds are merged into the latest one, which is delivered when the
+    window closes with a ``coalesced_count`` field. Each event type keeps its
+    own latest-state slot so type-filtered subscribers still see every
+    stream. Only progress ticks are coalesced: completion events carry
+    per-item results and, like failures and batch completion, flush the
+    pending progress for the key first and are then delivered immediately.
+    """
+    
+    DEFAULT_PROGRESS_TYPES = frozenset({
+        EventType.OCR_STARTED,
+        EventType.GRADING_STARTED
+    })
+    
+    def __init__(self, deliver: Callable[[Event], Any], window: float = 0.25,
+                 progress_types: Optional[Set[EventType]] = None):
+        self.deliver = deliver
+        self.window = window
+        self.progress_types = set(progress_types or self.DEFAULT_PROGRESS_TYPES)
+        # (exam_id, batch_id, user_id) -> {event_type: [latest_event, count]}
+        self._pending: Dict[tuple, Dict[EventType, List[Any]]] = {}
+        self._timers: Dict[tuple, asyncio.TimerHandle] = {}
+        self.stats = {
+            "received": 0,
+            "coalesced": 0,
+            "flushed": 0,
+            "passed_through": 0
+        }
+    
+    @staticmethod
+    def _key(event: Event) -> Optional[tuple]:
+        data = event.data if isinstance(event.data, dict) else {}
+        exam_id = data.get("exam_id")
+        batch_id = data.get("batch_id")
+        if exam_id is None and batch_id is None:
+            return None
+        user_id = event.metadata.user_id if event.metadata else None
+        return (exam_id, batch_id, user_id)
+    
+    def _is_progress(self, event: Event) -> bool:
+        if event.type not in self.progress_types:
+            return False
+        data = event.data if isinstance(event.data, dict) else {}
+        return not (data.get("error") or data.get("final"))
+    
+    def coalesce_key(self, event: Event) -> Optional[str]:
+        """Per-connection queue key for progress events, None for everything else
+        
+        Used by the COALESCE slow-consumer policy so a backlogged connection
+        keeps only the latest progress per (type, exam, batch, user).
+        """
+        key = self._key(event)
+        if key is None or not self._is_progress(event):
+            return None
+        return f"{event.type.value}:" + ":".join("" if part is None else str(part) for part in key)
+    
+    async def submit(self, event: Event):
+        """Buffer a progress event or deliver a terminal one"""
+        self.stats["received"] += 1
+        key = self._key(event)
+        
+        if self.window <= 0 or key is None:
+            self.stats["passed_through"] += 1
+            await self.deliver(event)
+            return
+        
+        if not self._is_progress(event):
+            # Deliver pending progress first so the terminal event is last
+            await self.flush_key(key)
+            self.stats["passed_through"] += 1
+            await self.deliver(event)
+            return
+        
+        slots = self._pending.setdefault(key, {})
+        slot = slots.get(event.type)
+        if slot is None:
+            slots[event.type] = [event, 1]
+        else:
+            slot[0] = event
+            slot[1] += 1
+            self.stats["coalesced"] += 1
+        
+        if key not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(
+                self.window, lambda: asyncio.ensure_future(self.flush_key(key))
+            )
+    
+    async def flush_key(self, key: tuple):
+        """Deliver the latest state for a key"""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        slots = self._pending.pop(key, None)
+        if not slots:
+            return
+        
+        for event, count in slots.values():
+            if count > 1:
+                event = event.model_copy(update={"data": {**event.data, "coalesced_count": count}})
+            self.stats["flushed"] += 1
+            try:
+                await self.deliver(event)
+            except Exception as e:
+                logger.error(f"Error delivering coalesced event {event.type}: {e}")
+    
+    async def flush_all(self):
+        for key in list(self._pending):
+            await self.flush_key(key)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "window": self.window,
+            "pending_keys": len(self._pending),
+            **self.stats
+        }
+
+
 class WebSocketEventHandler(EventHandler):
     """WebSocket event handler for broadcasting events to connections"""
     
@@ -222,6 +587,18 @@ class WebSocketEventHandler(EventHandler):
     async def process_event(self, event: Event):
         """Broadcast event to all subscribed WebSocket connections"""
         await self.websocket_manager.broadcast_event(event)
+    
+    async def handle_batch(self, events: List[Event]) -> List[bool]:
+        """Broadcast a stream batch; progress events coalesce across the batch"""
+        results = []
+        for event in events:
+            try:
+                await self.websocket_manager.broadcast_event(event)
+                results.append(True)
+            except Exception as e:
+                self.logger.error(f"Error broadcasting event {event.type}: {str(e)}")
+                results.append(False)
+        return results
 
 
 class WebSocketManager:
@@ -233,6 +610,9 @@ class WebSocketManager:
             connection_type: {} for connection_type in ConnectionType
         }
         
+        # 按连接ID索引的连接
+        self.connections_by_id: Dict[str, WebSocketConnection] = {}
+        
         # 按用户ID索引的连接
         self.user_connections: Dict[str, Set[str]] = {}
         
@@ -240,6 +620,7 @@ class WebSocketManager:
         self.exam_connections: Dict[str, Set[str]] = {}
         
         # Event broadcasting
+        self.subscription_index = SubscriptionIndex()
         self.event_handler = WebSocketEventHandler(self)
         self.broadcast_stats = {
             "total_events_broadcasted": 0,
@@ -247,7 +628,27 @@ class WebSocketManager:
             "failed_broadcasts": 0
         }
         
-        # 心跳检查任务
+        # 跨进程广播总线（未启用时仅本进程分发）
+        self.node_id = generate_node_id()
+        self.backplane: Optional[WebSocketBackplane] = None
+        self.subscription_index.on_interest_change = self._sync_backplane_interest
+        
+        # 进度事件合并窗口（秒），0 表示关闭
+        self.progress_coalescer = ProgressCoalescer(self._deliver_event, window=0.25)
+        
+        # Outbound queue configuration and totals from closed connections
+        self.outbound_queue_size = 1000
+        self.slow_consumer_policy = SlowConsumerPolicy.DROP_OLDEST
+        self.closed_queue_stats = {
+            "dropped": 0,
+            "coalesced": 0,
+            "slow_consumer_disconnects": 0
+        }
+        
+        # 心跳检查：连接按下次心跳时间挂在时间轮上，每个刻度只处理到期连接
+        self.heartbeat_interval = 30
+        self.idle_timeout: Optional[float] = None  # 无客户端活动超过该秒数则断开，None 表示不检测
+        self.heartbeat_wheel = TimingWheel(tick=1.0, slots=64)
         self.heartbeat_task: Optional[asyncio.Task] = None
         self._start_heartbeat_checker()
     
@@ -257,10 +658,19 @@ class WebSocketManager:
         try:
             await websocket.accept()
             
-            connection = WebSocketConnection(websocket, connection_type, user_id, exam_id)
+            connection = WebSocketConnection(
+                websocket, connection_type, user_id, exam_id,
+                max_queue_size=self.outbound_queue_size,
+                slow_consumer_policy=self.slow_consumer_policy
+            )
+            connection.subscription_index = self.subscription_index
+            connection.start_writer()
+            self.heartbeat_wheel.schedule(connection.connection_id, time.monotonic() + self.heartbeat_interval)
+            self._start_heartbeat_checker()
             
             # 添加到连接池
             self.connections[connection_type][connection.connection_id] = connection
+            self.connections_by_id[connection.connection_id] = connection
             
             # 添加用户索引
             if user_id:
@@ -306,6 +716,13 @@ class WebSocketManager:
         try:
             # 从连接池中移除
             del self.connections[connection.connection_type][connection_id]
+            self.connections_by_id.pop(connection_id, None)
+            self.subscription_index.remove_connection(connection_id)
+            self.heartbeat_wheel.cancel(connection_id)
+            self.closed_queue_stats["dropped"] += connection.queue_stats["dropped"]
+            self.closed_queue_stats["coalesced"] += connection.queue_stats["coalesced"]
+            if connection.slow_consumer_disconnected:
+                self.closed_queue_stats["slow_consumer_disconnects"] += 1
             
             # 从用户索引中移除
             if connection.user_id and connection.user_id in self.user_connections:
@@ -328,10 +745,7 @@ class WebSocketManager:
     
     def _find_connection(self, connection_id: str) -> Optional[WebSocketConnection]:
         """查找连接"""
-        for connection_type in ConnectionType:
-            if connection_id in self.connections[connection_type]:
-                return self.connections[connection_type][connection_id]
-        return None
+        return self.connections_by_id.get(connection_id)
     
     async def send_to_connection(self, connection_id: str, message_type: MessageType, 
                                data: Any = None, error: Optional[str] = None) -> bool:
@@ -341,109 +755,124 @@ class WebSocketManager:
             return await connection.send_message(message_type, data, error)
         return False
     
+    def _fan_out(self, connections: List[WebSocketConnection], payload: str,
+                 coalesce_key: Optional[str] = None) -> int:
+        """Queue one shared payload on every connection, returning the failure count"""
+        failed_count = 0
+        for connection in connections:
+            if not connection.enqueue(payload, coalesce_key):
+                failed_count += 1
+                if connection.slow_consumer_disconnected:
+                    asyncio.create_task(self.disconnect(connection.connection_id))
+        return failed_count
+    
+    def _active_connections(self, connection_ids) -> List[WebSocketConnection]:
+        connections = []
+        for connection_id in connection_ids:
+            connection = self.connections_by_id.get(connection_id)
+            if connection and connection.is_active:
+                connections.append(connection)
+        return connections
+    
     async def broadcast_to_type(self, connection_type: ConnectionType, 
                               message_type: MessageType, data: Any = None,
                               error: Optional[str] = None):
         """广播消息到指定类型的所有连接"""
-        connections = list(self.connections[connection_type].values())
-        
+        connections = self._active_connections(list(self.connections[connection_type]))
         if not connections:
             return
         
-        tasks = []
-        for connection in connections:
-            if connection.is_active:
-                task = connection.send_message(message_type, data, error)
-                tasks.append(task)
-        
-        if tasks:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            failed_count = sum(1 for result in results if isinstance(result, Exception) or not result)
-            
-            if failed_count > 0:
-                logger.warning(f"Failed to broadcast to {failed_count}/{len(tasks)} connections")
+        failed_count = self._fan_out(connections, encode_message(message_type.value, data, error))
+        if failed_count > 0:
+            logger.warning(f"Failed to broadcast to {failed_count}/{len(connections)} connections")
     
     async def broadcast_to_user(self, user_id: str, message_type: MessageType, 
                               data: Any = None, error: Optional[str] = None):
         """广播消息到用户的所有连接"""
-        if user_id not in self.user_connections:
-            return
-        
-        connection_ids = list(self.user_connections[user_id])
-        tasks = []
-        
-        for connection_id in connection_ids:
-            connection = self._find_connection(connection_id)
-            if connection and connection.is_active:
-                task = connection.send_message(message_type, data, error)
-                tasks.append(task)
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        connections = self._active_connections(list(self.user_connections.get(user_id, ())))
+        if connections:
+            self._fan_out(connections, encode_message(message_type.value, data, error))
     
     async def broadcast_to_exam(self, exam_id: str, message_type: MessageType,
                               data: Any = None, error: Optional[str] = None):
         """广播消息到考试相关的所有连接"""
-        if exam_id not in self.exam_connections:
-            return
-        
-        connection_ids = list(self.exam_connections[exam_id])
-        tasks = []
-        
-        for connection_id in connection_ids:
-            connection = self._find_connection(connection_id)
-            if connection and connection.is_active:
-                task = connection.send_message(message_type, data, error)
-                tasks.append(task)
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        connections = self._active_connections(list(self.exam_connections.get(exam_id, ())))
+        if connections:
+            self._fan_out(connections, encode_message(message_type.value, data, error))
     
     async def broadcast_event(self, event: Event):
-        """Broadcast event to all subscribed WebSocket connections"""
+        """Broadcast event to all subscribed WebSocket connections
+        
+        Progress events pass through the coalescer; terminal events are
+        delivered immediately.
+        """
         if not event:
             return
         
+        await self.progress_coalescer.submit(event)
+    
+    async def start_backplane(self, backplane: WebSocketBackplane):
+        """Join a cross-process backplane so events reach clients on other workers"""
+        if self.backplane is not None:
+            await self.stop_backplane()
+        self.backplane = backplane
+        backplane.set_local_interest(self.subscription_index.event_types())
+        await backplane.start(self.node_id, self._deliver_local)
+        logger.info(f"WebSocket backplane {backplane.__class__.__name__} started on node {self.node_id}")
+    
+    async def stop_backplane(self):
+        if self.backplane is not None:
+            backplane, self.backplane = self.backplane, None
+            await backplane.stop()
+    
+    def _sync_backplane_interest(self):
+        if self.backplane is not None:
+            self.backplane.set_local_interest(self.subscription_index.event_types())
+    
+    async def _deliver_event(self, event: Event):
+        """Forward an event to interested nodes, then deliver it locally"""
+        if self.backplane is not None:
+            node_ids = self.backplane.interested_nodes(event.type)
+            node_ids.discard(self.node_id)
+            if node_ids:
+                await self.backplane.publish(node_ids, event)
+        
+        await self._deliver_local(event)
+    
+    async def _deliver_local(self, event: Event):
+        """Deliver an event to every subscribed connection on this node"""
         # Update broadcast statistics
         self.broadcast_stats["total_events_broadcasted"] += 1
         event_type_str = event.type.value
         self.broadcast_stats["events_by_type"][event_type_str] = \
             self.broadcast_stats["events_by_type"].get(event_type_str, 0) + 1
         
-        # Collect all connections that might be interested
-        all_connections = []
-        for connection_type in ConnectionType:
-            all_connections.extend(self.connections[connection_type].values())
-        
-        # Filter connections that should receive this event
+        # Only connections indexed for this event type / exam / user are considered
         target_connections = []
-        for connection in all_connections:
-            if connection.is_active and connection.should_receive_event(event):
+        for connection_id in self.subscription_index.candidates(event):
+            connection = self.connections_by_id.get(connection_id)
+            if connection and connection.is_active and connection.should_receive_event(event):
                 target_connections.append(connection)
         
         if not target_connections:
             logger.debug(f"No connections subscribed to event {event.type}")
             return
         
-        # Send event to all target connections
-        tasks = []
-        for connection in target_connections:
-            task = connection.send_event(event)
-            tasks.append(task)
-        
+        # Encode once and queue the shared payload on every target connection
         try:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            failed_count = sum(1 for result in results if isinstance(result, Exception) or not result)
-            
-            if failed_count > 0:
-                self.broadcast_stats["failed_broadcasts"] += failed_count
-                logger.warning(f"Failed to broadcast event {event.type} to {failed_count}/{len(tasks)} connections")
-            else:
-                logger.debug(f"Successfully broadcasted event {event.type} to {len(tasks)} connections")
-                
+            payload = encode_event(event)
         except Exception as e:
-            self.broadcast_stats["failed_broadcasts"] += len(tasks)
-            logger.error(f"Error broadcasting event {event.type}: {str(e)}")
+            self.broadcast_stats["failed_broadcasts"] += len(target_connections)
+            logger.error(f"Error encoding event {event.type}: {str(e)}")
+            return
+        
+        failed_count = self._fan_out(target_connections, payload,
+                                     self.progress_coalescer.coalesce_key(event))
+        if failed_count > 0:
+            self.broadcast_stats["failed_broadcasts"] += failed_count
+            logger.warning(f"Failed to broadcast event {event.type} to {failed_count}/{len(target_connections)} connections")
+        else:
+            logger.debug(f"Successfully queued event {event.type} for {len(target_connections)} connections")
     
     async def subscribe_connection_to_events(self, connection_id: str, event_types: List[EventType], 
                                            filters: Optional[Dict[EventType, Callable]] = None):
@@ -506,11 +935,10 @@ class WebSocketManager:
                 EventType.GRADING_REVIEWED
             ]
             
-            # Add exam-specific filter
+            # Add exam-specific scope
             if connection.exam_id:
-                exam_filter = lambda event: event.data.get('exam_id') == connection.exam_id
                 for event_type in default_events:
-                    connection.subscribe_to_event(event_type, exam_filter)
+                    connection.subscribe_to_event(event_type, exam_id=connection.exam_id)
                 return
         elif connection.connection_type == ConnectionType.SYSTEM_MONITOR:
             # System monitor should receive system events
@@ -542,20 +970,12 @@ class WebSocketManager:
             "timestamp": datetime.utcnow().isoformat()
         }
         
-        connection_ids = list(self.user_connections[user_id])
-        tasks = []
-        
-        for connection_id in connection_ids:
-            connection = self._find_connection(connection_id)
-            if connection and connection.is_active:
-                task = connection._send_raw_message(notification_message)
-                tasks.append(task)
-        
-        if tasks:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            return any(result for result in results if not isinstance(result, Exception))
+        connections = self._active_connections(list(self.user_connections[user_id]))
+        if not connections:
+            return False
         
-        return False
+        payload = json.dumps(notification_message, default=str)
+        return self._fan_out(connections, payload) < len(connections)
     
     async def broadcast_system_message(self, message: Dict[str, Any]):
         """Broadcast system message to all connections"""
@@ -565,18 +985,9 @@ class WebSocketManager:
             "timestamp": datetime.utcnow().isoformat()
         }
         
-        all_connections = []
-        for connection_type in ConnectionType:
-            all_connections.extend(self.connections[connection_type].values())
-        
-        tasks = []
-        for connection in all_connections:
-            if connection.is_active:
-                task = connection._send_raw_message(system_message)
-                tasks.append(task)
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        connections = self._active_connections(list(self.connections_by_id))
+        if connections:
+            self._fan_out(connections, json.dumps(system_message, default=str))
     
     async def broadcast_system_notification(self, notification: Dict[str, Any]):
         """Broadcast system notification to all connections"""
@@ -586,18 +997,9 @@ class WebSocketManager:
             "timestamp": datetime.utcnow().isoformat()
         }
         
-        all_connections = []
-        for connection_type in ConnectionType:
-            all_connections.extend(self.connections[connection_type].values())
-        
-        tasks = []
-        for connection in all_connections:
-            if connection.is_active:
-                task = connection._send_raw_message(notification_message)
-                tasks.append(task)
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        connections = self._active_connections(list(self.connections_by_id))
+        if connections:
+            self._fan_out(connections, json.dumps(notification_message, default=str))
     
     def get_connection_stats(self) -> Dict[str, Any]:
         """获取连接统计信息 including event broadcasting stats"""
@@ -625,39 +1027,79 @@ class WebSocketManager:
             subscription_stats[connection_type.value] = type_subscriptions
         
         stats["event_subscriptions"] = subscription_stats
+        stats["outbound_queues"] = self.get_outbound_queue_stats()
+        stats["progress_coalescing"] = self.progress_coalescer.get_stats()
+        stats["backplane"] = self.backplane.get_stats() if self.backplane else None
         
         return stats
     
-    async def _start_heartbeat_checker(self):
-        """启动心跳检查器"""
+    def get_outbound_queue_stats(self) -> Dict[str, Any]:
+        """Outbound queue depth and slow-consumer statistics"""
+        depths = [connection.queue_depth for connection in self.connections_by_id.values()]
+        dropped = self.closed_queue_stats["dropped"]
+        coalesced = self.closed_queue_stats["coalesced"]
+        for connection in self.connections_by_id.values():
+            dropped += connection.queue_stats["dropped"]
+            coalesced += connection.queue_stats["coalesced"]
+        
+        return {
+            "policy": self.slow_consumer_policy.value,
+            "max_queue_size": self.outbound_queue_size,
+            "total_depth": sum(depths),
+            "max_depth": max(depths) if depths else 0,
+            "backlogged_connections": sum(1 for depth in depths if depth > 0),
+            "dropped_messages": dropped,
+            "coalesced_messages": coalesced,
+            "slow_consumer_disconnects": self.closed_queue_stats["slow_consumer_disconnects"]
+        }
+    
+    def _start_heartbeat_checker(self):
+        """启动心跳检查器（无运行中的事件循环时推迟到首个连接建立）"""
         if self.heartbeat_task and not self.heartbeat_task.done():
             return
         
-        self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.heartbeat_task = loop.create_task(self._heartbeat_loop())
     
     async def _heartbeat_loop(self):
         """心跳检查循环"""
         while True:
             try:
-                await asyncio.sleep(30)  # 每30秒检查一次
+                await asyncio.sleep(self.heartbeat_wheel.tick)
                 await self._check_connections()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Error in heartbeat loop: {e}")
     
     async def _check_connections(self):
-        """检查连接状态并清理死连接"""
+        """向到期连接批量发送心跳，并清理死连接和空闲连接"""
+        due = self.heartbeat_wheel.advance()
+        if not due:
+            return
+        
+        now = time.monotonic()
+        payload = encode_message(MessageType.HEARTBEAT.value)
         dead_connections = []
         
-        for connection_type in ConnectionType:
-            for connection_id, connection in self.connections[connection_type].items():
-                try:
-                    # 发送心跳消息
-                    if connection.is_active:
-                        success = await connection.send_message(MessageType.HEARTBEAT)
-                        if not success:
-                            dead_connections.append(connection_id)
-                except Exception:
-                    dead_connections.append(connection_id)
+        for connection_id in due:
+            connection = self.connections_by_id.get(connection_id)
+            if connection is None:
+                continue
+            if not connection.is_active:
+                dead_connections.append(connection_id)
+                continue
+            if self.idle_timeout is not None and now - connection.last_activity > self.idle_timeout:
+                logger.info(f"Closing idle connection {connection_id}")
+                dead_connections.append(connection_id)
+                continue
+            if not connection.enqueue(payload):
+                dead_connections.append(connection_id)
+                continue
+            self.heartbeat_wheel.schedule(connection_id, now + self.heartbeat_interval)
         
         # 清理死连接
         for connection_id in dead_connections:
@@ -669,6 +1111,10 @@ class WebSocketManager:
         if self.heartbeat_task and not self.heartbeat_task.done():
             self.heartbeat_task.cancel()
         
+        # 投递尚在合并窗口内的进度事件
+        await self.progress_coalescer.flush_all()
+        await self.stop_backplane()
+        
         # 关闭所有连接
         all_connections = []
         for connection_type in ConnectionType:
@@ -681,4 +1127,9 @@ class WebSocketManager:
 
 
 # 全局WebSocket管理器实例
-websocket_manager = WebSocketManager()
\ No newline at end of file
+websocket_manager = WebSocketManager()
+
+# 发送队列深度指标接入性能监控
+performance_monitor.register_queue_stats_provider(
+    "websocket_outbound", websocket_manager.get_outbound_queue_stats
+)
\ No newline at end of file
@@ -4,9 +4,11 @@ WebSocket性能优化模块
 """
 
 import asyncio
+import bisect
+import heapq
 import logging
 import time
-from typing import Dict, List, Optional, Any, Callable
+from typing import Dict, Hashable, List, Optional, Any, Callable, Set
 from datetime import datetime, timedelta
 from collections import defaultdict, deque
 from dataclasses import dataclass
@@ -28,15 +30,121 @@ class PerformanceMetrics:
     connection_errors: int = 0
     last_updated: datetime = None
 
-class MessageQueue:
-    """高性能消息队列"""
+class LatencyHistogram:
+    """对数分桶延迟直方图（秒），用于估算 p50/p95/p99"""
+    
+    # 0.5ms ~ 60s，相邻桶边界相差约 25%
+    BUCKETS = [0.0005 * (1.25 ** i) for i in range(53)]
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, value: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+    
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+    
+    def percentile(self, p: float) -> float:
+        """返回第 p 百分位所在桶的上界（不超过最大观测值）"""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(self.BUCKETS[index], self.max) if index < len(self.BUCKETS) else self.max
+        return self.max
+    
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max
+        }
+
+class PriorityMessageHeap:
+    """最小堆消息队列：优先级数值越小越先出队，同优先级按入队顺序"""
     
     def __init__(self, max_size: int = 10000):
-        self.queue = asyncio.Queue(maxsize=max_size)
+        self.max_size = max_size
+        self._heap: List[tuple] = []
+        self._sequence = 0
+        self._not_empty = asyncio.Event()
+    
+    def qsize(self) -> int:
+        return len(self._heap)
+    
+    def empty(self) -> bool:
+        return not self._heap
+    
+    def push(self, priority: int, message: Dict[str, Any]):
+        heapq.heappush(self._heap, (priority, self._sequence, message))
+        self._sequence += 1
+        self._not_empty.set()
+    
+    def pop_batch(self, max_items: int) -> List[Dict[str, Any]]:
+        batch = []
+        while self._heap and len(batch) < max_items:
+            batch.append(heapq.heappop(self._heap)[2])
+        if not self._heap:
+            self._not_empty.clear()
+        return batch
+    
+    async def wait(self):
+        await self._not_empty.wait()
+
+class MessageQueue:
+    """高性能消息队列
+    
+    基于堆的优先级队列，每次唤醒批量取出 batch_size 条消息并发分发。
+    每种消息类型有独立的并发上限，达到上限的类型消息暂存在该类型的
+    等待队列中，不会阻塞其他类型（如高优先级告警）。
+    """
+    
+    def __init__(self, max_size: int = 10000, batch_size: int = 64,
+                 default_concurrency: int = 8,
+                 concurrency_limits: Optional[Dict[str, int]] = None):
+        self.max_size = max_size
+        self.queue = PriorityMessageHeap(max_size)
+        self.batch_size = batch_size
+        self.default_concurrency = default_concurrency
+        self.concurrency_limits: Dict[str, int] = dict(concurrency_limits or {})
         self.processing_task: Optional[asyncio.Task] = None
         self.handlers: Dict[str, Callable] = {}
         self.metrics = PerformanceMetrics()
         
+        # 分发状态
+        self._active: Dict[str, int] = defaultdict(int)
+        self._deferred: Dict[str, deque] = defaultdict(deque)
+        self._deferred_count = 0
+        self._handler_tasks: Set[asyncio.Task] = set()
+        
+        # 延迟统计：端到端（入队到处理完成）和处理耗时
+        self.latency = LatencyHistogram()
+        self.latency_by_type: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.processing_time = LatencyHistogram()
+        
+    def set_concurrency_limit(self, message_type: str, limit: int):
+        """设置某类消息的并发处理上限"""
+        self.concurrency_limits[message_type] = limit
+    
+    def pending_count(self) -> int:
+        """排队中（含因并发上限暂存）的消息数"""
+        return self.queue.qsize() + self._deferred_count
+    
     async def start_processing(self):
         """启动消息处理"""
         if self.processing_task and not self.processing_task.done():
@@ -53,6 +161,10 @@ class MessageQueue:
                 await self.processing_task
             except asyncio.CancelledError:
                 pass
+        for task in list(self._handler_tasks):
+            task.cancel()
+        if self._handler_tasks:
+            await asyncio.gather(*self._handler_tasks, return_exceptions=True)
         logger.info("Message queue processing stopped")
     
     async def enqueue(self, message_type: str, data: Any, priority: int = 0):
@@ -64,20 +176,21 @@ class MessageQueue:
             data: 消息数据
             priority: 优先级(0=最高)
         """
-        try:
-            message = {
-                "type": message_type,
-                "data": data,
-                "priority": priority,
-                "timestamp": datetime.utcnow(),
-                "id": f"{int(time.time() * 1000000)}"
-            }
-            
-            await self.queue.put(message)
-            
-        except asyncio.QueueFull:
+        if self.pending_count() >= self.max_size:
             logger.warning(f"Message queue full, dropping message: {message_type}")
             self.metrics.messages_failed += 1
+            return False
+        
+        message = {
+            "type": message_type,
+            "data": data,
+            "priority": priority,
+            "timestamp": datetime.utcnow(),
+            "enqueued_at": time.monotonic(),
+            "id": f"{int(time.time() * 1000000)}"
+        }
+        self.queue.push(priority, message)
+        return True
     
     def register_handler(self, message_type: str, handler: Callable):
         """注册消息处理器"""
@@ -85,54 +198,159 @@ class MessageQueue:
         logger.info(f"Registered handler for message type: {message_type}")
     
     async def _process_messages(self):
-        """处理消息队列"""
+        """处理消息队列：每次唤醒批量出队并分发"""
         while True:
             try:
-                # 获取消息
-                message = await self.queue.get()
-                
-                # 查找处理器
-                handler = self.handlers.get(message["type"])
-                if not handler:
-                    logger.warning(f"No handler for message type: {message['type']}")
-                    continue
-                
-                # 执行处理器
-                start_time = time.time()
-                try:
-                    await handler(message)
-                    self.metrics.messages_sent += 1
-                except Exception as e:
-                    logger.error(f"Handler failed for {message['type']}: {e}")
-                    self.metrics.messages_failed += 1
-                finally:
-                    # 更新性能指标
-                    processing_time = time.time() - start_time
-                    self._update_response_time(processing_time)
-                
-                # 标记任务完成
-                self.queue.task_done()
+                await self.queue.wait()
+                for message in self.queue.pop_batch(self.batch_size):
+                    self._dispatch(message)
+                # 让出事件循环，使处理器任务得以运行
+                await asyncio.sleep(0)
                 
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Error in message processing: {e}")
     
-    def _update_response_time(self, processing_time: float):
-        """更新平均响应时间"""
-        if self.metrics.avg_response_time == 0:
-            self.metrics.avg_response_time = processing_time
-        else:
-            # 指数移动平均
-            self.metrics.avg_response_time = (
-                0.9 * self.metrics.avg_response_time + 
-                0.1 * processing_time
-            )
+    def _dispatch(self, message: Dict[str, Any]):
+        message_type = message["type"]
+        if message_type not in self.handlers:
+            logger.warning(f"No handler for message type: {message_type}")
+            return
+        
+        limit = self.concurrency_limits.get(message_type, self.default_concurrency)
+        if self._active[message_type] >= limit:
+            self._deferred[message_type].append(message)
+            self._deferred_count += 1
+            return
+        
+        self._active[message_type] += 1
+        task = asyncio.create_task(self._run_handler(message))
+        self._handler_tasks.add(task)
+        task.add_done_callback(self._handler_tasks.discard)
+    
+    async def _run_handler(self, message: Dict[str, Any]):
+        message_type = message["type"]
+        start_time = time.monotonic()
+        try:
+            await self.handlers[message_type](message)
+            self.metrics.messages_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Handler failed for {message_type}: {e}")
+            self.metrics.messages_failed += 1
+        finally:
+            # 更新性能指标
+            finished_at = time.monotonic()
+            self.processing_time.record(finished_at - start_time)
+            self.metrics.avg_response_time = self.processing_time.mean
+            end_to_end = finished_at - message["enqueued_at"]
+            self.latency.record(end_to_end)
+            self.latency_by_type[message_type].record(end_to_end)
+            
+            self._active[message_type] -= 1
+            deferred = self._deferred.get(message_type)
+            if deferred and self.processing_task is not None and not self.processing_task.done():
+                self._deferred_count -= 1
+                self._dispatch(deferred.popleft())
+    
+    def get_latency_stats(self) -> Dict[str, Any]:
+        """端到端延迟和处理耗时的 p50/p95/p99"""
+        return {
+            "end_to_end": self.latency.summary(),
+            "processing": self.processing_time.summary(),
+            "by_type": {
+                message_type: histogram.summary()
+                for message_type, histogram in self.latency_by_type.items()
+            },
+            "in_flight": {t: n for t, n in self._active.items() if n},
+            "deferred": self._deferred_count
+        }
+
+class TimingWheel:
+    """哈希时间轮 - 按截止时间触发的定时器集合
+    
+    touch() 只更新截止时间（O(1)），不移动槽位；槽位到期时再核对
+    真实截止时间，未到期的重新挂到对应槽位。advance() 只访问已经
+    走过的槽位，开销与到期数量相关，而与总连接数无关。
+    """
+    
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._deadlines: Dict[Hashable, float] = {}
+        self._scheduled_tick: Dict[Hashable, int] = {}
+        self._current_tick = self._tick_of(time.monotonic())
+    
+    def __len__(self) -> int:
+        return len(self._deadlines)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+    
+    def _tick_of(self, timestamp: float) -> int:
+        return int(timestamp // self.tick)
+    
+    def _place(self, key: Hashable, deadline: float):
+        tick = max(self._tick_of(deadline), self._current_tick + 1)
+        self._scheduled_tick[key] = tick
+        self.slots[tick % len(self.slots)].add(key)
+    
+    def schedule(self, key: Hashable, deadline: float):
+        """设置（或更新）截止时间"""
+        scheduled = self._scheduled_tick.get(key)
+        self._deadlines[key] = deadline
+        if scheduled is None:
+            self._place(key, deadline)
+        elif self._tick_of(deadline) < scheduled:
+            # 截止时间提前：移到更早的槽位
+            self.slots[scheduled % len(self.slots)].discard(key)
+            self._place(key, deadline)
+    
+    touch = schedule
+    
+    def cancel(self, key: Hashable):
+        self._deadlines.pop(key, None)
+        scheduled = self._scheduled_tick.pop(key, None)
+        if scheduled is not None:
+            self.slots[scheduled % len(self.slots)].discard(key)
+    
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """推进到当前时间，返回已到期（并移出时间轮）的键"""
+        now = time.monotonic() if now is None else now
+        target_tick = self._tick_of(now)
+        if target_tick <= self._current_tick:
+            return []
+        
+        # 落后超过一圈时每个槽位只需访问一次
+        first_tick = max(self._current_tick + 1, target_tick - len(self.slots) + 1)
+        self._current_tick = target_tick
+        
+        expired = []
+        for tick in range(first_tick, target_tick + 1):
+            index = tick % len(self.slots)
+            bucket = self.slots[index]
+            if not bucket:
+                continue
+            self.slots[index] = set()
+            for key in bucket:
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    continue
+                if deadline <= now:
+                    del self._deadlines[key]
+                    del self._scheduled_tick[key]
+                    expired.append(key)
+                else:
+                    self._place(key, deadline)
+        return expired
+
 
 class ConnectionPool:
     """WebSocket连接池管理"""
     
-    def __init__(self, max_connections: int = 10000):
+    def __init__(self, max_connections: int = 10000, stale_timeout_minutes: int = 30):
         self.max_connections = max_connections
         self.connections: Dict[str, Any] = {}
         self.connection_stats: Dict[str, Dict] = defaultdict(dict)
@@ -142,6 +360,13 @@ class ConnectionPool:
         self.response_times = deque(maxlen=1000)  # 保存最近1000次响应时间
         self.error_counts = defaultdict(int)
         
+        # 空闲检测：按最后活动时间 + 超时挂到时间轮上
+        self.stale_timeout_minutes = stale_timeout_minutes
+        self.idle_wheel = TimingWheel(tick=5.0, slots=512)
+    
+    def _idle_deadline(self) -> float:
+        return time.monotonic() + self.stale_timeout_minutes * 60
+        
     def add_connection(self, connection_id: str, connection: Any) -> bool:
         """
         添加连接到池中
@@ -166,6 +391,7 @@ class ConnectionPool:
             "bytes_received": 0,
             "last_activity": datetime.utcnow()
         }
+        self.idle_wheel.schedule(connection_id, self._idle_deadline())
         
         # 更新指标
         self.metrics.total_connections += 1
@@ -188,6 +414,7 @@ class ConnectionPool:
         """
         if connection_id in self.connections:
             del self.connections[connection_id]
+            self.idle_wheel.cancel(connection_id)
             
             # 更新指标
             if connection_id in self.connection_stats:
@@ -216,6 +443,7 @@ class ConnectionPool:
         if connection_id in self.connection_stats:
             stats = self.connection_stats[connection_id]
             stats["last_activity"] = datetime.utcnow()
+            self.idle_wheel.touch(connection_id, self._idle_deadline())
             
             if bytes_sent > 0:
                 stats["messages_sent"] += 1
@@ -225,14 +453,23 @@ class ConnectionPool:
                 stats["messages_received"] += 1
                 stats["bytes_received"] += bytes_received
     
-    def cleanup_stale_connections(self, timeout_minutes: int = 30):
-        """清理过期连接"""
-        cutoff_time = datetime.utcnow() - timedelta(minutes=timeout_minutes)
-        stale_connections = []
+    def cleanup_stale_connections(self, timeout_minutes: Optional[int] = None):
+        """清理过期连接
         
-        for conn_id, stats in self.connection_stats.items():
-            if stats["last_activity"] < cutoff_time:
-                stale_connections.append(conn_id)
+        使用池的超时时间时只处理时间轮上已到期的连接；指定其他
+        超时时间时退化为全量扫描。
+        """
+        if timeout_minutes is None or timeout_minutes == self.stale_timeout_minutes:
+            stale_connections = [
+                conn_id for conn_id in self.idle_wheel.advance()
+                if conn_id in self.connections
+            ]
+        else:
+            cutoff_time = datetime.utcnow() - timedelta(minutes=timeout_minutes)
+            stale_connections = [
+                conn_id for conn_id, stats in self.connection_stats.items()
+                if stats["last_activity"] < cutoff_time
+            ]
         
         for conn_id in stale_connections:
             self.remove_connection(conn_id)
@@ -280,6 +517,22 @@ class PerformanceMonitor:
         self.sample_interval = sample_interval
         self.monitoring_task: Optional[asyncio.Task] = None
         self.metrics_history = deque(maxlen=720)  # 保存6小时的数据(30s间隔)
+        self.queue_stats_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self.queue_depth_warning = 500
+    
+    def register_queue_stats_provider(self, name: str, provider: Callable[[], Dict[str, Any]]):
+        """注册发送队列指标提供者（如WebSocketManager的每连接发送队列）"""
+        self.queue_stats_providers[name] = provider
+    
+    def collect_queue_stats(self) -> Dict[str, Any]:
+        """收集所有已注册的发送队列指标"""
+        stats = {}
+        for name, provider in self.queue_stats_providers.items():
+            try:
+                stats[name] = provider()
+            except Exception as e:
+                logger.error(f"Queue stats provider {name} failed: {e}")
+        return stats
         
     async def start_monitoring(self, connection_pool: ConnectionPool, message_queue: MessageQueue):
         """启动性能监控"""
@@ -315,8 +568,10 @@ class PerformanceMonitor:
                         "queue_size": message_queue.queue.qsize(),
                         "messages_sent": message_queue.metrics.messages_sent,
                         "messages_failed": message_queue.metrics.messages_failed,
-                        "avg_response_time": message_queue.metrics.avg_response_time
-                    }
+                        "avg_response_time": message_queue.metrics.avg_response_time,
+                        "latency": message_queue.get_latency_stats()
+                    },
+                    "outbound_queues": self.collect_queue_stats()
                 }
                 
                 # 保存到历史记录
@@ -344,8 +599,15 @@ class PerformanceMonitor:
             logger.warning(f"Large message queue size: {queue_stats['queue_size']}")
         
         # 检查响应时间
-        if queue_stats["avg_response_time"] > 1.0:
-            logger.warning(f"High average response time: {queue_stats['avg_response_time']:.3f}s")
+        p99 = queue_stats.get("latency", {}).get("end_to_end", {}).get("p99", 0.0)
+        if p99 > 1.0:
+            logger.warning(f"High p99 message latency: {p99:.3f}s")
+        
+        # 检查连接发送队列积压
+        for name, outbound in metrics.get("outbound_queues", {}).items():
+            if outbound.get("max_depth", 0) > self.queue_depth_warning:
+                logger.warning(f"Outbound queue backlog in {name}: max depth {outbound['max_depth']}, "
+                               f"{outbound.get('backlogged_connections', 0)} backlogged connections")
         
         # 检查错误率
         total_messages = queue_stats["messages_sent"] + queue_stats["messages_failed"]
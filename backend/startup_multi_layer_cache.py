@@ -18,9 +18,17 @@ sys.path.append(str(Path(__file__).parent))
 from services.cache_manager import CacheManager
 from services.distributed_cache import DistributedCache, CacheConfig
 from services.edge_cache import EdgeCache, CDNConfig, CDNProvider
-from services.cache_consistency import CacheSystemManager, ConsistencyLevel
+from services.cache_consistency import (
+    CacheSystemManager,
+    ConsistencyLevel,
+    DEFAULT_INVALIDATION_PATTERNS,
+    DistributedCacheTarget,
+    L1CacheTarget,
+    QueryCacheTarget,
+)
+from db_connection import SessionLocal
 from database.enhanced_connection_manager import EnhancedConnectionManager, DatabaseRole
-from database.query_optimizer import QueryOptimizer
+from database.query_optimizer import QueryOptimizer, get_query_optimizer
 
 # 配置日志
 logging.basicConfig(
@@ -90,12 +98,13 @@ class MultiLayerCacheDemo:
                 'l2_cache': ['l3_cache'],
                 'database': ['l1_cache', 'l2_cache']
             },
-            'invalidation_patterns': {
-                'users': ['user:*', 'profile:*', 'session:*'],
-                'exams': ['exam:*', 'question:*'],
-                'grading': ['grading:*', 'score:*', 'feedback:*'],
-                'files': ['file:*', 'image:*', 'document:*']
-            }
+            'invalidation_patterns': DEFAULT_INVALIDATION_PATTERNS,
+            # 提交驱动的失效：ORM 提交后按表/标签失效 L1 和 L2
+            'session_factory': SessionLocal,
+            'invalidation_targets': [
+                L1CacheTarget(self.l1_cache),
+                DistributedCacheTarget(self.l2_cache)
+            ]
         }
         
         await self.cache_system_manager.initialize(cache_config)
@@ -124,7 +133,11 @@ class MultiLayerCacheDemo:
             'cache_size': 1000,
             'cache_ttl': 300
         }
-        # self.query_optimizer = create_query_optimizer(optimizer_config)
+        self.query_optimizer = get_query_optimizer()
+        if self.query_optimizer.cache is not None:
+            self.cache_system_manager.consistency_manager.register_invalidation_target(
+                QueryCacheTarget(self.query_optimizer.cache)
+            )
         
         print("✅ Multi-Layer Cache Architecture Initialized!")
         
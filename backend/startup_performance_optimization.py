@@ -15,6 +15,7 @@ from pathlib import Path
 # 添加项目路径
 sys.path.append(str(Path(__file__).parent))
 
+from config.settings import settings
 from services.service_mesh import ServiceRegistry, ServiceInstance, ServiceDefinition, LoadBalancingStrategy, ServiceMeshClient
 from services.async_pipeline import PipelineOrchestrator, TaskDefinition, TaskPriority, PreprocessingProcessor, OCRProcessor, GradingProcessor
 from services.fault_tolerance import FaultToleranceManager, CircuitBreakerConfig, RetryConfig, fault_tolerant
@@ -89,7 +90,7 @@ class PerformanceOptimizationDemo:
             
         # 2. 初始化异步处理管道
         print("⚙️ Setting up Async Processing Pipeline...")
-        self.pipeline_orchestrator = PipelineOrchestrator()
+        self.pipeline_orchestrator = PipelineOrchestrator(spill_dir=settings.RESULT_SPILL_DIR)
         
         # 注册处理器
         self.pipeline_orchestrator.register_processor(PreprocessingProcessor())
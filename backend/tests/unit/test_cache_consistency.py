@@ -0,0 +1,122 @@
+"""
+提交驱动缓存失效测试：ORM 提交后按标签失效真实缓存条目
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.query_optimizer import QueryCache
+from models.production_models import Base, Exam
+from services.cache_consistency import (
+    CacheConsistencyManager,
+    CacheSystemManager,
+    DEFAULT_INVALIDATION_PATTERNS,
+    L1CacheTarget,
+    QueryCacheTarget,
+)
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def make_exam(exam_id: str) -> Exam:
+    return Exam(id=exam_id, name="期中考试", subject="数学", grade="高一", created_by="test_user_001")
+
+
+def run_with_invalidation(session_factory, scenario):
+    """挂载提交钩子（L1 + 查询缓存）后执行测试场景"""
+    async def main():
+        # cache_manager 导入时会创建后台清理任务，需在事件循环中导入
+        from services.cache_manager import cache_manager
+
+        query_cache = QueryCache()
+        system = CacheSystemManager()
+        await system.initialize({
+            'invalidation_patterns': DEFAULT_INVALIDATION_PATTERNS,
+            'invalidation_targets': [L1CacheTarget(cache_manager), QueryCacheTarget(query_cache)],
+            'session_factory': session_factory
+        })
+        cache_manager.clear_all()
+        try:
+            await scenario(system.consistency_manager, cache_manager, query_cache)
+        finally:
+            cache_manager.clear_all()
+            await system.shutdown()
+
+    asyncio.run(main())
+
+
+def test_commit_evicts_tagged_l1_entry(session_factory):
+    async def scenario(manager, l1, query_cache):
+        from services.cache_manager import cache_warm_exam_data
+
+        cache_warm_exam_data("exam-1", {"name": "期中考试"})
+        cache_warm_exam_data("exam-2", {"name": "期末考试"})
+
+        with session_factory() as session:
+            session.add(make_exam("exam-1"))
+            session.commit()
+        await manager.flush()
+
+        assert l1.get("exam", "exam-1") is None
+        assert l1.get("exam", "exam-2") == {"name": "期末考试"}
+
+    run_with_invalidation(session_factory, scenario)
+
+
+def test_commit_from_worker_thread_is_delivered_to_manager_loop(session_factory):
+    async def scenario(manager, l1, query_cache):
+        from services.cache_manager import cache_warm_exam_data
+
+        cache_warm_exam_data("exam-1", {"name": "期中考试"})
+        query_cache.set("exams:all", [{"id": "exam-1"}], tables=["exams"])
+
+        def commit():
+            with session_factory() as session:
+                session.add(make_exam("exam-1"))
+                session.commit()
+
+        # 同步端点在线程池中提交
+        await asyncio.to_thread(commit)
+        await manager.flush()
+
+        assert l1.get("exam", "exam-1") is None
+        assert query_cache.get("exams:all") is None
+
+    run_with_invalidation(session_factory, scenario)
+
+
+def test_rollback_keeps_cached_entries(session_factory):
+    async def scenario(manager, l1, query_cache):
+        from services.cache_manager import cache_warm_exam_data
+
+        cache_warm_exam_data("exam-1", {"name": "期中考试"})
+
+        with session_factory() as session:
+            session.add(make_exam("exam-1"))
+            session.flush()
+            session.rollback()
+        await manager.flush()
+
+        assert l1.get("exam", "exam-1") == {"name": "期中考试"}
+
+    run_with_invalidation(session_factory, scenario)
+
+
+def test_wildcard_patterns_rejected():
+    manager = CacheConsistencyManager()
+    with pytest.raises(ValueError):
+        manager.register_invalidation_pattern("exams", ["exam:*"])
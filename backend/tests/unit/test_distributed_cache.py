@@ -0,0 +1,79 @@
+"""
+RedisDistributedCache 标签失效测试（fakeredis）
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("aioredis")
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis 执行 Lua 脚本需要 lupa
+
+
+def run_with_cache(scenario, **config):
+    """在事件循环中构造连接 fakeredis 的缓存并执行测试场景
+
+    cache_manager 导入时会创建后台清理任务，因此导入也放在事件循环内。
+    """
+    async def main():
+        from services.cache_manager import cache_manager
+        from services.distributed_cache import CacheConfig, RedisDistributedCache
+
+        cache = RedisDistributedCache(CacheConfig(**config))
+        cache.redis_client = fakeredis.aioredis.FakeRedis()
+        cache_manager.clear_all()
+        try:
+            await scenario(cache, cache_manager)
+        finally:
+            cache_manager.clear_all()
+            await cache.redis_client.aclose()
+
+    asyncio.run(main())
+
+
+def test_invalidate_by_tags_unlinks_members_and_tag_sets():
+    async def scenario(cache, l1):
+        for exam_id in ("e1", "e2", "e3"):
+            await cache.set("exam", exam_id, {"id": exam_id}, tags=["exam_list", f"exam_{exam_id}"])
+        await cache.set("exam", "other", {"id": "other"}, tags=["exam_other"])
+
+        invalidated = await cache.invalidate_by_tags(["exam_list"], include_l1=False)
+
+        assert invalidated == 3
+        redis = cache.redis_client
+        for exam_id in ("e1", "e2", "e3"):
+            assert not await redis.exists(cache._generate_key("exam", exam_id))
+        assert not await redis.exists(cache._tag_key("exam_list"))
+        assert await redis.exists(cache._generate_key("exam", "other"))
+        assert await redis.exists(cache._tag_key("exam_other"))
+
+    # 分块小于成员数，覆盖脚本内分批 UNLINK
+    run_with_cache(scenario, pipeline_chunk_size=2)
+
+
+def test_invalidate_by_tags_shared_members_counted_once():
+    async def scenario(cache, l1):
+        await cache.set("grading", "e1:s1", {"score": 1}, tags=["exam_e1", "student_s1"])
+
+        invalidated = await cache.invalidate_by_tags(["exam_e1", "student_s1"], include_l1=False)
+
+        assert invalidated == 1
+        assert not await cache.redis_client.exists(cache._tag_key("student_s1"))
+
+    run_with_cache(scenario)
+
+
+def test_invalidate_by_tags_l1_optional():
+    async def scenario(cache, l1):
+        await cache.set("exam", "e1", {"id": "e1"}, tags=["exam_e1"])
+        await cache.set("exam", "e2", {"id": "e2"}, tags=["exam_e2"])
+
+        await cache.invalidate_by_tags(["exam_e1"], include_l1=False)
+        assert l1.get("exam", "e1") == {"id": "e1"}
+
+        await cache.invalidate_by_tags(["exam_e2"])
+        assert l1.get("exam", "e2") is None
+        assert not await cache.redis_client.exists(cache._generate_key("exam", "e2"))
+
+    run_with_cache(scenario)